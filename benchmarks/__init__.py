@@ -0,0 +1,3 @@
+"""
+Benchmarks of the function saver: python -m benchmarks --help (from the root of the repository).
+"""
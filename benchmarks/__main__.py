@@ -0,0 +1,50 @@
+"""
+Run the benchmarks, from the root of the repository:
+    python -m benchmarks [--quick] [--only decorator serializers replay] [--output results.json]
+
+The results are compared to the baseline, benchmarks/baseline.json if it exists (--baseline to give another one):
+a benchmark slower than the baseline by more than the tolerance (default 25%) is a regression, and the exit code is 1.
+--save-baseline writes the results as the new baseline. The times depend on the machine: compare runs of the same one.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from . import bench_decorator, bench_replay, bench_serializers
+from .harness import compare, format_results, save_results
+
+BENCHMARKS = {"decorator": bench_decorator, "serializers": bench_serializers, "replay": bench_replay}
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+
+def main(arguments: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the function saver")
+    parser.add_argument("--quick", action="store_true", help="fewer repeats and smaller payloads")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--output", type=Path, help="write the results to this json file")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="the results to compare to")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="the slowdown tolerated, 0.25 for 25%%")
+    arguments = parser.parse_args(arguments)
+
+    results = []
+    for name in arguments.only:
+        print(f"Running the {name} benchmarks...", file=sys.stderr)
+        results += BENCHMARKS[name].run(arguments.quick)
+
+    comparisons = compare(results, arguments.baseline) if arguments.baseline.is_file() else []
+    print(format_results(results, comparisons, arguments.tolerance))
+    if arguments.output is not None:
+        save_results(results, arguments.output)
+    if arguments.save_baseline:
+        save_results(results, arguments.baseline)
+    regressions = [comparison for comparison in comparisons if comparison.ratio > 1 + arguments.tolerance]
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(c.name for c in regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+The overhead of the decorator: an undecorated function, then decorated with the saving disabled, enabled,
+and internals only, for sync and async functions, and called from several threads at once.
+"""
+
+import asyncio
+import tempfile
+import threading
+from typing import Callable
+
+from functionsaver import flush_background_writes, function_saver
+
+from .harness import Result, environment, measure, timing_settings
+
+THREADS = 8
+
+
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+@function_saver
+def add_saved(a: int, b: int) -> int:
+    return a + b
+
+
+@function_saver(save_in=False, save_out=False)
+def add_internals(a: int, b: int) -> int:
+    add_internals.save_internal(a - b, "difference")
+    return a + b
+
+
+async def add_async(a: int, b: int) -> int:
+    return a + b
+
+
+@function_saver
+async def add_async_saved(a: int, b: int) -> int:
+    return a + b
+
+
+def _calls(function: Callable, calls: int) -> Callable[[], None]:
+    def run():
+        for i in range(calls):
+            function(i, 1)
+
+    return run
+
+
+def _async_calls(function: Callable, calls: int) -> Callable[[], None]:
+    loop = asyncio.new_event_loop()
+
+    async def calls_():
+        for i in range(calls):
+            await function(i, 1)
+
+    return lambda: loop.run_until_complete(calls_())
+
+
+def _threads_calls(function: Callable, calls: int) -> Callable[[], None]:
+    def run():
+        threads = [threading.Thread(target=_calls(function, calls)) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return run
+
+
+def run(quick: bool = False) -> list[Result]:
+    settings = timing_settings(quick)
+    calls = 100 if quick else 1000
+    # the captures are written: fewer calls
+    captured_calls = 10 if quick else 50
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        disabled = {"FUNCTION_SAVER_ROOT_PATH": root, "FUNCTION_SAVER_ALL": "0", "FUNCTION_SAVER_INTERNALS_ALL": "0"}
+        enabled = {**disabled, "FUNCTION_SAVER_ALL": "1"}
+        internals = {**enabled, "FUNCTION_SAVER_INTERNALS_ALL": "1"}
+        for name, variables, function, calls_ in (
+            ("decorator/sync/undecorated", disabled, add, calls),
+            ("decorator/sync/disabled", disabled, add_saved, calls),
+            ("decorator/sync/enabled", enabled, add_saved, captured_calls),
+            ("decorator/sync/internals_only", internals, add_internals, captured_calls),
+        ):
+            with environment(variables):
+                results.append(measure(name, _calls(function, calls_), calls_, **settings))
+        for name, variables, function, calls_ in (
+            ("decorator/async/undecorated", disabled, add_async, calls),
+            ("decorator/async/disabled", disabled, add_async_saved, calls),
+            ("decorator/async/enabled", enabled, add_async_saved, captured_calls),
+        ):
+            with environment(variables):
+                results.append(measure(name, _async_calls(function, calls_), calls_, **settings))
+        for name, variables, calls_ in (
+            (f"decorator/threads_{THREADS}/disabled", disabled, calls),
+            (f"decorator/threads_{THREADS}/enabled", enabled, captured_calls),
+            (f"decorator/threads_{THREADS}/background", {**enabled, "FUNCTION_SAVER_BACKGROUND": "1"}, captured_calls),
+        ):
+            with environment(variables):
+                results.append(measure(name, _threads_calls(add_saved, calls_), THREADS * calls_, **settings))
+                flush_background_writes()
+    return results
@@ -0,0 +1,68 @@
+"""
+The speed of replay_function, replay_and_check_function and the pipelined replay_captures over a synthetic corpus
+of captures, saved in each storage format (folders, zip, segments).
+"""
+
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from functionsaver import (
+    function_saver,
+    list_segment_captures,
+    replay_and_check_function,
+    replay_captures,
+    replay_function,
+)
+
+from .harness import Result, environment, measure, timing_settings
+
+IMAGE_SHAPE = (256, 256)
+
+
+@function_saver
+def process(image: np.ndarray, gain: float, labels: list) -> np.ndarray:
+    return image * gain
+
+
+def _corpus(root: Path, storage: str, captures: int) -> list:
+    """Capture process, then return the capture ids"""
+    rng = np.random.default_rng(0)
+    variables = {"FUNCTION_SAVER_ROOT_PATH": str(root), "FUNCTION_SAVER_ALL": "1", "FUNCTION_SAVER_STORAGE": storage}
+    with environment(variables):
+        for i in range(captures):
+            process(rng.random(IMAGE_SHAPE, dtype=np.float32), float(i), [f"label {i}"] * 10)
+    if storage == "segment":
+        return list_segment_captures("process", root)
+    return sorted(path for path in root.iterdir() if path.name.startswith("process_"))
+
+
+def run(quick: bool = False) -> list[Result]:
+    settings = timing_settings(quick)
+    captures = 5 if quick else 20
+    payload = int(np.prod(IMAGE_SHAPE)) * 4
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        for storage in ("directory", "zip", "segment"):
+            capture_ids = _corpus(Path(root) / storage, storage, captures)
+
+            def replay_all():
+                for capture_id in capture_ids:
+                    replay_function(process, capture_id)
+
+            def replay_and_check_all():
+                for capture_id in capture_ids:
+                    replay_and_check_function(process, capture_id, compare_function=np.array_equal)
+
+            def replay_pipelined():
+                for _ in replay_captures(process, capture_ids, prefetch=2):
+                    pass
+
+            for name, replay in (
+                ("replay_function", replay_all),
+                ("replay_and_check_function", replay_and_check_all),
+                ("replay_captures", replay_pipelined),
+            ):
+                results.append(measure(f"replay/{storage}/{name}", replay, captures, payload, **settings))
+    return results
@@ -0,0 +1,84 @@
+"""
+The throughput of the serializers (_function_saver_serializers: npy, shuffle, png, numpy scalars,
+and the jsons fallback), to serialize and deserialize, for several payload sizes.
+"""
+
+import dataclasses
+
+import jsons
+import numpy as np
+
+from functionsaver.numpy_types import NumpyTypes
+from functionsaver.serializers import _default_serializer, _function_saver_deserializers, _function_saver_serializers
+
+from .harness import Result, measure, timing_settings
+
+SIZES = {"1K": 2**10, "64K": 2**16, "4M": 2**22}
+QUICK_SIZES = {"1K": 2**10, "64K": 2**16}
+
+
+@dataclasses.dataclass
+class Measure:
+    name: str
+    position: list[float]
+    values: list[int]
+
+
+def _array(size: int, dtype: type) -> np.ndarray:
+    """A smooth signal, like the images and the measures saved in practice (not white noise)."""
+    rng = np.random.default_rng(0)
+    items = max(size // np.dtype(dtype).itemsize, 1)
+    return np.cumsum(rng.integers(-2, 3, items)).astype(dtype)
+
+
+def _image(size: int) -> np.ndarray:
+    side = max(int(size**0.5), 1)
+    return _array(side * side, np.uint8).reshape(side, side)
+
+
+def _scalar(np_type: type):
+    return np.datetime64("2024-01-01T12:00:00") if np_type is np.datetime64 else np_type(1)
+
+
+def _measure_round_trip(name: str, value, serializer, deserializer, payload: int, settings: dict) -> list[Result]:
+    data = serializer(value)
+    return [
+        measure(f"{name}/dump", lambda: serializer(value), payload=payload, **settings),
+        measure(f"{name}/load", lambda: deserializer(data), payload=payload, **settings),
+    ]
+
+
+def run(quick: bool = False) -> list[Result]:
+    settings = timing_settings(quick)
+    sizes = QUICK_SIZES if quick else SIZES
+    numpy_types = set(NumpyTypes.types())
+    results = []
+    for type_, (serializer, extension) in _function_saver_serializers.items():
+        deserializer = _function_saver_deserializers[extension]
+        name = f"serializers/{type_.__name__}"
+        if type_ in numpy_types:
+            value = _scalar(type_)
+            results += _measure_round_trip(name, value, serializer, deserializer, value.nbytes, settings)
+            continue
+        for size_name, size in sizes.items():
+            value = _image(size) if extension == "png" else _array(size, np.float32)
+            results += _measure_round_trip(
+                f"{name}/{size_name}", value, serializer, deserializer, value.nbytes, settings
+            )
+    # the jsons fallback: json native values (fast path), and objects (reflection of jsons)
+    for size_name, size in sizes.items():
+        items = max(size // 16, 1)
+        native = {"position": [0.5] * items, "values": list(range(items))}
+        results += _measure_round_trip(
+            f"serializers/json/native/{size_name}", native, _default_serializer, jsons.loads, size, settings
+        )
+        measure_ = Measure("measure", [0.5] * items, list(range(items)))
+        results += _measure_round_trip(
+            f"serializers/json/dataclass/{size_name}",
+            measure_,
+            _default_serializer,
+            lambda data: jsons.loads(data, Measure),
+            size,
+            settings,
+        )
+    return results
@@ -0,0 +1,146 @@
+"""
+Measure, save and compare the benchmarks.
+
+A benchmark is a callable, run by timeit: the number of runs is calibrated so that a repeat lasts at least min_time
+(0.2 s, 0.05 s in quick mode), and the median of the repeats, divided by the number of operations of a run,
+gives the time of an operation.
+"""
+
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import timeit
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple
+
+import numpy as np
+
+from functionsaver import reload_config
+
+
+class Result(NamedTuple):
+    name: str
+    median: float  # seconds per operation
+    best: float  # seconds per operation, the fastest repeat
+    payload: int | None = None  # bytes per operation, for the throughput
+
+    @property
+    def throughput(self) -> float | None:
+        """Bytes per second"""
+        return self.payload / self.median if self.payload and self.median else None
+
+
+def timing_settings(quick: bool) -> dict:
+    """The repeat and min_time arguments of measure"""
+    return {"repeat": 3, "min_time": 0.05} if quick else {"repeat": 5, "min_time": 0.2}
+
+
+def measure(
+    name: str,
+    function: Callable[[], object],
+    operations: int = 1,
+    payload: int | None = None,
+    repeat: int = 5,
+    min_time: float = 0.2,
+) -> Result:
+    """
+    Time function.
+
+    Args:
+        name: the name of the benchmark, i.e. decorator/sync/disabled
+        function: the benchmark, without arguments
+        operations: the number of operations done by a call to function (i.e. the calls of an async loop)
+        payload: the bytes processed by an operation
+        repeat: the number of measures, the median is kept
+        min_time: the min duration of a measure, in seconds
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while (elapsed := timer.timeit(number)) < min_time / 10:
+        number *= 10
+    number = max(number, math.ceil(number * min_time / elapsed))
+    times = [time / (number * operations) for time in timer.repeat(repeat, number)]
+    return Result(name, statistics.median(times), min(times), payload)
+
+
+@contextlib.contextmanager
+def environment(variables: dict[str, str]) -> Iterator[None]:
+    """Set FUNCTION_SAVER_* environment variables for a benchmark, then restore them."""
+    old_environ = dict(os.environ)
+    os.environ.update(variables)
+    reload_config()
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(old_environ)
+        reload_config()
+
+
+def to_json(results: list[Result]) -> dict:
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": {
+            result.name: {"median": result.median, "best": result.best, "throughput": result.throughput}
+            for result in results
+        },
+    }
+
+
+def save_results(results: list[Result], path: str | Path):
+    Path(path).write_text(json.dumps(to_json(results), indent=2) + "\n")
+
+
+class Comparison(NamedTuple):
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def compare(results: list[Result], baseline_path: str | Path) -> list[Comparison]:
+    """The benchmarks of results also in the baseline (a file written by save_results), by name."""
+    baseline = json.loads(Path(baseline_path).read_text())["results"]
+    return [
+        Comparison(result.name, baseline[result.name]["median"], result.median)
+        for result in results
+        if result.name in baseline
+    ]
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def format_results(results: list[Result], comparisons: list[Comparison], tolerance: float) -> str:
+    ratios = {comparison.name: comparison.ratio for comparison in comparisons}
+    width = max((len(result.name) for result in results), default=0)
+    lines = []
+    for result in results:
+        line = f"{result.name:<{width}}  {_format_time(result.median):>10}"
+        if result.throughput is not None:
+            line += f"  {result.throughput / 2**20:10.1f} MiB/s"
+        ratio = ratios.get(result.name)
+        if ratio is not None:
+            line += f"  x{ratio:.2f} vs baseline"
+            if ratio > 1 + tolerance:
+                line += "  REGRESSION"
+        lines.append(line)
+    return "\n".join(lines)
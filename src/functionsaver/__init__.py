@@ -2,10 +2,39 @@ from . import jsons_numpy  # noqa: jsons_numpy is not used, but it's VERY IMPORT
 # It allows to register the custom serialization for numpy arrays in jsons package
 # Without, serializing a class with a np array as member to json, it will "freeze".
 from .function_saver import function_saver, replay_function, replay_and_check_function
-from .serializers import SerializeAsArrayPng, register_serializer
+from .async_capture import flush_async_captures, set_capture_executor
+from .batch_replay import batch_replay
+from .blob_store import gc_blobs
+from .catalog import find_captures
+from .config import reload_config
+from .metrics import metrics, start_metrics_server, to_prometheus, write_prometheus
+from .prettify import prettify_json
+from .replay_pipeline import replay_captures
+from .serializers import SerializeAsArrayPng, SerializeAsArrayShuffle, SerializeAsArrayShuffleDelta, register_serializer
+from .storage import list_segment_captures, read_capture_metadata
+from .timing import latency_histograms
+from .writer_pool import flush_background_writes
 
 __all__ = ["function_saver",
            "replay_function",
            "replay_and_check_function",
            "SerializeAsArrayPng",
-           "register_serializer"]
+           "SerializeAsArrayShuffle",
+           "SerializeAsArrayShuffleDelta",
+           "register_serializer",
+           "flush_background_writes",
+           "flush_async_captures",
+           "set_capture_executor",
+           "reload_config",
+           "list_segment_captures",
+           "gc_blobs",
+           "prettify_json",
+           "find_captures",
+           "read_capture_metadata",
+           "latency_histograms",
+           "metrics",
+           "to_prometheus",
+           "write_prometheus",
+           "start_metrics_server",
+           "batch_replay",
+           "replay_captures"]
@@ -0,0 +1,75 @@
+"""
+The command line of functionsaver:
+    python -m functionsaver replay my_package.my_module:my_function --root <root path> --workers 32
+        replays all the captures of a function, see batch_replay.py
+    python -m functionsaver prettify <capture folder or root folder>...
+        indents the json files of the captures, see prettify.py
+
+The commands are here, not in their modules: the package imports them, python -m would run a second copy.
+"""
+
+import argparse
+import os
+import sys
+
+from .batch_replay import batch_replay
+from .prettify import prettify_json
+
+
+def _replay(arguments: argparse.Namespace) -> int:
+    # the function is imported from the current directory, like python -m does
+    sys.path.insert(0, os.getcwd())
+    report = batch_replay(
+        arguments.function,
+        arguments.root,
+        workers=arguments.workers,
+        timeout=arguments.timeout,
+        retries=arguments.retries,
+        check=not arguments.no_check,
+        compare_function=arguments.compare,
+        mmap_mode=None if arguments.mmap_mode == "none" else arguments.mmap_mode,
+    )
+    print(report.summary())
+    if arguments.report:
+        report.write(arguments.report)
+    return 0 if report.ok else 1
+
+
+def _prettify(arguments: argparse.Namespace) -> int:
+    for path in arguments.paths:
+        print(f"{path}: {prettify_json(path)} json files prettified")
+    return 0
+
+
+def main(arguments: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m functionsaver")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay = commands.add_parser(
+        "replay",
+        help="replay all the captures of a function",
+        description="Replay all the captures of a function, in parallel worker processes",
+    )
+    replay.add_argument("function", help="the import path of the function: module:qualname")
+    replay.add_argument("--root", help="the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH")
+    replay.add_argument("--workers", type=int, help="the number of worker processes, default is the number of CPUs")
+    replay.add_argument("--timeout", type=float, help="the max duration of a replay, in seconds")
+    replay.add_argument("--retries", type=int, default=1, help="the retries after a timeout or a crash")
+    replay.add_argument("--no-check", action="store_true", help="don't compare the outputs to the saved outputs")
+    replay.add_argument("--compare", help="the import path of the function comparing the outputs")
+    replay.add_argument("--mmap-mode", choices=["c", "r", "none"], default="c", help="see replay_function")
+    replay.add_argument("--report", help="write the report to this json file")
+    replay.set_defaults(run=_replay)
+
+    prettify = commands.add_parser(
+        "prettify", help="indent the json files of the captures", description="Indent the json files of the captures"
+    )
+    prettify.add_argument("paths", nargs="+", help="capture folders, function folders or root paths of the captures")
+    prettify.set_defaults(run=_prettify)
+
+    arguments = parser.parse_args(arguments)
+    return arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Executor used by the async functions to serialize and write their captures out of the event loop.
+Each capture (inputs + output, or one internal) is one submission: encoding and writing happen in the executor.
+
+It is configured with:
+    - FUNCTION_SAVER_ASYNC_EXECUTOR = thread | process: the kind of pool (default thread)
+    - FUNCTION_SAVER_ASYNC_WORKERS: the number of workers (default is the executor default)
+or by providing your own executor with set_capture_executor.
+
+⚠ With a process pool, the saved values must be picklable, and serializers registered with register_serializer
+must be registered at import time of your modules (so that the worker processes know them).
+
+By default, the decorated coroutine awaits its capture (without blocking the loop).
+With FUNCTION_SAVER_BACKGROUND=1, it doesn't: use flush_async_captures to wait for the pending captures.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable
+
+from .config import config
+from .logger import get_logger
+
+logger = get_logger()
+
+_executor: Executor | None = None
+_executor_lock = threading.Lock()
+_pending: set[Future] = set()
+_pending_lock = threading.Lock()  # the futures are discarded by the executor threads
+
+
+def set_capture_executor(executor: Executor | None):
+    """
+    Set the executor used to write the captures of async functions.
+    None means: create one from the environment variables on next capture.
+    """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+def get_capture_executor() -> Executor:
+    """
+    Get the executor used to write the captures of async functions.
+
+    Raises:
+        ValueError: if FUNCTION_SAVER_ASYNC_EXECUTOR is neither thread nor process
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                kind = config.get("FUNCTION_SAVER_ASYNC_EXECUTOR", "thread")
+                workers = config.get("FUNCTION_SAVER_ASYNC_WORKERS")
+                max_workers = int(workers) if workers else None
+                if kind == "thread":
+                    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="function_saver_async")
+                elif kind == "process":
+                    _executor = ProcessPoolExecutor(max_workers=max_workers)
+                else:
+                    raise ValueError(f"FUNCTION_SAVER_ASYNC_EXECUTOR must be 'thread' or 'process', it is {kind}")
+    return _executor
+
+
+def _discard_pending(future: Future):
+    with _pending_lock:
+        _pending.discard(future)
+
+
+def _log_capture_error(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Error while writing a capture in the executor. {future.exception()}")
+
+
+async def submit_capture(job: Callable, *args, wait: bool = True, on_done: Callable[[Any], None] | None = None):
+    """
+    Run job(*args) in the capture executor.
+
+    Args:
+        job: the function writing the capture. It must be picklable for a process pool (a module level function).
+        wait: if True, await the end of the job (the event loop is not blocked meanwhile).
+        on_done: Optional. Called with the result of the job, when it succeeds, in this process.
+
+    Returns:
+        The result of the job if wait is True, else None.
+
+    Raises:
+        Any exception raised by the job, if wait is True.
+    """
+    future = get_capture_executor().submit(job, *args)
+    with _pending_lock:
+        _pending.add(future)
+    future.add_done_callback(_discard_pending)
+    if wait:
+        result = await asyncio.wrap_future(future)
+        if on_done is not None:
+            on_done(result)
+        return result
+    # nobody awaits it: errors must at least be logged
+    future.add_done_callback(_log_capture_error)
+    if on_done is not None:
+        future.add_done_callback(
+            lambda done: on_done(done.result()) if not done.cancelled() and done.exception() is None else None
+        )
+    return None
+
+
+async def flush_async_captures():
+    """Wait for all the pending captures of async functions, including the ones submitted meanwhile."""
+    while True:
+        with _pending_lock:
+            pending = list(_pending)
+        if not pending:
+            return
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in pending), return_exceptions=True)
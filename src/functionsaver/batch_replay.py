@@ -0,0 +1,391 @@
+"""
+Batch replay: replay all the captures of a function under a root path, in parallel worker processes.
+    report = batch_replay("my_package.my_module:my_function", root_path, workers=32, timeout=60)
+    print(report.summary())
+or from the command line:
+    python -m functionsaver replay my_package.my_module:my_function --root <root path> --workers 32
+
+The function is given by its import path (module:qualname) or as a function defined at the module level:
+each worker process imports it, then replays the captures one after the other. The captures are found in the root
+path, in any storage format (folders, zip captures, segments), see discover_captures.
+
+Each capture gets a status:
+    - passed: the output equals the saved output (or no check)
+    - failed: the output differs from the saved output, the report summarizes the difference
+    - error: an exception, while loading the capture or in the function
+    - timeout: the replay lasted more than the timeout: its worker is killed and replaced
+    - crashed: the worker died during the replay (segmentation fault, os._exit...): it is replaced
+The timeouts and the crashes are retried (retries times, in a new worker), the other statuses are deterministic.
+The report gives the load time (deserialization of the inputs and of the expected output: the arrays are memory
+mapped, their reads are in the run time) and the run time of the function, for each capture.
+"""
+
+import asyncio
+import collections
+import dataclasses
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from enum import Enum
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from .config import config
+from .function_saver import (
+    _call_replayed,
+    _call_replayed_async,
+    _check_mmap_mode,
+    _load_expected_output,
+    _load_inputs,
+)
+from .logger import get_logger
+from .storage import list_segment_captures, open_capture
+
+logger = get_logger()
+
+# the capture folders and zip captures: <function name>_<date>, see function_saver
+_CAPTURE_NAME = r"_\d{4}_\d{2}_\d{2}__\d{2}h\d{2}m\d{2}\.\d{6}(\.zip)?"
+
+_MAX_DIFF_LENGTH = 300
+
+
+class ReplayStatus(str, Enum):
+    PASSED = "passed"
+    FAILED = "failed"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+    CRASHED = "crashed"
+
+
+class CaptureReplayResult(NamedTuple):
+    capture_id: str
+    status: ReplayStatus
+    exception: str | None = None  # the traceback of the exception, for an error
+    load_duration: float | None = None  # seconds
+    run_duration: float | None = None  # seconds
+    diff: str | None = None  # the difference of the outputs, for a failure
+    attempts: int = 1
+
+
+class BatchReplayReport:
+    """The results of a batch replay, in the order of the captures."""
+
+    def __init__(self, function: str, results: list[CaptureReplayResult], duration: float, workers: int):
+        self.function = function
+        self.results = results
+        self.duration = duration
+        self.workers = workers
+
+    @property
+    def ok(self) -> bool:
+        return all(result.status == ReplayStatus.PASSED for result in self.results)
+
+    def counts(self) -> dict[str, int]:
+        """The number of captures by status"""
+        counts = collections.Counter(result.status.value for result in self.results)
+        return {status.value: counts[status.value] for status in ReplayStatus}
+
+    def to_json(self) -> dict:
+        return {
+            "function": self.function,
+            "duration": self.duration,
+            "workers": self.workers,
+            "counts": self.counts(),
+            "results": [{**result._asdict(), "status": result.status.value} for result in self.results],
+        }
+
+    def write(self, path: str | Path):
+        """Write the report as json"""
+        Path(path).write_text(json.dumps(self.to_json(), indent=2))
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{count} {status}" for status, count in self.counts().items() if count)
+        lines = [
+            f"{self.function}: {len(self.results)} captures replayed in {self.duration:.1f} s "
+            f"with {self.workers} workers: {counts or 'nothing to replay'}"
+        ]
+        for result in self.results:
+            if result.status != ReplayStatus.PASSED:
+                reason = result.diff or (result.exception or "").strip().splitlines()[-1:] or [""]
+                lines.append(f"  {result.status.value}: {result.capture_id}: {''.join(reason)}")
+        return "\n".join(lines)
+
+
+def discover_captures(function_name: str, root_path: str | Path | None = None) -> list[str]:
+    """
+    The captures of a function in a root path: its capture folders, zip captures and segment records, oldest first.
+
+    Args:
+        function_name: the name of the function (not qualified)
+        root_path: the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH
+
+    Returns:
+        The capture ids, as taken by replay_function
+    """
+    root_path = Path(root_path or config.root_path)
+    pattern = re.compile(re.escape(function_name) + _CAPTURE_NAME)
+    captures = []
+    if root_path.is_dir():
+        captures = sorted(str(path) for path in root_path.iterdir() if pattern.fullmatch(path.name))
+    return captures + list_segment_captures(function_name, root_path)
+
+
+def _import_path(function: Callable | str) -> str:
+    if isinstance(function, str):
+        return function
+    return f"{function.__module__}:{function.__qualname__}"
+
+
+def _import(path: str) -> Callable:
+    """Import module:qualname"""
+    module_name, _, qualname = path.partition(":")
+    if not qualname:
+        raise ValueError(f"Invalid function {path}: expected module:qualname")
+    value = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        value = getattr(value, name)
+    return value
+
+
+def outputs_equal(output, expected) -> bool:
+    """The default comparison: equality, element wise for the numpy arrays, recursively in the containers."""
+    if isinstance(output, np.ndarray) or isinstance(expected, np.ndarray):
+        return (
+            isinstance(output, np.ndarray)
+            and isinstance(expected, np.ndarray)
+            and output.shape == expected.shape
+            and bool(np.all((output == expected) | ((output != output) & (expected != expected))))
+        )
+    if isinstance(output, dict) and isinstance(expected, dict):
+        return output.keys() == expected.keys() and all(outputs_equal(output[k], expected[k]) for k in output)
+    if isinstance(output, (list, tuple)) and isinstance(expected, (list, tuple)):
+        return len(output) == len(expected) and all(outputs_equal(a, b) for a, b in zip(output, expected))
+    try:
+        return bool(output == expected)
+    except ValueError:  # objects with numpy arrays
+        if type(output) is not type(expected) or not hasattr(output, "__dict__"):
+            raise
+        return outputs_equal(vars(output), vars(expected))
+
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= _MAX_DIFF_LENGTH else text[: _MAX_DIFF_LENGTH - 3] + "..."
+
+
+def diff_summary(output, expected, path: str = "output") -> str:
+    """A short description of the first difference between output and expected"""
+    if isinstance(output, np.ndarray) and isinstance(expected, np.ndarray):
+        if output.shape != expected.shape or output.dtype != expected.dtype:
+            return f"{path}: shape {output.shape} {output.dtype} != {expected.shape} {expected.dtype}"
+        different = output != expected
+        if np.issubdtype(output.dtype, np.inexact):
+            different &= ~(np.isnan(output) & np.isnan(expected))
+        first = tuple(int(i) for i in np.argwhere(different)[0])
+        summary = f"{path}: {int(different.sum())}/{output.size} elements differ, first at {first}"
+        if np.issubdtype(output.dtype, np.number):
+            difference = np.abs(output.astype(np.float64) - expected.astype(np.float64))[different]
+            summary += f", max abs difference {float(np.nanmax(difference)):g}"
+        return summary
+    if isinstance(output, dict) and isinstance(expected, dict):
+        if output.keys() != expected.keys():
+            missing, extra = expected.keys() - output.keys(), output.keys() - expected.keys()
+            return _truncate(f"{path}: keys missing {sorted(map(str, missing))}, extra {sorted(map(str, extra))}")
+        for key in output:
+            if not outputs_equal(output[key], expected[key]):
+                return diff_summary(output[key], expected[key], f"{path}[{key!r}]")
+    if isinstance(output, (list, tuple)) and isinstance(expected, (list, tuple)):
+        if len(output) != len(expected):
+            return f"{path}: length {len(output)} != {len(expected)}"
+        for index, (item, expected_item) in enumerate(zip(output, expected)):
+            if not outputs_equal(item, expected_item):
+                return diff_summary(item, expected_item, f"{path}[{index}]")
+    if dataclasses.is_dataclass(output) and type(output) is type(expected):
+        return diff_summary(vars(output), vars(expected), path)
+    return _truncate(f"{path}: {output!r} != {expected!r}")
+
+
+def _replay_one(function: Callable, capture_id: str, compare: Callable | None, mmap_mode: str | None):
+    """Replay a capture in a worker"""
+    start = time.perf_counter()
+    load_duration = None
+    try:
+        capture = open_capture(capture_id)
+        args = _load_inputs(function, capture, mmap_mode)
+        expected = _load_expected_output(capture, mmap_mode) if compare is not None else None
+        loaded = time.perf_counter()
+        load_duration = loaded - start
+        if inspect.iscoroutinefunction(function):
+            output = asyncio.run(_call_replayed_async(function, capture, args))
+        else:
+            output = _call_replayed(function, capture, args)
+        run_duration = time.perf_counter() - loaded
+        if compare is not None and not compare(output, expected):
+            diff = diff_summary(output, expected)
+            return CaptureReplayResult(capture_id, ReplayStatus.FAILED, None, load_duration, run_duration, diff)
+    except Exception:
+        return CaptureReplayResult(capture_id, ReplayStatus.ERROR, traceback.format_exc(), load_duration)
+    return CaptureReplayResult(capture_id, ReplayStatus.PASSED, None, load_duration, run_duration)
+
+
+def _worker_main(connection: Connection, function_path: str, compare: Callable | str | None, mmap_mode: str | None):
+    """The loop of a worker process: tells it's ready, then receives capture ids and sends their results, until None"""
+    setup_error = None
+    try:
+        function = _import(function_path)
+        if isinstance(compare, str):
+            compare = _import(compare)
+    except Exception:
+        setup_error = traceback.format_exc()
+    connection.send(None)
+    while (capture_id := connection.recv()) is not None:
+        if setup_error is not None:
+            connection.send(CaptureReplayResult(capture_id, ReplayStatus.ERROR, setup_error))
+        else:
+            connection.send(_replay_one(function, capture_id, compare, mmap_mode))
+
+
+class _Task:
+    def __init__(self, index: int, capture_id: str):
+        self.index = index
+        self.capture_id = capture_id
+        self.attempts = 0
+
+
+class _Worker:
+    def __init__(self, context, arguments: tuple):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection, *arguments), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+        self.task: _Task | None = None
+        self.started = 0.0
+
+    def submit(self, task: _Task):
+        # the replay timeout doesn't include the start of the worker (imports...)
+        if not self.ready:
+            try:
+                self.connection.recv()
+            except EOFError:
+                raise RuntimeError(f"The replay worker failed to start: exit code {self.process.exitcode}") from None
+            self.ready = True
+        task.attempts += 1
+        self.task = task
+        self.started = time.monotonic()
+        self.connection.send(task.capture_id)
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+def batch_replay(
+    function: Callable | str,
+    root_path: str | Path | None = None,
+    captures: list[str] | None = None,
+    workers: int | None = None,
+    timeout: float | None = None,
+    retries: int = 1,
+    check: bool = True,
+    compare_function: Callable | str | None = None,
+    mmap_mode: str | None = "c",
+) -> BatchReplayReport:
+    """
+    Replay the captures of a function in worker processes, see the module documentation.
+
+    Args:
+        function: the function, or its import path module:qualname. It must be importable by the workers.
+        root_path: the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH
+        captures: the capture ids to replay, default is all the captures of the function in the root path
+        workers: the number of worker processes, default is the number of CPUs
+        timeout: the max duration of a replay, in seconds, default is no timeout
+        retries: the number of times a capture is replayed again after a timeout or a crash
+        check: compare the outputs to the saved outputs, like replay_and_check_function
+        compare_function: the comparison of the outputs (or its import path), default is outputs_equal.
+            It must be picklable or importable by the workers.
+        mmap_mode: see replay_function
+
+    Raises:
+        ValueError: if the function can't be imported, or if mmap_mode is invalid
+    """
+    _check_mmap_mode(mmap_mode)
+    function_path = _import_path(function)
+    # the workers import the function: fails early if they can't
+    try:
+        imported = _import(function_path)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Invalid function {function_path}: it can't be imported. {e}") from e
+    if not isinstance(function, str) and imported is not function:
+        raise ValueError(f"Invalid function {function_path}: expected a module level function, or module:qualname")
+    if captures is None:
+        captures = discover_captures(function_path.rpartition(":")[2].rpartition(".")[2], root_path)
+    compare = (compare_function or outputs_equal) if check else None
+    workers = max(1, min(workers or os.cpu_count() or 1, len(captures) or 1))
+    start = time.monotonic()
+
+    results: list[CaptureReplayResult | None] = [None] * len(captures)
+    pending = collections.deque(_Task(index, capture_id) for index, capture_id in enumerate(captures))
+    # spawn: the workers don't inherit the locks held by the threads of this process (writer pool, logging...)
+    context = multiprocessing.get_context("spawn")
+    arguments = (function_path, compare, mmap_mode)
+    pool = [_Worker(context, arguments) for _ in range(workers if captures else 0)]
+
+    def finish(worker: _Worker, result: CaptureReplayResult, replace: bool):
+        task = worker.task
+        worker.task = None
+        if replace:
+            worker.kill()
+            pool[pool.index(worker)] = _Worker(context, arguments)
+        if result.status in (ReplayStatus.TIMEOUT, ReplayStatus.CRASHED) and task.attempts <= retries:
+            logger.info(f"Replay of {task.capture_id} {result.status.value}: retried")
+            pending.appendleft(task)
+            return
+        results[task.index] = result._replace(attempts=task.attempts)
+
+    try:
+        while pending or any(worker.task is not None for worker in pool):
+            for worker in pool:
+                if worker.task is None and pending:
+                    worker.submit(pending.popleft())
+            busy = [worker for worker in pool if worker.task is not None]
+            wait_timeout = None
+            if timeout is not None:
+                wait_timeout = max(0.0, min(worker.started + timeout for worker in busy) - time.monotonic())
+            wait([worker.connection for worker in busy] + [worker.process.sentinel for worker in busy], wait_timeout)
+            now = time.monotonic()
+            for worker in busy:
+                if worker.connection.poll():
+                    try:
+                        finish(worker, worker.connection.recv(), replace=False)
+                        continue
+                    except (EOFError, OSError):
+                        pass
+                if not worker.process.is_alive():
+                    crashed = f"The worker died with exit code {worker.process.exitcode}"
+                    finish(worker, CaptureReplayResult(worker.task.capture_id, ReplayStatus.CRASHED, crashed), True)
+                elif timeout is not None and now - worker.started >= timeout:
+                    timed_out = f"The replay lasted more than {timeout} s"
+                    finish(worker, CaptureReplayResult(worker.task.capture_id, ReplayStatus.TIMEOUT, timed_out), True)
+    finally:
+        for worker in pool:
+            worker.stop()
+    return BatchReplayReport(function_path, results, time.monotonic() - start, workers)
+
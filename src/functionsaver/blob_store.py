@@ -0,0 +1,154 @@
+"""
+Content addressed store of the captured data, so that the large values passed at each call are written once
+(FUNCTION_SAVER_DEDUP=1, for the captures saved in folders):
+    - FUNCTION_SAVER_DEDUP_MIN_SIZE: the entries of this size or more are deduplicated (default 64K)
+
+Such an entry is written to <root>/.blobs/<digest[:2]>/<digest>, digest being the hash of its data computed by the
+capture writer (see storage.entry_hasher),
+then hard linked in the capture folder (copied if the file system has no hard links).
+The entries written as chunks are streamed to a temporary file of the store, hashed meanwhile: the temporary file
+becomes the blob (or is moved to the capture, if below the min size) once the hash is known.
+A capture folder stays a plain folder, and the number of links of a blob is its reference count + 1:
+gc_blobs deletes the blobs no longer referenced by a capture. When the retention evicts a capture, it collects only
+the blobs of this capture (collect_blobs), found from the hashes of its manifest.
+"""
+
+import itertools
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from .config import config, parse_size
+from .logger import get_logger
+
+logger = get_logger()
+
+BLOBS_FOLDER = ".blobs"
+
+_temporary_ids = itertools.count()
+
+
+class BlobStore:
+    def __init__(self, path: Path, min_size: int):
+        self.path = path
+        self.min_size = min_size
+
+    def temporary_path(self) -> Path:
+        """A temporary file of the store, to write the data before adding it (see add)."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        return self.path / f"{os.getpid()}.{threading.get_ident()}.{next(_temporary_ids)}.tmp"
+
+    def _link_stored(self, blob: Path, destination: Path) -> bool:
+        """Link destination to the blob if already stored. Returns False if not stored (or no hard links)."""
+        if not blob.exists():
+            return False
+        try:
+            os.link(blob, destination)
+            return True
+        except FileNotFoundError:
+            if blob.exists():
+                raise
+            return False  # deleted by gc_blobs in the meantime: stored again
+        except OSError:  # no hard links on this file system
+            return False
+
+    def add(self, temporary: Path, destination: Path, digest: str) -> int:
+        """
+        Add the data written to a temporary file of the store (see temporary_path), if not already stored,
+        and link it to destination. The temporary file is moved or deleted.
+
+        Args:
+            digest: the hash of the data
+
+        Returns:
+            The size written to the disk: 0 if the data was already stored
+        """
+        blob = self.path / digest[:2] / digest
+        if self._link_stored(blob, destination):
+            temporary.unlink()
+            return 0
+        size = temporary.stat().st_size
+        try:
+            # linked before becoming a blob: never collected by gc_blobs
+            os.link(temporary, destination)
+        except OSError:  # no hard links on this file system
+            shutil.move(temporary, destination)
+            return size
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temporary, blob)
+        return size
+
+    def store(self, destination: Path, chunks: Iterable[bytes | memoryview], digest: str) -> int:
+        """Same as add, the data being given as chunks: written only if not already stored."""
+        blob = self.path / digest[:2] / digest
+        if self._link_stored(blob, destination):
+            return 0
+        temporary = self.temporary_path()
+        try:
+            with open(temporary, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            return self.add(temporary, destination, digest)
+        finally:
+            temporary.unlink(missing_ok=True)
+
+
+def gc_blobs(root_path: str | Path | None = None) -> int:
+    """
+    Delete the blobs no longer referenced by a capture.
+
+    Args:
+        root_path: the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH
+
+    Returns:
+        The size freed
+    """
+    blobs_path = Path(root_path or config.root_path) / BLOBS_FOLDER
+    if not blobs_path.is_dir():
+        return 0
+    return collect_blobs(blob for blob in blobs_path.glob("*/*") if blob.suffix != ".tmp")
+
+
+def blob_path(root_path: str | Path, digest: str) -> Path:
+    """The path of the blob of the data of this hash, stored or not."""
+    return Path(root_path) / BLOBS_FOLDER / digest[:2] / digest
+
+
+def collect_blobs(blobs: Iterable[Path]) -> int:
+    """
+    Delete the blobs among blobs no longer referenced by a capture.
+
+    Returns:
+        The size freed
+    """
+    freed = 0
+    for blob in blobs:
+        try:
+            stat = blob.stat()
+            if stat.st_nlink == 1:
+                blob.unlink()
+                freed += stat.st_size
+        except OSError as e:
+            logger.debug(f"Function saver: blob {blob} not collected. {e}")
+    return freed
+
+
+_blob_store: BlobStore | None = None
+_blob_store_key: tuple | None = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore | None:
+    """Get the blob store matching the configuration, None if the deduplication is disabled."""
+    global _blob_store, _blob_store_key
+    if config.get("FUNCTION_SAVER_DEDUP", "0") != "1":
+        return None
+    key = (config.root_path, config.get("FUNCTION_SAVER_DEDUP_MIN_SIZE", "64K"))
+    if key != _blob_store_key:
+        with _blob_store_lock:
+            if key != _blob_store_key:
+                _blob_store = BlobStore(Path(key[0]) / BLOBS_FOLDER, parse_size(key[1]))
+                _blob_store_key = key
+    return _blob_store
@@ -0,0 +1,133 @@
+import inspect
+from typing import Any, Callable
+
+from .compression import Compression
+from .manifest import type_name
+from .serializers import SerializerEntry, _get_serializer_entry, serializer_generation
+from .snapshot import snapshot
+
+_SIMPLE_PARAMETER_KINDS = (
+    inspect.Parameter.POSITIONAL_OR_KEYWORD,
+    inspect.Parameter.KEYWORD_ONLY,
+)
+
+
+def _static_serializer_entry(annotation) -> SerializerEntry | None:
+    """
+    Resolve the serializer from the annotation only.
+    Returns None if the parameter is not annotated: the serializer depends on the value type, at each call.
+    """
+    if annotation is None or annotation == inspect.Signature.empty:
+        return None
+    return _get_serializer_entry(annotation, None)
+
+
+class CapturePlan:
+    """
+    What is needed to capture a function call, computed once per decorated function:
+    the signature, the parameters order and defaults, and the serializers deduced from the annotations.
+    Only the non annotated parameters (and output) get their serializer resolved at each call, from the value type.
+    The plan is outdated when a serializer is registered (is_outdated): it must be built again.
+    """
+
+    def __init__(self, func: Callable):
+        self.serializer_generation = serializer_generation()
+        self.signature = inspect.signature(func)
+        parameters = list(self.signature.parameters.values())
+        self.names = [parameter.name for parameter in parameters]
+        self.defaults = {
+            parameter.name: parameter.default
+            for parameter in parameters
+            if parameter.default is not inspect.Parameter.empty
+        }
+        # without *args, **kwargs, positional only... we can bind the arguments ourselves (much faster)
+        self._simple = all(parameter.kind in _SIMPLE_PARAMETER_KINDS for parameter in parameters)
+        self._positional_count = sum(
+            1 for parameter in parameters if parameter.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD
+        )
+        self.input_serializers = {
+            parameter.name: _static_serializer_entry(parameter.annotation)
+            for parameter in parameters
+            # Skip serializing 'self'
+            if parameter.name != "self"
+        }
+        self.output_serializer = _static_serializer_entry(self.signature.return_annotation)
+        # the annotations of the entries, for the manifest of the captures
+        self.declared_types = {
+            ("inputs", parameter.name): type_name(parameter.annotation)
+            for parameter in parameters
+            if parameter.name in self.input_serializers and parameter.annotation is not inspect.Signature.empty
+        }
+        if self.signature.return_annotation is not inspect.Signature.empty:
+            self.declared_types[("output", "output")] = type_name(self.signature.return_annotation)
+
+    def is_outdated(self) -> bool:
+        """True if a serializer was registered since the plan was built: its serializers may have changed."""
+        return self.serializer_generation != serializer_generation()
+
+    def bind(self, args: tuple, kwargs: dict) -> dict[str, Any]:
+        """
+        Same as signature.bind_partial(*args, **kwargs) then apply_defaults(), returning the arguments.
+
+        Raises:
+            TypeError: if the arguments don't match the signature
+        """
+        if self._simple and len(args) <= self._positional_count:
+            arguments = dict(zip(self.names, args))
+            consumed_kwargs = 0
+            for name in self.names[len(args):]:
+                if name in kwargs:
+                    arguments[name] = kwargs[name]
+                    consumed_kwargs += 1
+                elif name in self.defaults:
+                    arguments[name] = self.defaults[name]
+            if consumed_kwargs == len(kwargs):
+                return arguments
+        # not a simple case, or unexpected kwargs: let inspect do it (and raise)
+        bound_args = self.signature.bind_partial(*args, **kwargs)
+        bound_args.apply_defaults()
+        return bound_args.arguments
+
+    def input_entries(
+        self, args: tuple, kwargs: dict, section: str, compression_of: Callable[[str], Compression | None]
+    ) -> list[tuple]:
+        """
+        Returns the entries (serializer_entry, value, section, file_name, compression) to write the inputs of a call.
+        compression_of gives the compression of a variable, by name.
+        """
+        return self.arguments_entries(self.bind(args, kwargs), section, compression_of)
+
+    def snapshot_inputs(self, args: tuple, kwargs: dict) -> dict[str, Any]:
+        """
+        Bind the arguments of a call, and copy the ones to save before the call (see snapshot.py).
+
+        Raises:
+            TypeError: if the arguments don't match the signature
+        """
+        memo = {}
+        return {
+            name: snapshot(value, memo)
+            for name, value in self.bind(args, kwargs).items()
+            if name in self.input_serializers
+        }
+
+    def arguments_entries(
+        self, arguments: dict[str, Any], section: str, compression_of: Callable[[str], Compression | None]
+    ) -> list[tuple]:
+        """Same as input_entries, with the arguments already bound (i.e. by snapshot_inputs)"""
+        entries = []
+        for name, value in arguments.items():
+            if name not in self.input_serializers:
+                continue
+            serializer_entry = self.input_serializers[name]
+            if serializer_entry is None:
+                serializer_entry = _get_serializer_entry(None, type(value))
+            entries.append((serializer_entry, value, section, name, compression_of(name)))
+        return entries
+
+    def output_entry(self, output, section: str, compression_of: Callable[[str], Compression | None]) -> tuple:
+        """Returns the entry (serializer_entry, value, section, file_name, compression) to write the call output."""
+        serializer_entry = self.output_serializer
+        if serializer_entry is None:
+            serializer_entry = _get_serializer_entry(None, type(output))
+        return serializer_entry, output, section, "output", compression_of("output")
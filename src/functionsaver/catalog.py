@@ -0,0 +1,350 @@
+"""
+Catalog of the captures (FUNCTION_SAVER_CATALOG=1): a sqlite database in the root path, <root>/catalog.sqlite3,
+to find captures without listing the folders.
+
+Each capture is added when it is written, in one transaction: its function (name and qualified name), its timestamp,
+its capture id (the path of the folder or zip, or the id of the segment record: what replay_function takes),
+its size, the durations of the call and of the write, and its entries (inputs, output, internals) with their type,
+size and hash (the hash of the saved data, see storage.entry_hasher; of the hashes of its files for an entry with
+sidecar arrays). The numbers, strings and booleans are also recorded with their value:
+    find_captures("my_function", where={"x": (">", 3)}, limit=50)
+gives the last 50 captures of my_function called with x > 3.
+
+The retention removes the captures it evicts from the catalog.
+Only the internals saved with the capture are recorded (background or zip / segment captures):
+the internals saved during the call to a capture folder are written directly.
+"""
+
+import datetime
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple
+
+from .config import config
+from .logger import get_logger
+from .storage import CaptureWriter, entry_hasher, entry_type_and_value
+
+logger = get_logger()
+
+CATALOG_FILE = "catalog.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    capture_id TEXT NOT NULL UNIQUE,
+    function TEXT NOT NULL,
+    name TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    storage TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    call_duration REAL,
+    write_duration REAL
+);
+CREATE INDEX IF NOT EXISTS captures_by_name ON captures (name, timestamp);
+CREATE INDEX IF NOT EXISTS captures_by_function ON captures (function, timestamp);
+CREATE TABLE IF NOT EXISTS entries (
+    capture INTEGER NOT NULL REFERENCES captures (id) ON DELETE CASCADE,
+    section TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value,
+    size INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_by_capture ON entries (capture);
+CREATE INDEX IF NOT EXISTS entries_by_value ON entries (section, name, value);
+"""
+
+_QUERYABLE_TYPES = (int, float, str, bool)
+_MAX_TEXT_VALUE = 256
+_OPERATORS = {"=", "!=", "<", "<=", ">", ">="}
+
+
+def _type_name(type_: type) -> str:
+    return type_.__qualname__ if type_.__module__ == "builtins" else f"{type_.__module__}.{type_.__qualname__}"
+
+
+class CaptureRecord:
+    """What the catalog records about a capture: created at the call, completed when the capture is written."""
+
+    def __init__(self, function: str, name: str, timestamp: float, storage: str, capture_id: str):
+        self.function = function
+        self.name = name
+        self.timestamp = timestamp
+        self.storage = storage
+        self.capture_id = capture_id
+        self.call_duration: float | None = None
+
+
+def _entry_hash(hashes: list[str]) -> str:
+    """The hash of an entry from the hashes of its files: the hash of its file, without sidecar entries."""
+    if len(hashes) == 1:
+        return hashes[0]
+    hasher = entry_hasher()
+    hasher.update("".join(hashes).encode())
+    return hasher.hexdigest()
+
+
+class CatalogWriter(CaptureWriter):
+    """
+    Wraps the writer of a capture, to collect the size and hash of its entries (see CaptureWriter.digests).
+    The sidecar entries (see jsons_numpy.py) are accounted with their entry.
+    """
+
+    def __init__(self, writer: CaptureWriter, entries: list[tuple]):
+        self.writer = writer
+        self.digests = writer.digests
+        self.capture_id: str | None = None
+        # (section, name) -> [type, value, size, hashes of its files]
+        self.entries: dict[tuple[str, str], list] = {}
+        for _, entry_value, section, name, _ in entries:
+            value_type, value = entry_type_and_value(entry_value)
+            queryable = value_type in _QUERYABLE_TYPES and not (
+                isinstance(value, str) and len(value) > _MAX_TEXT_VALUE
+            )
+            self.entries[(section, name)] = [_type_name(value_type), value if queryable else None, 0, []]
+
+    def _add(self, section: str, file_name: str):
+        name = file_name.partition("#")[0]
+        while (section, name) not in self.entries and "." in name:
+            name = name.rpartition(".")[0]
+        entry = self.entries.setdefault((section, name), ["", None, 0, []])
+        size, digest = self.digests[(section, file_name)]
+        entry[2] += size
+        entry[3].append(digest)
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        size = self.writer.write(section, file_name, data)
+        if section:
+            self._add(section, file_name)
+        return size
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        size = self.writer.write_chunks(section, file_name, chunks)
+        self._add(section, file_name)
+        return size
+
+    def close(self):
+        self.writer.close()
+        # the capture id of a segment record is known once it is appended
+        self.capture_id = getattr(self.writer, "capture_id", None)
+
+
+class CapturedEntry(NamedTuple):
+    section: str
+    name: str
+    type: str
+    value: Any
+    size: int
+    hash: str | None
+
+
+class CaptureInfo(NamedTuple):
+    capture_id: str
+    function: str
+    name: str
+    timestamp: datetime.datetime
+    storage: str
+    size: int
+    call_duration: float | None
+    write_duration: float | None
+    entries: list[CapturedEntry]
+
+    def entry(self, name: str, section: str = "inputs") -> CapturedEntry | None:
+        return next((entry for entry in self.entries if entry.section == section and entry.name == name), None)
+
+
+class Catalog:
+    """The catalog database of a root path. One connection per thread, each capture added in a transaction."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            # several threads and processes write the catalog: WAL lets the readers work meanwhile
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def add(self, record: CaptureRecord, writer: CatalogWriter, write_duration: float):
+        """Add a written capture to the catalog. Its size is the size of its data (deduplicated or not)."""
+        size = sum(entry[2] for entry in writer.entries.values())
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO captures (capture_id, function, name, timestamp, storage, size, call_duration, "
+                "write_duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    writer.capture_id or record.capture_id,
+                    record.function,
+                    record.name,
+                    record.timestamp,
+                    record.storage,
+                    size,
+                    record.call_duration,
+                    write_duration,
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO entries (capture, section, name, type, value, size, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (cursor.lastrowid, section, name, type_, value, entry_size, _entry_hash(hashes))
+                    for (section, name), (type_, value, entry_size, hashes) in writer.entries.items()
+                    if hashes  # not written: failed to serialize
+                ],
+            )
+
+    def remove(self, capture_ids: Iterable[str]):
+        """Remove captures from the catalog (i.e. evicted by the retention)."""
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM captures WHERE capture_id = ?", [(str(id_),) for id_ in capture_ids])
+
+    def find(
+        self,
+        function: str | None = None,
+        where: dict[str, Any] | None = None,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+        limit: int | None = 50,
+    ) -> list[CaptureInfo]:
+        """See find_captures"""
+        conditions = []
+        parameters = []
+        if function is not None:
+            conditions.append("(captures.name = ? OR captures.function = ?)")
+            parameters += [function, function]
+        if since is not None:
+            conditions.append("captures.timestamp >= ?")
+            parameters.append(since.timestamp())
+        if until is not None:
+            conditions.append("captures.timestamp < ?")
+            parameters.append(until.timestamp())
+        for name, condition in (where or {}).items():
+            operator, value = condition if isinstance(condition, tuple) else ("=", condition)
+            if operator not in _OPERATORS:
+                raise ValueError(f"Invalid operator {operator}: expected one of {', '.join(sorted(_OPERATORS))}")
+            conditions.append(
+                "EXISTS (SELECT 1 FROM entries WHERE entries.capture = captures.id AND entries.section = 'inputs' "
+                f"AND entries.name = ? AND entries.value {operator} ?)"
+            )
+            parameters += [name, value]
+        query = "SELECT id, capture_id, function, name, timestamp, storage, size, call_duration, write_duration "
+        query += "FROM captures"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        connection = self._connection()
+        rows = connection.execute(query, parameters).fetchall()
+        entries: dict[int, list[CapturedEntry]] = {row[0]: [] for row in rows}
+        if rows:
+            for capture, *entry in connection.execute(
+                "SELECT capture, section, name, type, value, size, hash FROM entries "
+                f"WHERE capture IN ({', '.join('?' * len(rows))})",
+                list(entries),
+            ):
+                entries[capture].append(CapturedEntry(*entry))
+        return [
+            CaptureInfo(
+                capture_id,
+                function_,
+                name,
+                datetime.datetime.fromtimestamp(timestamp),
+                storage,
+                size,
+                call_duration,
+                write_duration,
+                entries[id_],
+            )
+            for id_, capture_id, function_, name, timestamp, storage, size, call_duration, write_duration in rows
+        ]
+
+
+# by database path: the connections of a catalog are reused, whoever opens it
+_catalogs: dict[Path, Catalog] = {}
+_catalog_lock = threading.Lock()
+
+
+def _catalog_at(path: Path) -> Catalog:
+    catalog = _catalogs.get(path)
+    if catalog is None:
+        with _catalog_lock:
+            catalog = _catalogs.get(path)
+            if catalog is None:
+                catalog = _catalogs[path] = Catalog(path)
+    return catalog
+
+
+def get_catalog() -> Catalog | None:
+    """Get the catalog of the root path, None if the catalog is disabled."""
+    if config.get("FUNCTION_SAVER_CATALOG", "0") != "1":
+        return None
+    return _catalog_at(Path(config.root_path) / CATALOG_FILE)
+
+
+def add_to_catalog(record: CaptureRecord, writer: CatalogWriter, write_duration: float):
+    """Add a written capture to the catalog. An error is logged: it doesn't fail the capture."""
+    catalog = get_catalog()
+    if catalog is None:
+        return
+    try:
+        catalog.add(record, writer, write_duration)
+    except Exception as e:
+        logger.error(f"Function saver: capture {record.capture_id} not added to the catalog. {e}")
+
+
+def remove_from_catalog(capture_ids: Iterable[str]):
+    """Remove captures from the catalog, if it is enabled. An error is logged."""
+    catalog = get_catalog()
+    if catalog is None:
+        return
+    try:
+        catalog.remove(capture_ids)
+    except Exception as e:
+        logger.error(f"Function saver: captures not removed from the catalog. {e}")
+
+
+def find_captures(
+    function: str | None = None,
+    where: dict[str, Any] | None = None,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    limit: int | None = 50,
+    root_path: str | Path | None = None,
+) -> list[CaptureInfo]:
+    """
+    Find captures in the catalog, newest first.
+
+    Args:
+        function: the name, or the qualified name (module.qualname), of the function. Default is all the functions.
+        where: conditions on the inputs, by argument name: a value ({"x": 3}),
+            or an operator =, !=, <, <=, >, >= and a value ({"x": (">", 3)}).
+            Only the numbers, strings and booleans are recorded with their value.
+        since: the captures from this date
+        until: the captures before this date
+        limit: the max number of captures, None for all
+        root_path: the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH
+
+    Returns:
+        The captures: their capture_id is what replay_function takes
+
+    Raises:
+        ValueError: if an operator is invalid
+        FileNotFoundError: if there is no catalog in the root path
+    """
+    path = Path(root_path or config.root_path) / CATALOG_FILE
+    if not path.is_file():
+        raise FileNotFoundError(f"No catalog in {path.parent}: FUNCTION_SAVER_CATALOG=1 enables it")
+    return _catalog_at(path).find(function, where, since, until, limit)
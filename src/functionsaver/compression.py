@@ -0,0 +1,129 @@
+"""
+Compression of the captured data. A compression is given as "<codec>[:<level>]":
+    - none: no compression (default)
+    - zlib, gzip, bz2, lzma: from the standard library
+    - zstd, lz4: if zstandard / lz4 are installed
+    - fast: the preset for the capture latency rather than the ratio: zstd:1, else lz4, else zlib:1
+
+It is chosen:
+    - per variable, with the compression parameter of the decorator: {"image": "zstd:3", "output": "none"}
+    - per function: FUNCTION_SAVER_COMPRESSION_<FUNCTION NAME>, or FUNCTION_SAVER_COMPRESSION_ALL
+    - for all the variables of a function, with the compression parameter of the decorator: "lzma"
+in this order of precedence.
+
+The codec is the last suffix of the file name (i.e. image.npy.zstd): the replay decompresses transparently.
+"""
+
+import bz2
+import gzip
+import lzma
+import zlib
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # optional
+    lz4 = None
+
+
+class Codec(NamedTuple):
+    """
+    A compression codec: its name (the file suffix), its default level,
+    the factory of its streaming compressors (with compress(data) and flush() methods), and its decompress function.
+    """
+
+    name: str
+    default_level: int | None
+    compressor: Callable[[int | None], Any]
+    decompress: Callable[[bytes], bytes]
+
+
+class _Lz4Compressor:
+    """lz4.frame compressor, with the compress / flush interface of the standard library compressors."""
+
+    def __init__(self, level: int | None):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level or 0)
+        self._begin = self._compressor.begin()
+
+    def compress(self, data) -> bytes:
+        compressed = self._begin + self._compressor.compress(data)
+        self._begin = b""
+        return compressed
+
+    def flush(self) -> bytes:
+        return self._begin + self._compressor.flush()
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    # the frames written by a streaming compressor don't have their size: decompressed in streaming too
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+CODECS: dict[str, Codec] = {
+    "zlib": Codec("zlib", 6, lambda level: zlib.compressobj(level), zlib.decompress),
+    "gzip": Codec("gzip", 6, lambda level: zlib.compressobj(level, wbits=31), gzip.decompress),
+    "bz2": Codec("bz2", 9, lambda level: bz2.BZ2Compressor(level), bz2.decompress),
+    "lzma": Codec("lzma", 6, lambda level: lzma.LZMACompressor(preset=level), lzma.decompress),
+}
+if zstandard is not None:
+    CODECS["zstd"] = Codec("zstd", 3, lambda level: zstandard.ZstdCompressor(level=level).compressobj(), _zstd_decompress)
+if lz4 is not None:
+    CODECS["lz4"] = Codec("lz4", 0, _Lz4Compressor, lz4.frame.decompress)
+
+_OPTIONAL_CODECS = {"zstd": "zstandard", "lz4": "lz4"}
+
+
+class Compression(NamedTuple):
+    """A codec and its level. The codec is None for no compression."""
+
+    codec: Codec | None
+    level: int | None = None
+
+    def compress(self, chunks: Iterable[bytes | memoryview]) -> Iterator[bytes]:
+        """Compress the data given as chunks, in streaming: the compressed data is produced as chunks."""
+        compressor = self.codec.compressor(self.level)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+NO_COMPRESSION = Compression(None)
+
+
+def fast_compression() -> Compression:
+    """The preset for the capture latency: zstd:1, else lz4, else zlib:1"""
+    if "zstd" in CODECS:
+        return Compression(CODECS["zstd"], 1)
+    if "lz4" in CODECS:
+        return Compression(CODECS["lz4"], 0)
+    return Compression(CODECS["zlib"], 1)
+
+
+def parse_compression(spec: str) -> Compression:
+    """
+    Parse a compression "<codec>[:<level>]", "none" or "fast"
+
+    Raises:
+        ValueError: if the compression is invalid, or if its codec is not installed
+    """
+    name, _, level = spec.strip().lower().partition(":")
+    if name == "none":
+        return NO_COMPRESSION
+    if name == "fast":
+        return fast_compression()
+    if name in _OPTIONAL_CODECS and name not in CODECS:
+        raise ValueError(f"Invalid compression {spec}: pip install {_OPTIONAL_CODECS[name]} to use {name}")
+    if name not in CODECS:
+        raise ValueError(f"Invalid compression {spec}: expected none, fast or one of {', '.join(CODECS)}")
+    codec = CODECS[name]
+    try:
+        return Compression(codec, int(level) if level else codec.default_level)
+    except ValueError:
+        raise ValueError(f"Invalid compression {spec}: the level must be an integer") from None
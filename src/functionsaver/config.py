@@ -0,0 +1,192 @@
+"""
+The function saver configuration: a snapshot of the FUNCTION_SAVER_* environment variables.
+
+The environment is read once (at import), not at each call of a decorated function:
+call reload_config() after changing the environment variables.
+
+FUNCTION_SAVER_COMPILE_OUT=1 makes function_saver return the decorated functions untouched (no wrapper at all).
+It is read at decoration time: it must be set before importing the modules with decorated functions.
+"""
+
+import os
+import tempfile
+import weakref
+
+from .compression import Compression, parse_compression
+from .logger import get_logger
+from .profiling import ProfileMode, parse_profile_mode
+from .sampling import SamplingPolicy, parse_sampling_policy
+
+logger = get_logger()
+
+_SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size in bytes, with an optional suffix K, M, G or T (powers of 1024), i.e. "10G"
+
+    Raises:
+        ValueError: if the size is invalid
+    """
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in _SIZE_SUFFIXES:
+        return int(float(size[:-1]) * _SIZE_SUFFIXES[size[-1]])
+    return int(size)
+
+
+_DEFAULT_PROFILE_TOP = 30
+
+
+class FunctionSettings:
+    """
+    The settings of one decorated function, updated by reload_config.
+    They are plain attributes, so that checking if a call must be saved is a single attribute read.
+    """
+
+    __slots__ = (
+        "function_name",
+        "save",
+        "save_internals",
+        "sampling",
+        "compression",
+        "snapshot",
+        "profile",
+        "profile_sampling",
+        "profile_top",
+        "__weakref__",
+    )
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.save = False
+        self.save_internals = False
+        self.sampling: SamplingPolicy | None = None
+        self.compression: Compression | None = None
+        self.snapshot = True
+        self.profile: ProfileMode | None = None
+        self.profile_sampling: SamplingPolicy | None = None
+        self.profile_top = _DEFAULT_PROFILE_TOP
+        self.update(config)
+        _function_settings.add(self)
+
+    def update(self, config_: "Config"):
+        upper_name = self.function_name.upper()
+        self.save = config_.save_all or config_.get(f"FUNCTION_SAVER_{upper_name}") == "1"
+        self.save_internals = (
+            config_.save_internals_all or config_.get(f"FUNCTION_SAVER_INTERNALS_{upper_name}") == "1"
+        )
+        self.sampling = None
+        sampling_spec = config_.get(f"FUNCTION_SAVER_SAMPLING_{upper_name}", config_.get("FUNCTION_SAVER_SAMPLING_ALL"))
+        if sampling_spec:
+            try:
+                self.sampling = parse_sampling_policy(sampling_spec)
+            except ValueError as e:
+                logger.error(f"{e}. All the calls of {self.function_name} will be saved.")
+        self.compression = None
+        compression_spec = config_.get(
+            f"FUNCTION_SAVER_COMPRESSION_{upper_name}", config_.get("FUNCTION_SAVER_COMPRESSION_ALL")
+        )
+        if compression_spec:
+            try:
+                self.compression = parse_compression(compression_spec)
+            except ValueError as e:
+                logger.error(f"{e}. The captures of {self.function_name} will not be compressed.")
+        self.snapshot = (
+            config_.get(f"FUNCTION_SAVER_SNAPSHOT_{upper_name}", config_.get("FUNCTION_SAVER_SNAPSHOT_ALL", "1")) != "0"
+        )
+        self.profile = None
+        self.profile_sampling = None
+        profile_spec = config_.get(f"FUNCTION_SAVER_PROFILE_{upper_name}", config_.get("FUNCTION_SAVER_PROFILE_ALL"))
+        if profile_spec:
+            try:
+                self.profile = parse_profile_mode(profile_spec)
+            except ValueError as e:
+                logger.error(f"{e}. The calls of {self.function_name} will not be profiled.")
+        profile_sampling_spec = config_.get(
+            f"FUNCTION_SAVER_PROFILE_SAMPLING_{upper_name}", config_.get("FUNCTION_SAVER_PROFILE_SAMPLING_ALL")
+        )
+        if self.profile is not None and profile_sampling_spec:
+            try:
+                self.profile_sampling = parse_sampling_policy(profile_sampling_spec)
+            except ValueError as e:
+                logger.error(f"{e}. All the captured calls of {self.function_name} will be profiled.")
+        self.profile_top = _DEFAULT_PROFILE_TOP
+        profile_top_spec = config_.get("FUNCTION_SAVER_PROFILE_TOP")
+        if self.profile is not None and profile_top_spec:
+            try:
+                self.profile_top = int(profile_top_spec)
+            except ValueError:
+                logger.error(
+                    f"Invalid FUNCTION_SAVER_PROFILE_TOP {profile_top_spec}. "
+                    f"The reports of {self.function_name} will have {_DEFAULT_PROFILE_TOP} lines."
+                )
+
+
+_function_settings: weakref.WeakSet[FunctionSettings] = weakref.WeakSet()
+
+
+class Config:
+    """The global settings, see the module documentation."""
+
+    def __init__(self):
+        self.environ = {}
+        self.save_all = False
+        self.save_internals_all = False
+        self.verbose = False
+        self.background = False
+        self.compile_out = False
+        self.root_path = ""
+        #: the retention budget (see retention.py), None for no limit
+        self.max_bytes: int | None = None
+        self.max_captures: int | None = None
+        self.retention_refuse = False
+        self.reload()
+
+    def get(self, name: str, default: str | None = None) -> str | None:
+        """Get a FUNCTION_SAVER_* variable from the snapshot of the environment."""
+        return self.environ.get(name, default)
+
+    def reload(self):
+        """Read again the environment variables, and update the settings of all the decorated functions."""
+        self.environ = {name: value for name, value in os.environ.items() if name.startswith("FUNCTION_SAVER_")}
+        self.save_all = self.get("FUNCTION_SAVER_ALL", "0") == "1"
+        self.save_internals_all = self.get("FUNCTION_SAVER_INTERNALS_ALL", "0") == "1"
+        self.verbose = self.get("FUNCTION_SAVER_LOG", "0") == "1"
+        self.background = self.get("FUNCTION_SAVER_BACKGROUND", "0") == "1"
+        self.compile_out = self.get("FUNCTION_SAVER_COMPILE_OUT", "0") == "1"
+        self.root_path = self.get("FUNCTION_SAVER_ROOT_PATH", tempfile.gettempdir() + "/function_saver")
+        self._reload_retention()
+        for settings in list(_function_settings):
+            settings.update(self)
+
+
+    def _reload_retention(self):
+        self.max_bytes = None
+        max_bytes = self.get("FUNCTION_SAVER_MAX_BYTES")
+        if max_bytes:
+            try:
+                self.max_bytes = parse_size(max_bytes)
+            except ValueError:
+                logger.error(f"Invalid FUNCTION_SAVER_MAX_BYTES {max_bytes}. The size of the captures is not limited.")
+        self.max_captures = None
+        max_captures = self.get("FUNCTION_SAVER_MAX_CAPTURES")
+        if max_captures:
+            try:
+                self.max_captures = int(max_captures)
+            except ValueError:
+                logger.error(
+                    f"Invalid FUNCTION_SAVER_MAX_CAPTURES {max_captures}. The number of captures is not limited."
+                )
+        retention = self.get("FUNCTION_SAVER_RETENTION", "evict")
+        if retention not in ("evict", "refuse"):
+            logger.error(f"Invalid FUNCTION_SAVER_RETENTION {retention}: expected evict or refuse. evict is used.")
+        self.retention_refuse = retention == "refuse"
+
+
+config = Config()
+
+
+def reload_config():
+    """Read again the FUNCTION_SAVER_* environment variables."""
+    config.reload()
@@ -16,6 +16,20 @@ class ContextData:
         self._option_save_out = contextvars.ContextVar("THREAD_LOCAL_OPTION_SAVE_OUT", default=True)
         self._option_save_internals = contextvars.ContextVar("THREAD_LOCAL_OPTION_SAVE_INTERNALS", default=True)
         self._initialized = contextvars.ContextVar("THREAD_LOCAL_INITIALIZED", default=False)
+        self._pending_internals = contextvars.ContextVar("THREAD_LOCAL_PENDING_INTERNALS", default=None)
+
+    def begin_call(self, **values) -> list[contextvars.Token]:
+        """
+        Set the context data for a saved call, i.e. begin_call(save_internals=True, internal_folder=None)
+        The returned tokens must be given to end_call after the call, to restore the previous values.
+        """
+        return [getattr(self, f"_{name}").set(value) for name, value in values.items()]
+
+    @staticmethod
+    def end_call(tokens: list[contextvars.Token]):
+        """Restore the context data as it was before begin_call"""
+        for token in reversed(tokens):
+            token.var.reset(token)
 
     @property
     def save_internals(self):
@@ -72,3 +86,11 @@ class ContextData:
     @initialized.setter
     def initialized(self, value):
         self._initialized.set(value)
+
+    @property
+    def pending_internals(self):
+        return self._pending_internals.get()
+
+    @pending_internals.setter
+    def pending_internals(self, value):
+        self._pending_internals.set(value)
@@ -1,2 +1,6 @@
 class ReplayException(Exception):
     pass
+
+
+class SerializationSkipped(Exception):
+    """A value not serialized: its serializer already failed with such a value (see serializers._serialize)"""
@@ -12,22 +12,56 @@ import contextvars
 import datetime
 import functools
 import inspect
-import os
 import shutil
-import tempfile
+import time
 from contextlib import contextmanager, asynccontextmanager
 from functools import wraps
 from pathlib import Path
 from typing import Callable, Any
 
-import aiofiles
 import jsons
+import numpy as np
 
+from .async_capture import submit_capture
+from .blob_store import get_blob_store
+from .capture_plan import CapturePlan
+from .catalog import CaptureRecord, CatalogWriter, add_to_catalog, get_catalog
+from .compression import Compression, parse_compression
+from .config import config, FunctionSettings
 from .context_data import ContextData
-from .exception import ReplayException
+from .exception import ReplayException, SerializationSkipped
+from .jsons_numpy import collecting_sidecar_arrays, resolving_sidecar_arrays, sidecar_name
 from .logger import get_logger
+from .manifest import ManifestWriter, verify_entry
+from .metrics import CaptureMetrics, capture_metrics
+from .profiling import PROFILE_SECTION, new_call_profiler
 from .replay_compare_shortcut import produce_replay_compare_shortcuts
-from .serializers import _get_serializer, _get_deserializer
+from .retention import get_retention
+from .serializers import (
+    SerializerEntry,
+    _default_serializer,
+    _get_serializer_entry,
+    _get_deserializer,
+    _get_map_deserializer,
+    _serialize,
+)
+from .snapshot import SnapshotStats, snapshot
+from .timing import CaptureTiming, TimingWriter
+from .storage import (
+    BufferedEntry,
+    CaptureReader,
+    CaptureStorage,
+    CaptureWriter,
+    DirectoryCaptureReader,
+    DirectoryCaptureWriter,
+    MANIFEST_FILE,
+    METADATA_FILE,
+    capture_path,
+    create_capture_writer,
+    get_capture_storage,
+    open_capture,
+)
+from .writer_pool import get_writer_pool
 
 logger = get_logger()
 
@@ -38,61 +72,296 @@ _function_saver_replaying = contextvars.ContextVar(
 _function_saver_replaying_already_delete = contextvars.ContextVar(
     "FUNCTION_SAVER_REPLAYING_ALREADY_DELETE", default="0"
 )
-_function_saver_replaying_folder = contextvars.ContextVar(
-    "FUNCTION_SAVER_REPLAYING_FOLDER", default=""
+_function_saver_replaying_capture: contextvars.ContextVar[CaptureReader | None] = contextvars.ContextVar(
+    "FUNCTION_SAVER_REPLAYING_CAPTURE", default=None
 )
 
 
 @contextmanager
-def replaying(replaying_folder: Path):
+def replaying(capture: CaptureReader):
     _function_saver_replaying.set("1")
     _function_saver_replaying_already_delete.set("0")
-    _function_saver_replaying_folder.set(str(replaying_folder))
+    _function_saver_replaying_capture.set(capture)
     try:
-        produce_replay_compare_shortcuts(replaying_folder)
+        # the shortcuts compare folders: only for captures stored as folders
+        if isinstance(capture, DirectoryCaptureReader):
+            produce_replay_compare_shortcuts(capture.replay_folder)
         yield
     finally:
         _function_saver_replaying.set("0")
 
 
 @asynccontextmanager
-async def replaying_async(replaying_folder: Path):
+async def replaying_async(capture: CaptureReader):
     _function_saver_replaying.set("1")
     _function_saver_replaying_already_delete.set("0")
-    _function_saver_replaying_folder.set(str(replaying_folder))
+    _function_saver_replaying_capture.set(capture)
     try:
-        produce_replay_compare_shortcuts(replaying_folder)
+        if isinstance(capture, DirectoryCaptureReader):
+            produce_replay_compare_shortcuts(capture.replay_folder)
         yield
     finally:
         _function_saver_replaying.set("0")
 
 
-def _do_serialize(object_type: type, object_, folder: Path, file_name: str):
-    object_dynamic_type = type(object_)
-    serializer, extension = _get_serializer(object_type, object_dynamic_type)
+def _write_entry(
+    writer: CaptureWriter,
+    serializer_entry: SerializerEntry,
+    object_,
+    section: str,
+    file_name: str,
+    compression: Compression | None = None,
+) -> int:
+    """
+    Serialize object_ with an already resolved serializer, to the entry file_name.extension of a capture section.
+    The data produced as chunks (i.e. numpy arrays) are streamed to the destination.
+    Compressed data is written to file_name.extension.codec (see compression.py), except by the serializers
+    compressing their data themselves (i.e. the shuffled arrays, see shuffle.py): they are given the compression.
+    The large arrays nested in an object saved to json are written to their own .npy entries (see jsons_numpy.py).
+
+    Returns:
+        The size written (in characters for text files)
+
+    Raises:
+        SerializationSkipped: if this serializer already failed with the type of object_ (see _serialize)
+    """
+    sidecar_arrays = []
+    if serializer_entry.serializer is _default_serializer:
+        with collecting_sidecar_arrays() as sidecar_arrays:
+            data = _serialize(serializer_entry, object_)
+    elif serializer_entry.compressing:
+        data = _serialize(serializer_entry, object_, compression)
+        compression = None  # compressed by the serializer, which records its codec in the data
+    else:
+        data = _serialize(serializer_entry, object_)
+    entry_name = f"{file_name}.{serializer_entry.extension}"
+    if compression is not None:
+        if isinstance(data, (str, bytes)):
+            data = [data.encode() if isinstance(data, str) else data]
+        size = writer.write_chunks(section, f"{entry_name}.{compression.codec.name}", compression.compress(data))
+    elif isinstance(data, (str, bytes)):
+        size = writer.write(section, entry_name, data)
+    else:
+        size = writer.write_chunks(section, entry_name, data)
+    for index, array in enumerate(sidecar_arrays):
+        size += _write_entry(
+            writer,
+            _get_serializer_entry(np.ndarray, np.ndarray),
+            array,
+            section,
+            sidecar_name(file_name, index),
+            compression,
+        )
+    return size
+
+
+def _save_error(message: str, error: Exception, metrics: CaptureMetrics | None):
+    """
+    Log an error while saving a value, and count it in the failed metric of the function.
+    A skipped value (see SerializationSkipped) is only counted: it is skipped at each call, its failure was logged.
+    """
+    if not isinstance(error, SerializationSkipped):
+        logger.error(message)
+    if metrics is not None:
+        metrics.failed.inc()
+
+
+def _write_entries(
+    writer: CaptureWriter, entries: list[tuple], function_name: str, metrics: CaptureMetrics | None = None
+) -> int:
+    """
+    Write the entries (serializer_entry, object_, section, file_name, compression) of a capture.
+    object_ can be a BufferedEntry: the entry was already serialized, its files are written as they are.
+    An error doesn't stop the others, it is counted in the failed metric of the function.
+
+    Returns:
+        The total size written
+    """
+    size = 0
+    for entry in entries:
+        try:
+            if isinstance(entry[1], BufferedEntry):
+                # already serialized (see _buffer_entry)
+                size += entry[1].write_to(writer)
+            else:
+                size += _write_entry(writer, *entry)
+        except Exception as e:
+            _save_error(f"Error while saving {entry[3]} of function {function_name}. {e}.", e, metrics)
+    return size
+
+
+def _write_entries_and_close(
+    writer: CaptureWriter,
+    entries: list[tuple],
+    function_name: str,
+    record: CaptureRecord | None = None,
+    timing: CaptureTiming | None = None,
+    metrics: CaptureMetrics | None = None,
+    declared_types: dict[tuple[str, str], str] | None = None,
+) -> int:
+    """
+    _write_entries, then the manifest of the capture (see manifest.py), then its metadata with its timing
+    (see timing.py), then close the writer.
+    With a catalog record, the entries are hashed as they are written, then the capture is added to the catalog.
+
+    Returns:
+        The total size written
+    """
+    catalog_writer = None
+    if record is not None:
+        writer = catalog_writer = CatalogWriter(writer, entries)
+    writer = manifest_writer = ManifestWriter(writer, entries, declared_types)
+    if timing is not None:
+        writer = TimingWriter(writer)
+    start = time.perf_counter()
+    try:
+        size = _write_entries(writer, entries, function_name, metrics)
+        size += writer.write("", MANIFEST_FILE, manifest_writer.to_json())
+        if timing is not None:
+            timing.io = writer.io
+            timing.serialization = time.perf_counter() - start - writer.io
+            size += writer.write("", METADATA_FILE, timing.to_json())
+    finally:
+        writer.close()
+    if catalog_writer is not None:
+        add_to_catalog(record, catalog_writer, time.perf_counter() - start)
+    return size
+
+
+def _buffer_entry(
+    object_type: type, object_, file_name: str, compression: Compression | None = None
+) -> BufferedEntry:
+    """Serialize object_ in memory, to the internal entry file_name.extension written later with its capture."""
+    buffered = BufferedEntry(object_)
+    serializer_entry = _get_serializer_entry(object_type, type(object_))
+    _write_entry(buffered, serializer_entry, object_, "internal", file_name, compression)
+    return buffered
+
 
-    # let's check if the serializer returns a string or bytes to open accordingly the file:
-    mode = "w"
-    if inspect.signature(serializer).return_annotation == bytes:
-        mode = "wb"
-    with open(folder / f"{file_name}.{extension}", mode) as f:
-        f.write(serializer(object_))
+def _do_serialize(
+    object_type: type, object_, folder: Path, file_name: str, compression: Compression | None = None
+) -> int:
+    """Serialize object_ to folder / file_name.extension: the internals written during the call, and the replays."""
+    return _write_entry(
+        DirectoryCaptureWriter(folder.parent, [], hash_entries=False),
+        _get_serializer_entry(object_type, type(object_)),
+        object_,
+        folder.name,
+        file_name,
+        compression,
+    )
 
 
-async def _do_serialize_async(object_type: type, object_, folder: Path, file_name: str):
-    object_dynamic_type = type(object_)
-    serializer, extension = _get_serializer(object_type, object_dynamic_type)
+async def _do_serialize_async(
+    object_type: type, object_, folder: Path, file_name: str, compression: Compression | None = None
+) -> int:
+    """The async version of _do_serialize: the serialization and the write are done in the capture executor."""
+    return await submit_capture(_do_serialize, object_type, object_, folder, file_name, compression)
 
-    # Let's check if the serializer returns a string or bytes to open accordingly the file:
-    mode = "w"
-    if inspect.signature(serializer).return_annotation == bytes:
-        mode = "wb"
 
-    async with aiofiles.open(folder / f"{file_name}.{extension}", mode) as f:
-        await f.write(serializer(object_))
+def _write_capture(
+    storage: CaptureStorage,
+    save_path: Path,
+    sections: list[str],
+    entries: list[tuple],
+    function_name: str,
+    save_folder_filesystem_link: str,
+    record: CaptureRecord | None = None,
+    timing: CaptureTiming | None = None,
+    metrics: CaptureMetrics | None = None,
+    declared_types: dict[tuple[str, str], str] | None = None,
+) -> int:
+    """
+    Write a whole capture: create it (folders or container, see storage.py) then serialize its entries.
+    This is the job run by the background writer pool, and by the capture executor for async functions.
+
+    Args:
+        storage: the storage format of the capture
+        save_path: the path of the capture
+        sections: the sections to create (inputs, output, internal)
+        entries: tuples (serializer_entry, object_, section, file_name), as taken by _write_entries
+        function_name: the name of the saved function, for the logs
+        save_folder_filesystem_link: the link to the capture, for the logs
+        record: the record of the capture in the catalog, None if the catalog is disabled (see catalog.py)
+        timing: the timing of the call, completed with the timing of the write and saved in the metadata
+        metrics: the metrics of the function, counting the errors (see metrics.py)
+        declared_types: the annotations of the entries by (section, name), for the manifest (see manifest.py)
+
+    Returns:
+        The total size written
+    """
+    try:
+        writer = create_capture_writer(storage, save_path, sections)
+        size = _write_entries_and_close(writer, entries, function_name, record, timing, metrics, declared_types)
+        logger.debug(
+            f"Data of function {function_name} saved to: {save_folder_filesystem_link}"
+        )
+        return size
+    except Exception as e:
+        logger.error(f"Error while saving in out of function {function_name}. {e}.")
+        if metrics is not None:
+            metrics.failed.inc()
+        return 0
+
+
+def _track_capture_size(save_folder: Path, size: int, metrics: CaptureMetrics | None = None, end: bool = False):
+    """
+    Account the size written for a capture, for the retention (see retention.py) and the metrics.
+    end: the write of the capture is over, it is no longer pending for the retention.
+    """
+    if metrics is not None:
+        metrics.written_bytes.inc(size)
+    retention = get_retention()
+    if retention is not None:
+        if end:
+            retention.end_capture(save_folder, size)
+        else:
+            retention.add_bytes(save_folder, size)
+
+
+def _drop_capture(save_folder: Path, metrics: CaptureMetrics):
+    """A capture dropped by the writer pool (see writer_pool.py): counted, and no longer tracked by the retention."""
+    metrics.dropped.inc()
+    retention = get_retention()
+    if retention is not None:
+        retention.cancel_capture(save_folder)
+
+
+def _write_capture_and_track_size(
+    save_folder: Path,
+    *args,
+    metrics: CaptureMetrics | None = None,
+    declared_types: dict[tuple[str, str], str] | None = None,
+):
+    """_write_capture then _track_capture_size: the job run by the background writer pool."""
+    size = _write_capture(*args, metrics=metrics, declared_types=declared_types)
+    _track_capture_size(save_folder, size, metrics, end=True)
 
 
-def function_saver(*args, save_in=True, save_out=True, save_internals=True):
+def _save_internal_compiled_out(var_value, var_name, serializer_type=None):
+    pass
+
+
+async def _save_internal_async_compiled_out(var_value, var_name, serializer_type=None):
+    pass
+
+
+def _is_save_internal_enabled_compiled_out() -> bool:
+    return False
+
+
+def _compile_out(func_: Callable) -> Callable:
+    """
+    Return the function untouched (FUNCTION_SAVER_COMPILE_OUT=1), except the function saver methods,
+    added as no-ops so that the calls to them in the function body still work.
+    """
+    func_.save_internal = _save_internal_compiled_out
+    func_.save_internal_async = _save_internal_async_compiled_out
+    func_.is_save_internal_enabled = _is_save_internal_enabled_compiled_out
+    return func_
+
+
+def function_saver(*args, save_in=True, save_out=True, save_internals=True, compression=None):
     def decorator(func_: Callable) -> Callable:
         """
         Decorator to save inputs and output of a function to a folder.
@@ -103,13 +372,29 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
           - Variables for def one_function(...):
             - FUNCTION_SAVER_ONE_FUNCTION=1 to enable saving
             - FUNCTION_SAVER_INTERNALS_ONE_FUNCTION=1 to enable saving internal variables
+            - FUNCTION_SAVER_SAMPLING_ONE_FUNCTION=<spec> to save only some calls (see sampling.py)
+            - FUNCTION_SAVER_COMPRESSION_ONE_FUNCTION=<codec>[:<level>] to compress the captures (see compression.py)
+            - FUNCTION_SAVER_SNAPSHOT_ONE_FUNCTION=0 to save the inputs after the call, not copied (see snapshot.py)
+            - FUNCTION_SAVER_PROFILE_ONE_FUNCTION=1|memory to profile the captured calls (see profiling.py)
+            - FUNCTION_SAVER_PROFILE_SAMPLING_ONE_FUNCTION=<spec> to profile only some captured calls
 
         - Global variables (for all decorated functions):
             - FUNCTION_SAVER_ROOT_PATH to set the root path where to save the data.
                 Default is the system temp folder / function_saver
             - FUNCTION_SAVER_ALL=1 to enable saving
             - FUNCTION_SAVER_INTERNALS_ALL=1 to enable saving internal variables
+            - FUNCTION_SAVER_SAMPLING_ALL=<spec> to save only some calls (see sampling.py)
+            - FUNCTION_SAVER_COMPRESSION_ALL=<codec>[:<level>] to compress the captures (see compression.py)
+            - FUNCTION_SAVER_SNAPSHOT_ALL=0 to save the inputs after the call, not copied (see snapshot.py)
+            - FUNCTION_SAVER_PROFILE_ALL=1|memory to profile the captured calls (see profiling.py)
+            - FUNCTION_SAVER_PROFILE_SAMPLING_ALL=<spec> to profile only some captured calls
             - FUNCTION_SAVER_LOG=1 to enable logging (global for all functions)
+            - FUNCTION_SAVER_BACKGROUND=1 to write the captures in background threads (see writer_pool.py)
+            - FUNCTION_SAVER_COMPILE_OUT=1 to return the decorated functions untouched, read at decoration time.
+            - FUNCTION_SAVER_STORAGE=directory|zip|segment to choose how the captures are stored (see storage.py)
+            - FUNCTION_SAVER_CATALOG=1 to index the captures in a sqlite catalog (see catalog.py)
+
+        The environment variables are read once: call reload_config() after changing them (see config.py).
 
         Usage exemple:
         ```python
@@ -121,10 +406,73 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
         ```
 
         """
+        if config.compile_out:
+            return _compile_out(func_)
+
         thread_data = ContextData()
+        settings = FunctionSettings(func_.__name__)
+        qualified_name = f"{func_.__module__}.{func_.__qualname__}"
+        metrics = capture_metrics(qualified_name)
+        latency = metrics.latency
+        capture_plan = None
+        # compression parameter: a compression for all the variables, or one per variable
+        default_compression = None
+        variable_compressions = {}
+        if isinstance(compression, dict):
+            variable_compressions = {name: parse_compression(spec) for name, spec in compression.items()}
+        elif compression is not None:
+            default_compression = parse_compression(compression)
+
+        def compression_of(name: str) -> Compression | None:
+            """The compression of a variable (None for no compression), see compression.py for the precedence."""
+            compression_ = variable_compressions.get(name) or settings.compression or default_compression
+            if compression_ is None or compression_.codec is None:
+                return None
+            return compression_
+
+        def get_capture_plan() -> CapturePlan:
+            # built at the first capture, then reused: no reflection at each call
+            # (built again if a serializer was registered meanwhile)
+            nonlocal capture_plan
+            if capture_plan is None or capture_plan.is_outdated():
+                capture_plan = CapturePlan(func_)
+            return capture_plan
+
+        snapshot_stats = SnapshotStats()
+
+        def snapshot_inputs(args_: tuple, kwargs: dict, timing: CaptureTiming) -> dict[str, Any] | None:
+            """The inputs to save, copied before the call (see snapshot.py). None if they are saved after the call."""
+            if not thread_data.option_save_in or not settings.snapshot:
+                return None
+            start = time.perf_counter()
+            try:
+                inputs = get_capture_plan().snapshot_inputs(args_, kwargs)
+            except Exception as e:
+                log(f"Inputs of {func_.__name__} not copied, they are saved after the call. {e}")
+                return None
+            duration = timing.snapshot = time.perf_counter() - start
+            snapshot_stats.add(duration)
+            log(f"Inputs of {func_.__name__} copied in {duration * 1000:.3f} ms")
+            return inputs
+
+        def timed_call(args_: tuple, kwargs: dict) -> Any:
+            """Call the function, recording its duration in its latency histogram (see timing.py)"""
+            start = time.perf_counter_ns()
+            try:
+                return func_(*args_, **kwargs)
+            finally:
+                latency.record(time.perf_counter_ns() - start)
+
+        async def timed_call_async(args_: tuple, kwargs: dict) -> Any:
+            """The async version of timed_call"""
+            start = time.perf_counter_ns()
+            try:
+                return await func_(*args_, **kwargs)
+            finally:
+                latency.record(time.perf_counter_ns() - start)
 
         def log(message: str):
-            if thread_data.verbose:
+            if config.verbose:
                 separator = " "
                 if message and message[0] == ">":
                     separator = ""
@@ -132,13 +480,8 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
 
         def is_save_internal_enabled() -> bool:
             if _function_saver_replaying.get() == "1":
-                internal_folder = (
-                    Path(_function_saver_replaying_folder.get()) / "internal"
-                )
                 # if internal data were saved:
-                if internal_folder.exists():
-                    return True
-                return False
+                return _function_saver_replaying_capture.get().has_section("internal")
             return thread_data.option_save_internals and thread_data.save_internals
 
         def save_internal(var_value, var_name, serializer_type=None):
@@ -155,15 +498,13 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
             """
             destination_folder = thread_data.internal_folder
             if _function_saver_replaying.get() == "1":
-                destination_folder = (
-                    Path(_function_saver_replaying_folder.get()) / "internal"
-                )
+                replaying_capture = _function_saver_replaying_capture.get()
                 # if internal data were saved, we save also when replaying.
-                if not destination_folder.exists():
+                if not replaying_capture.has_section("internal"):
                     return
                 thread_data.option_save_internals = True
                 thread_data.save_internals = True
-                destination_folder /= "../internal_replay"
+                destination_folder = replaying_capture.replay_folder / "internal_replay"
                 if _function_saver_replaying_already_delete.get() == "0":
                     shutil.rmtree(destination_folder, ignore_errors=True)
                     _function_saver_replaying_already_delete.set("1")
@@ -175,12 +516,26 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
             log(f">>>>>>>> Saving internal variable {var_name}")
             if serializer_type is None:
                 serializer_type = type(var_value)
+            pending_internals = thread_data.pending_internals
+            if pending_internals is not None:
+                # the internal is written with the rest of the capture (background mode, or not a folder capture):
+                # serialized now, the caller may modify it meanwhile
+                try:
+                    buffered = _buffer_entry(serializer_type, var_value, var_name, compression_of(var_name))
+                except Exception as e:
+                    message = f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
+                    _save_error(message, e, metrics)
+                    return
+                pending_internals.append((None, buffered, "internal", var_name, None))
+                return
+            # the replays are not compressed
+            internal_compression = None if _function_saver_replaying.get() == "1" else compression_of(var_name)
             try:
-                _do_serialize(serializer_type, var_value, destination_folder, var_name)
+                size = _do_serialize(serializer_type, var_value, destination_folder, var_name, internal_compression)
+                _track_capture_size(destination_folder.parent, size, metrics)
             except Exception as e:
-                logger.error(
-                    f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
-                )
+                message = f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
+                _save_error(message, e, metrics)
 
         async def save_internal_async(var_value, var_name, serializer_type=None):
             """
@@ -196,15 +551,13 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
             """
             destination_folder = thread_data.internal_folder
             if _function_saver_replaying.get() == "1":
-                destination_folder = (
-                    Path(_function_saver_replaying_folder.get()) / "internal"
-                )
+                replaying_capture = _function_saver_replaying_capture.get()
                 # if internal data were saved, we save also when replaying.
-                if not destination_folder.exists():
+                if not replaying_capture.has_section("internal"):
                     return
                 thread_data.option_save_internals = True
                 thread_data.save_internals = True
-                destination_folder /= "../internal_replay"
+                destination_folder = replaying_capture.replay_folder / "internal_replay"
                 if _function_saver_replaying_already_delete.get() == "0":
                     shutil.rmtree(destination_folder, ignore_errors=True)
                     _function_saver_replaying_already_delete.set("1")
@@ -216,177 +569,278 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
             log(f">>>>>>>> Saving internal variable {var_name}")
             if serializer_type is None:
                 serializer_type = type(var_value)
+            pending_internals = thread_data.pending_internals
+            if pending_internals is not None:
+                # not a folder capture: the internal is written with the rest of the capture,
+                # serialized now in the capture executor, the caller may modify it meanwhile
+                try:
+                    buffered = await submit_capture(
+                        _buffer_entry, serializer_type, var_value, var_name, compression_of(var_name)
+                    )
+                except Exception as e:
+                    message = f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
+                    _save_error(message, e, metrics)
+                    return
+                pending_internals.append((None, buffered, "internal", var_name, None))
+                return
+            # the replays are not compressed
+            internal_compression = None if _function_saver_replaying.get() == "1" else compression_of(var_name)
             try:
-                await _do_serialize_async(
-                    serializer_type, var_value, destination_folder, var_name
+                size = await _do_serialize_async(
+                    serializer_type, var_value, destination_folder, var_name, internal_compression
                 )
+                _track_capture_size(destination_folder.parent, size, metrics)
             except Exception as e:
-                logger.error(
-                    f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
-                )
+                message = f"Error while saving internal variable {var_name} for function {func_.__name__}. {e}"
+                _save_error(message, e, metrics)
 
         @wraps(func_)
         def wrapper_sync(*args_, **kwargs) -> Any:
-            if _function_saver_replaying.get() == "1":
-                return func_(*args_, **kwargs)
-            function_name = func_.__name__
-            if os.getenv("FUNCTION_SAVER_ALL", "0") == "1":
-                save = True
-            else:
-                save = os.getenv(f"FUNCTION_SAVER_{function_name.upper()}", "0") == "1"
-            if os.getenv("FUNCTION_SAVER_INTERNALS_ALL", "0") == "1":
-                thread_data.save_internals = True
-            else:
-                thread_data.save_internals = (
-                    os.getenv(f"FUNCTION_SAVER_INTERNALS_{function_name.upper()}", "0")
-                    == "1"
-                )
-            thread_data.verbose = os.getenv("FUNCTION_SAVER_LOG", "0") == "1"
-            log(
-                f"Function saver for {function_name}: save={save}, save_internals={thread_data.save_internals},"
-                f"verbose={thread_data.verbose}"
+            # disabled: a single attribute read, then the call, timed for the latency histogram
+            if not settings.save or _function_saver_replaying.get() == "1":
+                return timed_call(args_, kwargs)
+            sampling = settings.sampling
+            if sampling is not None and not sampling.should_capture():
+                metrics.skipped.inc()
+                return timed_call(args_, kwargs)
+            tokens = thread_data.begin_call(
+                save_internals=settings.save_internals,
+                option_save_in=save_in,
+                option_save_out=save_out,
+                option_save_internals=save_internals,
+                internal_folder=None,
+                pending_internals=None,
             )
+            try:
+                return save_call_sync(args_, kwargs)
+            finally:
+                thread_data.end_call(tokens)
 
-            if not save:
-                return func_(*args_, **kwargs)
-
-            thread_data.option_save_in = save_in
-            thread_data.option_save_out = save_out
-            thread_data.option_save_internals = save_internals
-
-            function_saver_root_path = os.getenv(
-                "FUNCTION_SAVER_ROOT_PATH", tempfile.gettempdir() + "/function_saver"
-            )
-            log(f"Function saver for {function_name}")
-            folder = function_name + datetime.datetime.now().strftime(
-                "_%Y_%m_%d__%Hh%Mm%S.%f"
+        def save_call_sync(args_: tuple, kwargs: dict) -> Any:
+            start_capture = time.perf_counter_ns()
+            function_name = func_.__name__
+            log(
+                f"Function saver for {function_name}: save=True, save_internals={thread_data.save_internals}"
             )
-            save_folder = Path(function_saver_root_path) / folder
+            function_saver_root_path = config.root_path
+            now = datetime.datetime.now()
+            folder = function_name + now.strftime("_%Y_%m_%d__%Hh%Mm%S.%f")
+            storage = get_capture_storage()
+            save_folder = capture_path(Path(function_saver_root_path), function_name, folder, storage)
+            record = None
+            if get_catalog() is not None:
+                record = CaptureRecord(qualified_name, function_name, now.timestamp(), storage.value, str(save_folder))
+            # no retention with the segment logs: they are rotated (see get_capture_storage)
+            retention = get_retention()
+            if retention is not None and not retention.begin_capture(function_name, save_folder):
+                log(f"Capture of {function_name} refused: the retention budget is exhausted")
+                metrics.refused.inc()
+                return timed_call(args_, kwargs)
             save_folder_filesystem_link = save_folder.resolve().as_uri()
-            input_folder = save_folder / "inputs"
-            output_folder = save_folder / "output"
+            sections = []
             if thread_data.option_save_internals:
-                thread_data.internal_folder = save_folder / "internal"
-                thread_data.internal_folder.mkdir(parents=True, exist_ok=True)
-            try:
-                if thread_data.option_save_in:
-                    input_folder.mkdir(parents=True, exist_ok=True)
-                if thread_data.option_save_out:
-                    output_folder.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                logger.error(
-                    f"Error while creating folders for saving in out of function {func_.__name__}. {e}. "
-                    f"Let's skip the saving and just call the function."
-                )
-                return func_(*args_, **kwargs)
+                sections.append("internal")
+            if thread_data.option_save_in:
+                sections.append("inputs")
+            if thread_data.option_save_out:
+                sections.append("output")
+            profiler = new_call_profiler(settings.profile, settings.profile_sampling)
+            if profiler is not None:
+                sections.append(PROFILE_SECTION)
+            writer = None
+            if config.background or storage != CaptureStorage.DIRECTORY:
+                # the capture is created by the writer pool (or at the end of the call),
+                # internals are collected and written with the capture
+                thread_data.pending_internals = []
+            else:
+                try:
+                    writer = DirectoryCaptureWriter(save_folder, sections, get_blob_store())
+                    if thread_data.option_save_internals:
+                        thread_data.internal_folder = save_folder / "internal"
+                except Exception as e:
+                    logger.error(
+                        f"Error while creating folders for saving in out of function {func_.__name__}. {e}. "
+                        f"Let's skip the saving and just call the function."
+                    )
+                    metrics.failed.inc()
+                    return timed_call(args_, kwargs)
+            metrics.captures.inc()
+            timing = CaptureTiming()
+            inputs = snapshot_inputs(args_, kwargs, timing)
             log(f">>>>>>>> Saving inputs and output to {save_folder_filesystem_link}")
-            output = func_(*args_, **kwargs)
+            start_cpu = time.thread_time_ns()
+            start = time.perf_counter_ns()
+            try:
+                output = func_(*args_, **kwargs) if profiler is None else profiler.run(func_, *args_, **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - start
+                latency.record(duration)
+            timing.wall = duration / 1e9
+            timing.cpu = (time.thread_time_ns() - start_cpu) / 1e9
+            if record is not None:
+                record.call_duration = timing.wall
             try:
-                signature = inspect.signature(func_)
-                output_arg_type = signature.return_annotation
-                bound_args = signature.bind_partial(*args_, **kwargs)
-                bound_args.apply_defaults()
-                if thread_data.option_save_in:
-                    for arg_name, value in bound_args.arguments.items():
-                        # Skip serializing 'self'
-                        if arg_name == "self":
-                            continue
-                        arg_type = signature.parameters[arg_name].annotation
-                        _do_serialize(arg_type, value, input_folder, arg_name)
+                plan = get_capture_plan()
+                entries = []
+                if inputs is not None:
+                    entries.extend(plan.arguments_entries(inputs, "inputs", compression_of))
+                elif thread_data.option_save_in:
+                    entries.extend(plan.input_entries(args_, kwargs, "inputs", compression_of))
                 if thread_data.option_save_out:
-                    _do_serialize(output_arg_type, output, output_folder, "output")
-                logger.debug(
-                    f"Data of function {function_name} saved to: {save_folder_filesystem_link}"
-                )
+                    # written in background: the caller may modify the output meanwhile
+                    saved_output = snapshot(output) if config.background else output
+                    entries.append(plan.output_entry(saved_output, "output", compression_of))
+                if profiler is not None:
+                    entries.extend(profiler.report_entries(settings.profile_top))
+                if writer is not None:
+                    size = _write_entries_and_close(
+                        writer, entries, function_name, record, timing, metrics, plan.declared_types
+                    )
+                    _track_capture_size(save_folder, size, metrics, end=True)
+                    logger.debug(
+                        f"Data of function {function_name} saved to: {save_folder_filesystem_link}"
+                    )
+                else:
+                    entries.extend(thread_data.pending_internals)
+                    job = functools.partial(
+                        _write_capture_and_track_size,
+                        save_folder,
+                        storage,
+                        save_folder,
+                        sections,
+                        entries,
+                        function_name,
+                        save_folder_filesystem_link,
+                        record,
+                        timing,
+                        metrics=metrics,
+                        declared_types=plan.declared_types,
+                    )
+                    if config.background:
+                        get_writer_pool().submit(job, on_drop=functools.partial(_drop_capture, save_folder, metrics))
+                    else:
+                        job()
             except Exception as e:
                 logger.error(
                     f"Error while saving in out of function {func_.__name__}. {e}."
                 )
+                metrics.failed.inc()
             finally:
+                metrics.overhead.record(time.perf_counter_ns() - start_capture - duration)
                 return output
 
         @wraps(func_)
         async def wrapper_async(*args_, **kwargs) -> Any:
-            if _function_saver_replaying.get() == "1":
-                return await func_(*args_, **kwargs)
-            function_name = func_.__name__
-            if os.getenv("FUNCTION_SAVER_ALL", "0") == "1":
-                save = True
-            else:
-                save = os.getenv(f"FUNCTION_SAVER_{function_name.upper()}", "0") == "1"
-            if os.getenv("FUNCTION_SAVER_INTERNALS_ALL", "0") == "1":
-                thread_data.save_internals = True
-            else:
-                thread_data.save_internals = (
-                    os.getenv(f"FUNCTION_SAVER_INTERNALS_{function_name.upper()}", "0")
-                    == "1"
-                )
-            thread_data.verbose = os.getenv("FUNCTION_SAVER_LOG", "0") == "1"
-            log(
-                f"Function saver for {function_name}: save={save}, save_internals={thread_data.save_internals},"
-                f"verbose={thread_data.verbose}"
+            # disabled: a single attribute read, then the call, timed for the latency histogram
+            if not settings.save or _function_saver_replaying.get() == "1":
+                return await timed_call_async(args_, kwargs)
+            sampling = settings.sampling
+            if sampling is not None and not sampling.should_capture():
+                metrics.skipped.inc()
+                return await timed_call_async(args_, kwargs)
+            tokens = thread_data.begin_call(
+                save_internals=settings.save_internals,
+                option_save_in=save_in,
+                option_save_out=save_out,
+                option_save_internals=save_internals,
+                internal_folder=None,
+                pending_internals=None,
             )
+            try:
+                return await save_call_async(args_, kwargs)
+            finally:
+                thread_data.end_call(tokens)
 
-            if not save:
-                return await func_(*args_, **kwargs)
-
-            thread_data.option_save_in = save_in
-            thread_data.option_save_out = save_out
-            thread_data.option_save_internals = save_internals
-
-            function_saver_root_path = os.getenv(
-                "FUNCTION_SAVER_ROOT_PATH", tempfile.gettempdir() + "/function_saver"
-            )
-            log(f"Function saver for {function_name}")
-            folder = function_name + datetime.datetime.now().strftime(
-                "_%Y_%m_%d__%Hh%Mm%S.%f"
+        async def save_call_async(args_: tuple, kwargs: dict) -> Any:
+            start_capture = time.perf_counter_ns()
+            function_name = func_.__name__
+            log(
+                f"Function saver for {function_name}: save=True, save_internals={thread_data.save_internals}"
             )
-            save_folder = Path(function_saver_root_path) / folder
+            function_saver_root_path = config.root_path
+            now = datetime.datetime.now()
+            folder = function_name + now.strftime("_%Y_%m_%d__%Hh%Mm%S.%f")
+            storage = get_capture_storage()
+            save_folder = capture_path(Path(function_saver_root_path), function_name, folder, storage)
+            record = None
+            if get_catalog() is not None:
+                record = CaptureRecord(qualified_name, function_name, now.timestamp(), storage.value, str(save_folder))
+            # no retention with the segment logs: they are rotated (see get_capture_storage)
+            retention = get_retention()
+            if retention is not None and not retention.begin_capture(function_name, save_folder):
+                log(f"Capture of {function_name} refused: the retention budget is exhausted")
+                metrics.refused.inc()
+                return await timed_call_async(args_, kwargs)
             save_folder_filesystem_link = save_folder.resolve().as_uri()
-            input_folder = save_folder / "inputs"
-            output_folder = save_folder / "output"
+            sections = []
             if thread_data.option_save_internals:
-                thread_data.internal_folder = save_folder / "internal"
-                thread_data.internal_folder.mkdir(parents=True, exist_ok=True)
-            try:
-                if thread_data.option_save_in:
-                    input_folder.mkdir(parents=True, exist_ok=True)
-                if thread_data.option_save_out:
-                    output_folder.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                logger.error(
-                    f"Error while creating folders for saving in out of function {func_.__name__}. {e}. "
-                    f"Let's skip the saving and just call the function."
-                )
-                return await func_(*args_, **kwargs)
+                sections.append("internal")
+                if storage == CaptureStorage.DIRECTORY:
+                    # internals can be saved during the call: the folder must exist before
+                    thread_data.internal_folder = save_folder / "internal"
+                    thread_data.internal_folder.mkdir(parents=True, exist_ok=True)
+                else:
+                    # internals are collected and written with the capture
+                    thread_data.pending_internals = []
+            # the capture is created in the capture executor, with the write of the data
+            if thread_data.option_save_in:
+                sections.append("inputs")
+            if thread_data.option_save_out:
+                sections.append("output")
+            profiler = new_call_profiler(settings.profile, settings.profile_sampling)
+            if profiler is not None:
+                sections.append(PROFILE_SECTION)
+            metrics.captures.inc()
+            timing = CaptureTiming()
+            inputs = snapshot_inputs(args_, kwargs, timing)
             log(f">>>>>>>> Saving inputs and output to {save_folder_filesystem_link}")
-            output = await func_(*args_, **kwargs)
+            start = time.perf_counter_ns()
             try:
-                signature = inspect.signature(func_)
-                output_arg_type = signature.return_annotation
-                bound_args = signature.bind_partial(*args_, **kwargs)
-                bound_args.apply_defaults()
-                if thread_data.option_save_in:
-                    for arg_name, value in bound_args.arguments.items():
-                        # Skip serializing 'self'
-                        if arg_name == "self":
-                            continue
-                        arg_type = signature.parameters[arg_name].annotation
-                        await _do_serialize_async(
-                            arg_type, value, input_folder, arg_name
-                        )
+                coroutine = func_(*args_, **kwargs)
+                output = await (coroutine if profiler is None else profiler.run_async(coroutine))
+            finally:
+                duration = time.perf_counter_ns() - start
+                latency.record(duration)
+            timing.wall = duration / 1e9
+            if record is not None:
+                record.call_duration = timing.wall
+            try:
+                plan = get_capture_plan()
+                entries = []
+                if inputs is not None:
+                    entries.extend(plan.arguments_entries(inputs, "inputs", compression_of))
+                elif thread_data.option_save_in:
+                    entries.extend(plan.input_entries(args_, kwargs, "inputs", compression_of))
                 if thread_data.option_save_out:
-                    await _do_serialize_async(
-                        output_arg_type, output, output_folder, "output"
-                    )
-                logger.debug(
-                    f"Data of function {function_name} saved to: {save_folder_filesystem_link}"
+                    # written in background: the caller may modify the output meanwhile
+                    saved_output = snapshot(output) if config.background else output
+                    entries.append(plan.output_entry(saved_output, "output", compression_of))
+                if profiler is not None:
+                    entries.extend(profiler.report_entries(settings.profile_top))
+                if thread_data.pending_internals is not None:
+                    entries.extend(thread_data.pending_internals)
+                await submit_capture(
+                    _write_capture,
+                    storage,
+                    save_folder,
+                    sections,
+                    entries,
+                    function_name,
+                    save_folder_filesystem_link,
+                    record,
+                    timing,
+                    metrics,
+                    plan.declared_types,
+                    wait=not config.background,
+                    on_done=functools.partial(_track_capture_size, save_folder, metrics=metrics, end=True),
                 )
             except Exception as e:
                 logger.error(
                     f"Error while saving in out of function {func_.__name__}. {e}."
                 )
+                metrics.failed.inc()
             finally:
+                metrics.overhead.record(time.perf_counter_ns() - start_capture - duration)
                 return output
 
         def is_coroutine_function(a_function):
@@ -399,6 +853,12 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
         wrapper_async.is_save_internal_enabled = is_save_internal_enabled
         wrapper_async.save_internal = save_internal
         wrapper_async.save_internal_async = save_internal_async
+        wrapper_sync.snapshot_stats = snapshot_stats
+        wrapper_async.snapshot_stats = snapshot_stats
+        wrapper_sync.latency = latency
+        wrapper_async.latency = latency
+        wrapper_sync.metrics = metrics
+        wrapper_async.metrics = metrics
         if is_coroutine_function(func_):
             return wrapper_async
         return wrapper_sync
@@ -411,135 +871,264 @@ def function_saver(*args, save_in=True, save_out=True, save_internals=True):
     return decorator
 
 
-def replay_function(function: callable, folder_path: str | Path):
+def _check_mmap_mode(mmap_mode: str | None):
+    if mmap_mode not in ("c", "r", None):
+        raise ValueError(f"Invalid mmap_mode {mmap_mode}: expected 'c' (copy on write), 'r' (read only) or None")
+
+
+def _entry_mapper(
+    capture: CaptureReader, section: str, file_name: str, extension: str, mmap_mode: str | None
+) -> Callable[[], Any] | None:
+    """The loader mapping an entry in memory instead of reading it, None if the entry can't be mapped."""
+    if mmap_mode is None:
+        return None
+    map_deserializer = _get_map_deserializer(extension)
+    if map_deserializer is None:
+        return None
+    location = capture.entry_location(section, file_name)
+    if location is None:
+        return None
+    return functools.partial(map_deserializer, *location, mmap_mode)
+
+
+def _deserialize_entry(
+    capture: CaptureReader, section: str, name: str, mmap_mode: str | None, deserialize: Callable, data: str | bytes
+):
+    """Deserialize the data of the entry name, the arrays it references are loaded from their entries (sidecars)"""
+
+    def load_sidecar(index: int) -> np.ndarray:
+        sidecar = sidecar_name(name, index)
+        files = capture.entry_files(section, sidecar)
+        if not files:
+            raise FileNotFoundError(f"No entry {sidecar} in {capture.location}/{section}")
+        return _entry_loader(capture, section, files[0], files[0][len(sidecar) + 1:], mmap_mode)()
+
+    with resolving_sidecar_arrays(load_sidecar):
+        return deserialize(data)
+
+
+def _entry_loader(
+    capture: CaptureReader, section: str, file_name: str, extension: str, mmap_mode: str | None
+) -> Callable[[], Any]:
+    """
+    The loader of an entry: mapped if possible (see _function_saver_map_deserializers), else read.
+    The entry is first checked against the manifest of the capture, if enabled (see manifest.py).
+    """
+    verify_entry(capture, section, file_name)
+    mapper = _entry_mapper(capture, section, file_name, extension, mmap_mode)
+    if mapper is not None:
+        return mapper
+    deserialize, read_mode = _get_deserializer(extension)
+    name = file_name[: -len(extension) - 1]
+    return functools.partial(
+        _deserialize_entry, capture, section, name, mmap_mode, deserialize, capture.read(section, file_name, read_mode)
+    )
+
+
+async def _entry_loader_async(
+    capture: CaptureReader, section: str, file_name: str, extension: str, mmap_mode: str | None
+) -> Callable[[], Any]:
+    """The async version of _entry_loader"""
+    verify_entry(capture, section, file_name)
+    mapper = _entry_mapper(capture, section, file_name, extension, mmap_mode)
+    if mapper is not None:
+        return mapper
+    deserialize, read_mode = _get_deserializer(extension)
+    name = file_name[: -len(extension) - 1]
+    data = await capture.read_async(section, file_name, read_mode)
+    return functools.partial(_deserialize_entry, capture, section, name, mmap_mode, deserialize, data)
+
+
+def _read_inputs(function: callable, loaders: list[Callable[[], Any]]) -> list:
     """
-    Replay the function saved data from a folder.
+    Deserialize the inputs of a capture, with their loaders.
 
     Raises:
-        FileNotFoundError: if the input file is not found or if multiple files are found
         ReplayException: if an error occurs while deserializing the arguments
-
-    Args:
-        function: the function to replay
-        folder_path: the path to the folder where the data have been saved
     """
-    if isinstance(folder_path, str):
-        folder_path = Path(folder_path)
-    logger.info(f"Replaying function {function.__name__} from {folder_path}")
-    input_folder = folder_path / "inputs"
-    if not input_folder.exists():
-        raise FileNotFoundError(f"Folder {input_folder} does not exist")
-    arg_names = inspect.signature(function).parameters
     args = []
     all_args_deserialized = True
-    for arg_name in arg_names:
-        input_files = list(input_folder.glob(f"{arg_name}.*"))
-        if not input_files:
+    for arg_name, loader in zip(inspect.signature(function).parameters, loaders):
+        try:
+            args.append(loader())
+        except jsons.exceptions.SignatureMismatchError as e:
+            logger.error(
+                f"Error while deserializing argument {arg_name} for function {function.__name__}.\n"
+                f"You probably didn't provide {e.argument} in __init__ of {e.target.__name__}.\n"
+                f"Exception message: {e}"
+            )
+            all_args_deserialized = False
+    if not all_args_deserialized:
+        raise ReplayException("Error while deserializing arguments. Read the logs.")
+    return args
+
+
+def _input_files(function: callable, capture: CaptureReader) -> list[tuple[str, str]]:
+    """
+    Find the file of each argument of function in the inputs of a capture.
+
+    Returns:
+        The (file name, extension) of each argument
+
+    Raises:
+        FileNotFoundError: if the inputs are not found, or if no file is found for an argument
+        ValueError: if multiple files are found for an argument
+    """
+    if not capture.has_section("inputs"):
+        raise FileNotFoundError(f"No inputs saved in {capture.location}")
+    input_files = []
+    for arg_name in inspect.signature(function).parameters:
+        files = capture.entry_files("inputs", arg_name)
+        if not files:
             raise FileNotFoundError(f"No file found for argument {arg_name}")
-        if len(input_files) > 1:
+        if len(files) > 1:
             raise ValueError(f"Multiple files found for argument {arg_name}")
-        extension = "".join(input_files[0].suffixes)
-        if extension.startswith("."):
-            extension = extension[1:]
-        deserialize, read_mode = _get_deserializer(extension)
-        with open(input_files[0], read_mode) as f:
-            try:
-                arg = deserialize(f.read())
-                args.append(arg)
-            except jsons.exceptions.SignatureMismatchError as e:
-                logger.error(
-                    f"Error while deserializing argument {arg_name} for function {function.__name__}.\n"
-                    f"You probably didn't provide {e.argument} in __init__ of {e.target.__name__}.\n"
-                    f"Exception message: {e}"
-                )
-                all_args_deserialized = False
-    if all_args_deserialized:
-        with replaying(folder_path):
-            output = function(*args)
-            output_folder = folder_path / "output"
-            # if output was saved, we also save at replay
-            try:
-                if not output_folder.exists():
-                    return output
-                output_replay_folder = output_folder / "../output_replay"
-                shutil.rmtree(output_replay_folder, ignore_errors=True)
-                output_replay_folder.mkdir(parents=True)
-                signature = inspect.signature(function)
-                output_arg_type = signature.return_annotation
-                _do_serialize(output_arg_type, output, output_replay_folder, "output")
-            finally:
+        # the extension is all after the argument name: it may contain dots
+        input_files.append((files[0], files[0][len(arg_name) + 1:]))
+    return input_files
+
+
+def _output_file(capture: CaptureReader) -> str:
+    """
+    Find the output file of a capture.
+
+    Raises:
+        FileNotFoundError: if the output file is not found or if multiple files are found
+    """
+    output_folder = f"{capture.location}/output"
+    if not capture.has_section("output"):
+        raise FileNotFoundError(f"No output saved in {capture.location}")
+    output_files = capture.entry_files("output", "output")
+    output_files_count = len(output_files)
+    if output_files_count == 0:
+        raise FileNotFoundError(
+            f"No file found for output in {output_folder}. We expect one file named 'output.*'"
+        )
+    if output_files_count > 1:
+        raise FileNotFoundError(
+            f"Multiple files found for output in {output_folder}. We expect one file named 'output.*'"
+        )
+    return output_files[0]
+
+
+def _prepare_output_replay_folder(capture: CaptureReader) -> Path:
+    output_replay_folder = capture.replay_folder / "output_replay"
+    shutil.rmtree(output_replay_folder, ignore_errors=True)
+    output_replay_folder.mkdir(parents=True)
+    return output_replay_folder
+
+
+def _load_inputs(function: callable, capture: CaptureReader, mmap_mode: str | None) -> list:
+    """Deserialize the inputs of a capture, the arguments of function"""
+    loaders = [
+        _entry_loader(capture, "inputs", file_name, extension, mmap_mode)
+        for file_name, extension in _input_files(function, capture)
+    ]
+    return _read_inputs(function, loaders)
+
+
+def _load_expected_output(capture: CaptureReader, mmap_mode: str | None):
+    """Deserialize the output of a capture"""
+    output_file = _output_file(capture)
+    return _entry_loader(capture, "output", output_file, output_file[len("output."):], mmap_mode)()
+
+
+def _replay_capture(function: callable, capture: CaptureReader, mmap_mode: str | None):
+    """Replay the function from an opened capture, see replay_function"""
+    return _call_replayed(function, capture, _load_inputs(function, capture, mmap_mode))
+
+
+def _call_replayed(function: callable, capture: CaptureReader, args: list):
+    """Call function with the inputs of a capture, saving its output and internals at replay"""
+    with replaying(capture):
+        output = function(*args)
+        # if output was saved, we also save at replay
+        try:
+            if not capture.has_section("output"):
                 return output
-    else:
-        raise ReplayException("Error while deserializing arguments. Read the logs.")
+            output_replay_folder = _prepare_output_replay_folder(capture)
+            signature = inspect.signature(function)
+            output_arg_type = signature.return_annotation
+            _do_serialize(output_arg_type, output, output_replay_folder, "output")
+        finally:
+            return output
+
+
+async def _replay_capture_async(function: callable, capture: CaptureReader, mmap_mode: str | None):
+    """The async version of _replay_capture"""
+    loaders = [
+        await _entry_loader_async(capture, "inputs", file_name, extension, mmap_mode)
+        for file_name, extension in _input_files(function, capture)
+    ]
+    args = _read_inputs(function, loaders)
+    return await _call_replayed_async(function, capture, args)
+
+
+async def _call_replayed_async(function: callable, capture: CaptureReader, args: list):
+    """The async version of _call_replayed"""
+    async with replaying_async(capture):
+        output = await function(*args)
+        # if output was saved, we also save at replay
+        try:
+            if not capture.has_section("output"):
+                return output
+            output_replay_folder = _prepare_output_replay_folder(capture)
+            signature = inspect.signature(function)
+            output_arg_type = signature.return_annotation
+            await _do_serialize_async(
+                output_arg_type, output, output_replay_folder, "output"
+            )
+        finally:
+            return output
 
 
-async def replay_function_async(function: callable, folder_path: str | Path):
+def replay_function(function: callable, folder_path: str | Path | tuple[Path, int], mmap_mode: str | None = "c"):
+    """
+    Replay the function saved data from a capture: a folder, a single file capture,
+    or a segment record (its capture id, or (segment, offset)), see storage.py.
+
+    Raises:
+        FileNotFoundError: if the input file is not found or if multiple files are found
+        ReplayException: if an error occurs while deserializing the arguments
+        CaptureIntegrityError: with FUNCTION_SAVER_VERIFY_CAPTURES=1, if an entry doesn't match the manifest of
+            the capture (see manifest.py)
+
+    Args:
+        function: the function to replay
+        folder_path: the path to the capture, or the capture id of a segment record
+        mmap_mode: how the saved numpy arrays are memory mapped instead of being read in memory:
+            "c" copy on write (default: the function can modify them, the capture is not modified),
+            "r" read only, None to read them in memory.
+    """
+    _check_mmap_mode(mmap_mode)
+    logger.info(f"Replaying function {function.__name__} from {folder_path}")
+    return _replay_capture(function, open_capture(folder_path), mmap_mode)
+
+
+async def replay_function_async(
+    function: callable, folder_path: str | Path | tuple[Path, int], mmap_mode: str | None = "c"
+):
     """The async version of replay_function"""
-    if isinstance(folder_path, str):
-        folder_path = Path(folder_path)
+    _check_mmap_mode(mmap_mode)
     logger.info(f"Replaying function {function.__name__} from {folder_path}")
-    input_folder = folder_path / "inputs"
-    if not input_folder.exists():
-        raise FileNotFoundError(f"Folder {input_folder} does not exist")
-    arg_names = inspect.signature(function).parameters
-    args = []
-    all_args_deserialized = True
-    for arg_name in arg_names:
-        input_files = list(input_folder.glob(f"{arg_name}.*"))
-        if not input_files:
-            raise FileNotFoundError(f"No file found for argument {arg_name}")
-        if len(input_files) > 1:
-            raise ValueError(f"Multiple files found for argument {arg_name}")
-        extension = input_files[0].suffix
-        if extension.startswith("."):
-            extension = extension[1:]
-        deserialize, read_mode = _get_deserializer(extension)
-        async with aiofiles.open(input_files[0], read_mode) as f:
-            try:
-                arg = deserialize(await f.read())
-                args.append(arg)
-            except jsons.exceptions.SignatureMismatchError as e:
-                logger.error(
-                    f"Error while deserializing argument {arg_name} for function {function.__name__}.\n"
-                    f"You probably didn't provide {e.argument} in __init__ of {e.target.__name__}.\n"
-                    f"Exception message: {e}"
-                )
-                all_args_deserialized = False
-    if all_args_deserialized:
-        async with replaying_async(folder_path):
-            output = await function(*args)
-            output_folder = folder_path / "output"
-            # if output was saved, we also save at replay
-            try:
-                if not output_folder.exists():
-                    return output
-                output_replay_folder = output_folder / "../output_replay"
-                shutil.rmtree(output_replay_folder, ignore_errors=True)
-                output_replay_folder.mkdir(parents=True)
-                signature = inspect.signature(function)
-                output_arg_type = signature.return_annotation
-                await _do_serialize_async(
-                    output_arg_type, output, output_replay_folder, "output"
-                )
-            finally:
-                return output
-    else:
-        raise ReplayException("Error while deserializing arguments. Read the logs.")
+    return await _replay_capture_async(function, open_capture(folder_path), mmap_mode)
 
 
 def replay_and_check_function(
     function: callable,
-    folder_path: str | Path,
+    folder_path: str | Path | tuple[Path, int],
     compare_function: callable = lambda x, y: x == y,
+    mmap_mode: str | None = "c",
 ):
     """
-    Replay the function saved data from a folder and check the output.
+    Replay the function saved data from a capture and check the output.
 
     Args:
         function: the function to replay
-        folder_path: the path to the folder where the data have been saved
+        folder_path: the capture, as taken by replay_function
         compare_function: the function to compare the output with the expected output
             default is a simple equality check
+        mmap_mode: see replay_function
 
     Returns:
         The output of the function
@@ -548,27 +1137,11 @@ def replay_and_check_function(
         AssertionError: if the output does not match the expected output
         FileNotFoundError: if the output file is not found or if multiple files are found
     """
-    output_folder = folder_path / "output"
-    if not output_folder.exists():
-        raise FileNotFoundError(f"Folder {output_folder} does not exist")
-    output_files = list(output_folder.glob("output.*"))
-    output_files_count = len(output_files)
-    if output_files_count == 0:
-        raise FileNotFoundError(
-            f"No file found for output in {output_folder}. We expect one file named 'output.*'"
-        )
-    if output_files_count > 1:
-        raise FileNotFoundError(
-            f"Multiple files found for output in {output_folder}. We expect one file named 'output.*'"
-        )
-    output_file = output_files[0]
-    extension = output_file.suffix
-    if extension.startswith("."):
-        extension = extension[1:]
-    deserialize, read_mode = _get_deserializer(extension)
-    with open(output_file, read_mode) as f:
-        expected_output = deserialize(f.read())
-    output = replay_function(function, folder_path)
+    _check_mmap_mode(mmap_mode)
+    logger.info(f"Replaying function {function.__name__} from {folder_path}")
+    capture = open_capture(folder_path)
+    expected_output = _load_expected_output(capture, mmap_mode)
+    output = _replay_capture(function, capture, mmap_mode)
     if not compare_function(output, expected_output):
         raise AssertionError(
             f"Output does not match the expected output: {output} != {expected_output}"
@@ -578,31 +1151,18 @@ def replay_and_check_function(
 
 async def replay_and_check_function_async(
     function: callable,
-    folder_path: str | Path,
+    folder_path: str | Path | tuple[Path, int],
     compare_function: callable = lambda x, y: x == y,
+    mmap_mode: str | None = "c",
 ):
     """The async version of replay_and_check_function"""
-    output_folder = folder_path / "output"
-    if not output_folder.exists():
-        raise FileNotFoundError(f"Folder {output_folder} does not exist")
-    output_files = list(output_folder.glob("output.*"))
-    output_files_count = len(output_files)
-    if output_files_count == 0:
-        raise FileNotFoundError(
-            f"No file found for output in {output_folder}. We expect one file named 'output.*'"
-        )
-    if output_files_count > 1:
-        raise FileNotFoundError(
-            f"Multiple files found for output in {output_folder}. We expect one file named 'output.*'"
-        )
-    output_file = output_files[0]
-    extension = output_file.suffix
-    if extension.startswith("."):
-        extension = extension[1:]
-    deserialize, read_mode = _get_deserializer(extension)
-    async with aiofiles.open(output_file, read_mode) as f:
-        expected_output = deserialize(await f.read())
-    output = await replay_function_async(function, folder_path)
+    _check_mmap_mode(mmap_mode)
+    logger.info(f"Replaying function {function.__name__} from {folder_path}")
+    capture = open_capture(folder_path)
+    output_file = _output_file(capture)
+    loader = await _entry_loader_async(capture, "output", output_file, output_file[len("output."):], mmap_mode)
+    expected_output = loader()
+    output = await _replay_capture_async(function, capture, mmap_mode)
     if not compare_function(output, expected_output):
         raise AssertionError(
             f"Output does not match the expected output: {output} != {expected_output}"
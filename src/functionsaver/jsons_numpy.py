@@ -1,8 +1,15 @@
 """
 This file allows to define a custom json serialization for numpy arrays for jsons package.
+
+The arrays nested in the objects saved to json (i.e. an image in a dataclass) are written as .npy entries
+next to the json entry ("sidecars" <name>#<n>.npy), the json only references them: {"__numpy_ref__": n, ...}.
+The small arrays (less than SIDECAR_MIN_BYTES), or out of a capture, are embedded in the json in base64.
 """
 
+import contextvars
 from base64 import b64encode, b64decode
+from contextlib import contextmanager
+from typing import Callable, Iterator
 
 import numpy as np
 from jsons import DeserializationError, set_serializer, set_deserializer
@@ -11,7 +18,49 @@ from numpy.lib.format import dtype_to_descr, descr_to_dtype
 from mycronic.functionsaver.numpy_types import NumpyTypes
 
 
+SIDECAR_MIN_BYTES = 1024
+
+# The arrays to write as sidecars, while an entry of a capture is serialized
+_sidecar_arrays: contextvars.ContextVar[list[np.ndarray] | None] = contextvars.ContextVar(
+    "FUNCTION_SAVER_SIDECAR_ARRAYS", default=None
+)
+# The function loading the sidecar n, while an entry of a capture is deserialized
+_sidecar_resolver: contextvars.ContextVar[Callable[[int], np.ndarray] | None] = contextvars.ContextVar(
+    "FUNCTION_SAVER_SIDECAR_RESOLVER", default=None
+)
+
+
+def sidecar_name(name: str, index: int) -> str:
+    """The name (without extension) of the sidecar index of the entry name"""
+    return f"{name}#{index}"
+
+
+@contextmanager
+def collecting_sidecar_arrays() -> Iterator[list[np.ndarray]]:
+    """The large arrays serialized in this context are collected in the list, instead of being embedded"""
+    arrays = []
+    token = _sidecar_arrays.set(arrays)
+    try:
+        yield arrays
+    finally:
+        _sidecar_arrays.reset(token)
+
+
+@contextmanager
+def resolving_sidecar_arrays(resolver: Callable[[int], np.ndarray]):
+    """The array references deserialized in this context are loaded by resolver"""
+    token = _sidecar_resolver.set(resolver)
+    try:
+        yield
+    finally:
+        _sidecar_resolver.reset(token)
+
+
 def default_np_array_serializer(obj: np.ndarray, **_) -> dict:
+    arrays = _sidecar_arrays.get()
+    if arrays is not None and obj.nbytes >= SIDECAR_MIN_BYTES and not obj.dtype.hasobject:
+        arrays.append(obj)
+        return {"__numpy_ref__": len(arrays) - 1, "dtype": dtype_to_descr(obj.dtype), "shape": obj.shape}
     return {
         "__numpy__": b64encode(
             obj.data if obj.flags.c_contiguous else obj.tobytes()
@@ -22,6 +71,15 @@ def default_np_array_serializer(obj: np.ndarray, **_) -> dict:
 
 
 def default_np_array_deserializer(obj: dict, cls: type = np.ndarray, **_) -> np.ndarray:
+    if "__numpy_ref__" in obj:
+        resolver = _sidecar_resolver.get()
+        if resolver is None:
+            raise DeserializationError(
+                message="The array is saved in a sidecar entry, it can only be loaded from its capture.",
+                source=obj,
+                target=cls,
+            )
+        return resolver(obj["__numpy_ref__"])
     if "__numpy__" in obj:
         np_obj = np.frombuffer(
             b64decode(obj["__numpy__"]), descr_to_dtype(obj["dtype"])
@@ -0,0 +1,120 @@
+"""
+The manifest of a capture: manifest.json at the root of the capture, written with it, listing its entries.
+For each file of the inputs, output and internals saved with the capture (and their sidecar arrays, see jsons_numpy.py):
+    - section, name (the argument, "output", the internal variable...) and file name
+    - extension of the serializer, and codec if compressed (see compression.py)
+    - type: the type of the saved value, declared_type: its annotation (null if not annotated)
+    - size in bytes and hash (blake2b, 128 bits) of the data written
+
+The replay finds the files of the arguments in the manifest, without listing the sections
+(see CaptureReader.entry_files). The captures saved without a manifest are still replayed, their sections are listed.
+FUNCTION_SAVER_VERIFY_CAPTURES=1: the replay checks the size and the hash of each entry it loads against the manifest,
+and raises CaptureIntegrityError on a mismatch (a truncated or modified capture).
+
+The internals saved during the call directly to a capture folder are not in the manifest:
+only the internals written with the capture (background, zip or segment captures).
+"""
+
+import inspect
+import json
+import types
+from typing import Any, Iterable
+
+from .compression import CODECS
+from .config import config
+from .exception import ReplayException
+from .storage import CaptureReader, CaptureWriter, entry_hasher, entry_type_and_value
+
+
+class CaptureIntegrityError(ReplayException):
+    pass
+
+
+def type_name(type_: Any) -> str | None:
+    """The name of a type or of an annotation (i.e. list[int]), None for no annotation"""
+    if type_ is None or type_ is inspect.Signature.empty:
+        return None
+    if isinstance(type_, type) and not isinstance(type_, types.GenericAlias):
+        return type_.__qualname__ if type_.__module__ == "builtins" else f"{type_.__module__}.{type_.__qualname__}"
+    return str(type_)
+
+
+class ManifestWriter(CaptureWriter):
+    """Wraps the writer of a capture, to list its entries with their size and hash (see CaptureWriter.digests)."""
+
+    def __init__(
+        self, writer: CaptureWriter, entries: list[tuple], declared_types: dict[tuple[str, str], str] | None = None
+    ):
+        self.writer = writer
+        self.digests = writer.digests
+        # (section, name) -> type name
+        self._types = {
+            (section, name): type_name(entry_type_and_value(value)[0]) for _, value, section, name, _ in entries
+        }
+        self._declared_types = declared_types or {}
+        self.entries: list[dict] = []
+
+    def _add(self, section: str, file_name: str):
+        names = [name for entry_section, name in self._types if entry_section == section]
+        name = max((name for name in names if file_name.startswith(f"{name}.")), key=len, default=None)
+        if name is None:
+            # a sidecar array of an entry: <name>#<index>.npy
+            base, _, index = file_name.rpartition("#")
+            name = f"{base}#{index.partition('.')[0]}" if base else file_name.partition(".")[0]
+        base_extension, _, codec = file_name[len(name) + 1:].rpartition(".")
+        if not base_extension or codec not in CODECS:
+            base_extension, codec = file_name[len(name) + 1:], None
+        sidecar = (section, name) not in self._types
+        size, digest = self.digests[(section, file_name)]
+        entry = {
+            "section": section,
+            "name": name,
+            "file": file_name,
+            "extension": base_extension,
+            "codec": codec,
+            "type": "numpy.ndarray" if sidecar else self._types[(section, name)],
+            "declared_type": self._declared_types.get((section, name)),
+            "size": size,
+            "hash": digest,
+        }
+        self.entries.append(entry)
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        size = self.writer.write(section, file_name, data)
+        if section:  # the files at the root (metadata, manifest) are not entries
+            self._add(section, file_name)
+        return size
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        size = self.writer.write_chunks(section, file_name, chunks)
+        self._add(section, file_name)
+        return size
+
+    def to_json(self) -> str:
+        return json.dumps({"entries": self.entries}, indent=1)
+
+    def close(self):
+        self.writer.close()
+
+
+def verify_entry(capture: CaptureReader, section: str, file_name: str):
+    """
+    Check the size and the hash of an entry against the manifest of the capture, if FUNCTION_SAVER_VERIFY_CAPTURES=1.
+    Nothing is checked for the captures saved without a manifest, or the entries not in it.
+
+    Raises:
+        CaptureIntegrityError: if the entry doesn't match the manifest
+    """
+    if config.get("FUNCTION_SAVER_VERIFY_CAPTURES", "0") != "1" or capture.manifest is None:
+        return
+    expected = capture.manifest.get((section, file_name))
+    if expected is None:
+        return
+    data = capture.read(section, file_name, "rb")
+    hasher = entry_hasher()
+    hasher.update(data)
+    if len(data) != expected["size"] or hasher.hexdigest() != expected["hash"]:
+        raise CaptureIntegrityError(
+            f"The entry {section}/{file_name} of {capture.location} doesn't match its manifest: "
+            f"{len(data)} bytes, hash {hasher.hexdigest()}, expected {expected['size']} bytes, hash {expected['hash']}"
+        )
@@ -0,0 +1,212 @@
+"""
+Metrics of the decorated functions, by qualified name (module.qualname):
+    - calls: the calls, captured or not, and their durations (the latency histogram, see timing.py)
+    - captures: the captures done
+    - skipped: the calls not captured by the sampling (see sampling.py)
+    - refused: the captures refused by the retention (see retention.py)
+    - dropped: the captures dropped by the background writer pool when its queue is full (see writer_pool.py)
+    - failed: the errors while saving: a value not serialized, a capture not written (also logged)
+    - written_bytes: the bytes written by the captures
+    - overhead: the time added to the calls by their capture (snapshot, serialization and writing in the caller)
+
+The counters are sharded by thread, like the histograms: the updates take no lock, the reads sum the shards.
+The shard of a thread is folded into the totals when the thread ends.
+They are read with metrics(), or exported in the Prometheus text format:
+    - to_prometheus(): the text
+    - write_prometheus(path): to a file, replaced atomically (i.e. for the textfile collector of the node exporter)
+    - start_metrics_server(port): served on http://127.0.0.1:<port>/metrics, by a daemon thread
+
+With a process pool capture executor (FUNCTION_SAVER_ASYNC_EXECUTOR=process), the errors of the writes are counted
+in the worker processes: the failed counter of the caller process misses them.
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .timing import LatencyHistogram, ThreadShards, new_latency_histogram
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the upper bounds (seconds) of the histogram buckets exported to Prometheus
+_PROMETHEUS_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Counter:
+    """A counter sharded by thread: each thread increments its own count, without lock (see ThreadShards)."""
+
+    def __init__(self):
+        self._shards = ThreadShards(1)
+        self._local = self._shards.local
+
+    def inc(self, amount: int = 1):
+        try:
+            self._local.shard[0] += amount
+        except AttributeError:
+            self._shards.new_shard()[0] += amount
+
+    @property
+    def value(self) -> int:
+        return self._shards.totals()[0]
+
+    def reset(self):
+        self._shards.reset()
+
+
+# name in the Python API and in Prometheus (function_saver_<name>_total), help
+_COUNTERS = {
+    "captures": "Calls captured",
+    "skipped": "Calls not captured by the sampling",
+    "refused": "Captures refused by the retention",
+    "dropped": "Captures dropped by the background writer pool, its queue being full",
+    "failed": "Errors while saving a value or a capture",
+    "written_bytes": "Bytes written by the captures",
+}
+
+
+class CaptureMetrics:
+    """The metrics of a decorated function, see the module documentation."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency: LatencyHistogram = new_latency_histogram(name)
+        self.overhead = LatencyHistogram(name)
+        self.captures = Counter()
+        self.skipped = Counter()
+        self.refused = Counter()
+        self.dropped = Counter()
+        self.failed = Counter()
+        self.written_bytes = Counter()
+
+    def __reduce__(self):
+        # sent to a process pool with the capture: the worker process counts in its own registry
+        return capture_metrics, (self.name,)
+
+    def to_dict(self) -> dict:
+        """i.e. {"calls": 10, "captures": 2, ..., "latency": {"count": 10, "p50": ...}, "overhead": {...}}"""
+        values = {"calls": self.latency.count}
+        values.update((name, getattr(self, name).value) for name in _COUNTERS)
+        values["latency"] = self.latency.summary()
+        values["overhead"] = self.overhead.summary()
+        return values
+
+    def reset(self):
+        self.latency.reset()
+        self.overhead.reset()
+        for name in _COUNTERS:
+            getattr(self, name).reset()
+
+
+_metrics: dict[str, CaptureMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def capture_metrics(name: str) -> CaptureMetrics:
+    """The metrics of a decorated function, by qualified name, created at the first use (at decoration time)."""
+    metrics_ = _metrics.get(name)
+    if metrics_ is None:
+        with _metrics_lock:
+            metrics_ = _metrics.get(name)
+            if metrics_ is None:
+                metrics_ = _metrics[name] = CaptureMetrics(name)
+    return metrics_
+
+
+def metrics() -> dict[str, dict]:
+    """The metrics of all the decorated functions, by qualified name (see CaptureMetrics.to_dict)."""
+    return {name: metrics_.to_dict() for name, metrics_ in list(_metrics.items())}
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_histogram(lines: list[str], name: str, function: str, histogram: LatencyHistogram):
+    summary = histogram.summary(())
+    buckets = histogram.buckets()
+    cumulative = 0
+    index = 0
+    for bound in _PROMETHEUS_BUCKETS:
+        while index < len(buckets) and buckets[index][0] <= bound:
+            cumulative += buckets[index][1]
+            index += 1
+        lines.append(f'{name}_bucket{{function="{function}",le="{bound:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{function="{function}",le="+Inf"}} {summary["count"]}')
+    lines.append(f'{name}_sum{{function="{function}"}} {summary["total"]:.9g}')
+    lines.append(f'{name}_count{{function="{function}"}} {summary["count"]}')
+
+
+def to_prometheus() -> str:
+    """The metrics of all the decorated functions, in the Prometheus text exposition format."""
+    all_metrics = sorted(_metrics.items())
+    lines = [
+        "# HELP function_saver_calls_total Calls of the decorated functions, captured or not",
+        "# TYPE function_saver_calls_total counter",
+    ]
+    lines += [f'function_saver_calls_total{{function="{_label(name)}"}} {m.latency.count}' for name, m in all_metrics]
+    for counter, help_ in _COUNTERS.items():
+        lines.append(f"# HELP function_saver_{counter}_total {help_}")
+        lines.append(f"# TYPE function_saver_{counter}_total counter")
+        lines += [
+            f'function_saver_{counter}_total{{function="{_label(name)}"}} {getattr(m, counter).value}'
+            for name, m in all_metrics
+        ]
+    for histogram, help_ in (
+        ("call_duration_seconds", "Durations of the calls, captured or not"),
+        ("capture_overhead_seconds", "Time added to the calls by their capture"),
+    ):
+        lines.append(f"# HELP function_saver_{histogram} {help_}")
+        lines.append(f"# TYPE function_saver_{histogram} histogram")
+        for name, m in all_metrics:
+            _prometheus_histogram(
+                lines,
+                f"function_saver_{histogram}",
+                _label(name),
+                m.latency if histogram == "call_duration_seconds" else m.overhead,
+            )
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str | Path):
+    """Write the metrics in the Prometheus text format to path, replaced atomically: never read half written."""
+    path = Path(path)
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_text(to_prometheus())
+    os.replace(temporary, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = to_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # a scrape every few seconds: not logged
+
+
+def start_metrics_server(port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the metrics in the Prometheus text format on http://<host>:<port>/metrics, in a daemon thread.
+
+    Args:
+        port: the port, 0 for a free port (server.server_address gives it)
+        host: the address to listen to, the local host by default
+
+    Returns:
+        The server: server.shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="function_saver_metrics", daemon=True).start()
+    return server
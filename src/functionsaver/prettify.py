@@ -0,0 +1,82 @@
+"""
+The json files of the captures are written compact, for the speed of the capture and the size of the files.
+prettify_json indents them afterwards, to read them:
+    python -m functionsaver prettify <capture folder or root folder>...
+
+Only the captures saved in folders can be prettified (not the zip captures nor the segments),
+and the compressed files (i.e. a.json.zlib) are left as they are.
+The manifest of a capture (see manifest.py) is updated with the size and hash of its prettified files.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from .logger import get_logger
+from .storage import MANIFEST_FILE, entry_hasher
+
+logger = get_logger()
+
+
+def _prettify_file(path: Path) -> bool:
+    text = path.read_text()
+    pretty = json.dumps(json.loads(text), indent=2)
+    if pretty == text:
+        return False
+    _replace_text(path, pretty)
+    return True
+
+
+def _replace_text(path: Path, text: str):
+    # written aside then replaced: a deduplicated file (hard link to a blob, see blob_store.py) gets its own copy
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary.write_text(text)
+    os.replace(temporary, path)
+
+
+def _update_manifest(manifest_path: Path, files: list[Path]):
+    """Update the size and hash of the files of a capture in its manifest"""
+    manifest = json.loads(manifest_path.read_text())
+    entries = {(entry["section"], entry["file"]): entry for entry in manifest["entries"]}
+    for file in files:
+        entry = entries.get((file.parent.name, file.name))
+        if entry is None:
+            continue
+        data = file.read_bytes()
+        hasher = entry_hasher()
+        hasher.update(data)
+        entry["size"], entry["hash"] = len(data), hasher.hexdigest()
+    _replace_text(manifest_path, json.dumps(manifest, indent=2))
+
+
+def prettify_json(path: str | Path) -> int:
+    """
+    Indent the json files of a capture folder, or of all the capture folders under path.
+
+    Args:
+        path: a capture folder, a function folder, or the root path of the captures
+
+    Returns:
+        The number of files prettified
+    """
+    path = Path(path)
+    json_files = [path] if path.is_file() else sorted(path.rglob("*.json"))
+    count = 0
+    # manifest -> the files prettified in its capture
+    prettified: dict[Path, list[Path]] = {}
+    for json_file in json_files:
+        try:
+            if _prettify_file(json_file):
+                count += 1
+                prettified.setdefault(json_file.parent.parent / MANIFEST_FILE, []).append(json_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Function saver: {json_file} not prettified. {e}")
+    for manifest_path, files in prettified.items():
+        if not manifest_path.is_file():  # a capture saved without a manifest
+            continue
+        try:
+            _update_manifest(manifest_path, files)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Function saver: {manifest_path} not updated. {e}")
+    return count
+
@@ -0,0 +1,207 @@
+"""
+Profiling of the captured calls, opt-in, to know why a call was slow without reproducing it:
+    - FUNCTION_SAVER_PROFILE_ONE_FUNCTION=1 (or cpu) for def one_function(...): the call runs under cProfile,
+      =memory: also under tracemalloc. FUNCTION_SAVER_PROFILE_ALL for all the decorated functions.
+    - FUNCTION_SAVER_PROFILE_SAMPLING_ONE_FUNCTION=<spec>: profile only some of the captured calls, with a sampling
+      policy (see sampling.py), FUNCTION_SAVER_PROFILE_SAMPLING_ALL for all the decorated functions.
+      Default: all the captured calls are profiled.
+    - FUNCTION_SAVER_PROFILE_TOP=N: the number of lines of the text reports (default 30)
+
+Only the captured calls are profiled. The reports are saved in the profile section of the capture:
+    - profile.pstats: the cProfile stats, i.e. pstats.Stats("profile.pstats"), snakeviz...
+    - profile.txt: the top N functions by cumulative time
+    - memory.txt (memory mode): the peak memory during the call, and the top N allocation sites
+
+Limitations:
+    - one profiler per thread: a profiled call made by a profiled call is not profiled on its own
+      (from python 3.12, one profiler per process: a call profiled while another is running is not profiled)
+    - the coroutines are profiled only while they run, not while they await: the other tasks of the event loop
+      are not in their report
+    - tracemalloc traces the whole process: the peak memory includes the allocations of the other threads meanwhile
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import tracemalloc
+from enum import Enum
+from typing import Any, Callable, Coroutine
+
+from .logger import get_logger
+from .sampling import SamplingPolicy
+from .serializers import SerializerEntry
+
+logger = get_logger()
+
+PROFILE_SECTION = "profile"
+
+
+class ProfileMode(str, Enum):
+    CPU = "cpu"
+    MEMORY = "memory"
+
+
+def parse_profile_mode(spec: str) -> ProfileMode | None:
+    """
+    The profile mode of a FUNCTION_SAVER_PROFILE_* variable: 0 (None), 1 or cpu, memory
+
+    Raises:
+        ValueError: if the spec is invalid
+    """
+    spec = spec.strip().lower()
+    if spec in ("", "0"):
+        return None
+    if spec == "1":
+        return ProfileMode.CPU
+    try:
+        return ProfileMode(spec)
+    except ValueError:
+        raise ValueError(f"Invalid profile mode '{spec}'. Expected 0, 1, cpu or memory") from None
+
+
+def _as_is(data: str | bytes) -> str | bytes:
+    """The serializer of the reports: they are already serialized"""
+    return data
+
+
+# the thread running a profiler: cProfile profiles a thread, one profiler at a time
+_local = threading.local()
+
+# tracemalloc is process wide: it is started by the first profiled call, stopped by the last one
+_memory_lock = threading.Lock()
+_memory_users = 0
+_memory_started = False
+
+
+class CallProfiler:
+    """Profiles one call, then gives its reports as capture entries."""
+
+    def __init__(self, mode: ProfileMode):
+        self.mode = mode
+        self.profile = cProfile.Profile()
+        self.profiled = False
+        self.peak_memory: int | None = None
+        self._enabled = False
+        self._memory_start = 0
+        self._memory_snapshot: tracemalloc.Snapshot | None = None
+        self._memory_statistics: list[tracemalloc.StatisticDiff] = []
+
+    def _resume(self):
+        if getattr(_local, "profiling", False):
+            return  # a profiled call in a profiled call: the outer profiler already sees it
+        try:
+            self.profile.enable()
+        except ValueError as e:  # python >= 3.12: another profiler is running
+            logger.debug(f"Function saver: call not profiled. {e}")
+            return
+        _local.profiling = self._enabled = self.profiled = True
+
+    def _pause(self):
+        if self._enabled:
+            self.profile.disable()
+            _local.profiling = self._enabled = False
+
+    def _start_memory(self):
+        global _memory_users, _memory_started
+        if self.mode != ProfileMode.MEMORY:
+            return
+        with _memory_lock:
+            if _memory_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _memory_started = True
+            _memory_users += 1
+        self._memory_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self._memory_start = tracemalloc.get_traced_memory()[0]
+
+    def _stop_memory(self):
+        global _memory_users, _memory_started
+        if self.mode != ProfileMode.MEMORY:
+            return
+        self.peak_memory = max(tracemalloc.get_traced_memory()[1] - self._memory_start, 0)
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        self._memory_statistics = snapshot.compare_to(self._memory_snapshot, "lineno")
+        self._memory_snapshot = None
+        with _memory_lock:
+            _memory_users -= 1
+            if _memory_users == 0 and _memory_started:
+                tracemalloc.stop()
+                _memory_started = False
+
+    def run(self, function: Callable, *args, **kwargs) -> Any:
+        """Call function(*args, **kwargs), profiled"""
+        self._start_memory()
+        self._resume()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._pause()
+            self._stop_memory()
+
+    async def run_async(self, coroutine: Coroutine) -> Any:
+        """Await coroutine, profiled while it runs"""
+        self._start_memory()
+        try:
+            return await _ProfiledCoroutine(coroutine, self)
+        finally:
+            self._stop_memory()
+
+    def report_entries(self, top: int = 30) -> list[tuple]:
+        """
+        The reports, as capture entries (serializer_entry, value, section, file_name, compression)
+
+        Args:
+            top: the number of lines of the text reports
+        """
+        entries = []
+        if self.profiled:
+            self.profile.create_stats()
+            # dumped before pstats.Stats takes the stats from the profile
+            entries.append((SerializerEntry(_as_is, "pstats", "wb"), marshal.dumps(self.profile.stats), "profile"))
+            text = io.StringIO()
+            pstats.Stats(self.profile, stream=text).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+            entries.append((SerializerEntry(_as_is, "txt", "w"), text.getvalue(), "profile"))
+        if self.peak_memory is not None:
+            lines = [f"Peak memory during the call: {self.peak_memory} bytes", ""]
+            lines.append(f"Top {top} allocation sites, by memory allocated during the call and still held at its end:")
+            lines += [str(statistic) for statistic in self._memory_statistics[:top]]
+            entries.append((SerializerEntry(_as_is, "txt", "w"), "\n".join(lines) + "\n", "memory"))
+        return [(entry, value, PROFILE_SECTION, name, None) for entry, value, name in entries]
+
+
+class _ProfiledCoroutine:
+    """Runs a coroutine step by step, profiling its steps only: not the other tasks run while it awaits."""
+
+    def __init__(self, coroutine: Coroutine, profiler: CallProfiler):
+        self.coroutine = coroutine
+        self.profiler = profiler
+
+    def __await__(self):
+        send, value = self.coroutine.send, None
+        while True:
+            self.profiler._resume()
+            try:
+                yielded = send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profiler._pause()
+            try:
+                value = yield yielded
+                send = self.coroutine.send
+            except GeneratorExit:
+                self.coroutine.close()
+                raise
+            except BaseException as e:
+                send, value = self.coroutine.throw, e
+
+
+def new_call_profiler(mode: ProfileMode | None, sampling: SamplingPolicy | None) -> CallProfiler | None:
+    """The profiler of a captured call, None if it is not profiled (disabled, or not sampled)"""
+    if mode is None:
+        return None
+    if sampling is not None and not sampling.should_capture():
+        return None
+    return CallProfiler(mode)
@@ -0,0 +1,149 @@
+"""
+Pipelined replay: replay a stream of captures, loading the next ones in background threads while the current one runs.
+    for replayed in replay_captures(my_function, capture_ids, prefetch=2):
+        print(replayed.capture_id, replayed.output)
+
+replay_function opens the capture, reads and deserializes the inputs, then calls the function: the CPU waits on
+the disk at each capture. replay_captures opens and deserializes the inputs of the next `prefetch` captures in
+threads meanwhile. The memory is bounded: at most prefetch + 2 captures are loaded at once (the replay being
+consumed, the current one and the prefetched ones), the next load starts when the replay is consumed.
+
+The memory mapped arrays (mmap_mode "c" or "r", see replay_function) are mapped by the loader, and their files are
+read ahead by the kernel (posix_fadvise WILLNEED, where supported): the replay finds them in the page cache.
+
+An exception while loading a capture is raised when its replay comes, and stops the iteration, like an exception of
+the function. Only the sync functions: replay the async functions with replay_function_async.
+"""
+
+import collections
+import inspect
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+from .batch_replay import discover_captures
+from .function_saver import _call_replayed, _check_mmap_mode, _load_expected_output, _load_inputs
+from .logger import get_logger
+from .storage import CaptureReader, open_capture
+
+logger = get_logger()
+
+
+class ReplayedCapture(NamedTuple):
+    capture_id: str | Path | tuple[Path, int]
+    output: Any
+    expected_output: Any  # None if not loaded (expected_output=False)
+    load_duration: float  # seconds, in the background
+    wait_duration: float  # seconds the replay waited for the load: 0 if the prefetch keeps up
+    run_duration: float  # seconds
+
+
+class _LoadedCapture(NamedTuple):
+    capture: CaptureReader
+    args: list
+    expected_output: Any
+    duration: float
+
+
+def _will_need(value):
+    """Ask the kernel to read ahead the files of the memory mapped arrays of value"""
+    if isinstance(value, np.memmap):
+        if value.filename is None or not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            fd = os.open(value.filename, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, value.offset, value.nbytes, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.debug(f"Function saver: no read ahead of {value.filename}. {e}")
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _will_need(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _will_need(item)
+
+
+def _load(function: Callable, capture_id, mmap_mode: str | None, expected_output: bool) -> _LoadedCapture:
+    start = time.perf_counter()
+    capture = open_capture(capture_id)
+    args = _load_inputs(function, capture, mmap_mode)
+    expected = _load_expected_output(capture, mmap_mode) if expected_output else None
+    _will_need(args)
+    _will_need(expected)
+    return _LoadedCapture(capture, args, expected, time.perf_counter() - start)
+
+
+def replay_captures(
+    function: Callable,
+    captures: Iterable[str | Path | tuple[Path, int]] | None = None,
+    prefetch: int = 2,
+    mmap_mode: str | None = "c",
+    expected_output: bool = False,
+) -> Iterator[ReplayedCapture]:
+    """
+    Replay the captures one after the other, the next ones being loaded in background threads, see the module
+    documentation.
+
+    Args:
+        function: the function to replay (sync)
+        captures: the captures (folders, zip captures, segment capture ids), default is all the captures of the
+            function in FUNCTION_SAVER_ROOT_PATH (see discover_captures)
+        prefetch: the number of captures loaded in advance, 0 to load each capture when its replay comes
+        mmap_mode: see replay_function
+        expected_output: also load the saved outputs, to compare them to the outputs
+
+    Returns:
+        An iterator of the replays, in the order of captures
+
+    Raises:
+        ValueError: if prefetch is negative or mmap_mode is invalid
+        TypeError: if function is a coroutine function
+    """
+    _check_mmap_mode(mmap_mode)
+    if prefetch < 0:
+        raise ValueError(f"Invalid prefetch {prefetch}: expected >= 0")
+    if inspect.iscoroutinefunction(function):
+        raise TypeError(f"{function.__name__} is a coroutine function: replay it with replay_function_async")
+    if captures is None:
+        captures = discover_captures(function.__name__)
+    return _replay_pipeline(function, iter(captures), prefetch, mmap_mode, expected_output)
+
+
+def _replay_pipeline(
+    function: Callable, captures: Iterator, prefetch: int, mmap_mode: str | None, expected_output: bool
+) -> Iterator[ReplayedCapture]:
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1), thread_name_prefix="function_saver_replay")
+    loads: collections.deque[tuple[Any, Future]] = collections.deque()
+    try:
+        while True:
+            # the current capture and the prefetched ones
+            while len(loads) <= prefetch and (capture_id := next(captures, None)) is not None:
+                loads.append((capture_id, executor.submit(_load, function, capture_id, mmap_mode, expected_output)))
+            if not loads:
+                return
+            capture_id, load = loads.popleft()
+            start = time.perf_counter()
+            loaded = load.result()
+            started = time.perf_counter()
+            logger.info(f"Replaying function {function.__name__} from {capture_id}")
+            output = _call_replayed(function, loaded.capture, loaded.args)
+            replayed = ReplayedCapture(
+                capture_id,
+                output,
+                loaded.expected_output,
+                loaded.duration,
+                started - start,
+                time.perf_counter() - started,
+            )
+            del loaded  # the inputs are released while the replay is consumed
+            yield replayed
+    finally:
+        # stopped early (exception, break): the pending loads are cancelled, the running ones are awaited
+        executor.shutdown(wait=True, cancel_futures=True)
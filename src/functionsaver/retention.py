@@ -0,0 +1,271 @@
+"""
+Retention of the captures under FUNCTION_SAVER_ROOT_PATH, so that they don't fill the disk:
+    - FUNCTION_SAVER_MAX_BYTES: max total size of the captures (suffixes K, M, G, T are accepted, i.e. 10G)
+    - FUNCTION_SAVER_MAX_CAPTURES: max number of captures per function
+    - FUNCTION_SAVER_RETENTION = evict | refuse (default evict):
+        - evict: the oldest captures are deleted to make room (ring buffer)
+        - refuse: new captures are refused once the budget is exhausted
+
+The root path is scanned once (at the first capture), then the sizes are tracked as the captures are written.
+The sizes of text files are counted in characters (the json files are ascii).
+A blob (see blob_store.py) is counted with the capture which stored it first: the disk usage can exceed the budget
+by the size of the blobs still shared when this capture is evicted.
+The evicted captures are removed from the catalog (see catalog.py).
+The evicted captures are deleted after the tracking lock is released: the other captures don't wait for the disk.
+A capture is pending from its registration (before the call) until its write ends, which can be later in the writer
+pool or in the capture executor: a pending capture evicted meanwhile is deleted when its write ends.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+
+from .blob_store import blob_path, collect_blobs, gc_blobs
+from .catalog import remove_from_catalog
+from .config import config
+from .logger import get_logger
+from .storage import MANIFEST_FILE
+
+logger = get_logger()
+
+_CAPTURE_NAME = re.compile(r"^(?P<function_name>.+)_\d{4}_\d{2}_\d{2}__\d{2}h\d{2}m\d{2}\.\d{6}(\.zip)?$")
+
+
+def _path_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    size = 0
+    for folder, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(folder, file))
+            except OSError:
+                pass
+    return size
+
+
+def _manifest_digests(path: Path) -> dict[tuple[str, str], str]:
+    """The hashes of the files of a capture folder, by (section, file name), from its manifest (see manifest.py)."""
+    try:
+        entries = json.loads((path / MANIFEST_FILE).read_text())["entries"]
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {(entry["section"], entry["file"]): entry["hash"] for entry in entries}
+
+
+def _delete(path: Path, root_path: Path) -> list[Path] | None:
+    """
+    Delete a capture.
+
+    Returns:
+        The blobs (see blob_store.py) its files were linked to, to collect.
+        None if some are not known from its manifest: all the blobs must be collected.
+    """
+    if not path.is_dir():
+        path.unlink(missing_ok=True)
+        return []
+    digests = None
+    blobs = []
+    for folder, _, files in os.walk(path):
+        section = "" if Path(folder) == path else Path(folder).name
+        for file in files:
+            file_path = os.path.join(folder, file)
+            try:
+                if os.stat(file_path).st_nlink == 1:
+                    continue
+            except OSError:
+                continue
+            if digests is None:
+                digests = _manifest_digests(path)
+            digest = digests.get((section, file))
+            blob = blob_path(root_path, digest) if digest is not None else None
+            try:
+                if blob is not None and os.path.samefile(blob, file_path):
+                    blobs.append(blob)
+                    continue
+            except OSError:
+                pass
+            # linked, but not to the blob of its hash (i.e. a capture saved without manifest)
+            blobs = None
+            break
+        if blobs is None:
+            break
+    shutil.rmtree(path, ignore_errors=True)
+    return blobs
+
+
+class RetentionManager:
+    """
+    Tracks the captures under a root path, oldest first, and evicts or refuses captures to stay within the budget.
+    All the captures are in one ordered dict (global age order), and in one deque per function:
+    the oldest capture of a function is always the leftmost of its deque, so evictions are O(1).
+    """
+
+    def __init__(
+        self, root_path: str | Path, max_bytes: int | None = None, max_captures: int | None = None, refuse=False
+    ):
+        self.root_path = Path(root_path)
+        self.max_bytes = max_bytes
+        self.max_captures = max_captures
+        self.refuse = refuse
+        self.total_bytes = 0
+        self._captures: OrderedDict[Path, list] = OrderedDict()  # path -> [function_name, size]
+        self._captures_by_function: dict[str, deque[Path]] = {}
+        self._pending: set[Path] = set()  # registered, not written yet
+        self._evicted_pending: set[Path] = set()  # evicted before being written: deleted when written
+        self._lock = threading.Lock()
+        self._scanned = False
+
+    def _scan(self):
+        """Register the captures already on disk, oldest first. Called once."""
+        self._scanned = True
+        if not self.root_path.is_dir():
+            return
+        existing = []
+        for path in self.root_path.iterdir():
+            match = _CAPTURE_NAME.match(path.name)
+            if match is None:
+                continue
+            existing.append((path.name.removesuffix(".zip")[len(match["function_name"]):], match["function_name"], path))
+        for _, function_name, path in sorted(existing, key=lambda capture: capture[0]):
+            self._register(function_name, path, _path_size(path))
+
+    def _register(self, function_name: str, path: Path, size: int):
+        self._captures[path] = [function_name, size]
+        self._captures_by_function.setdefault(function_name, deque()).append(path)
+        self.total_bytes += size
+
+    def _evict_oldest(self, function_name: str | None = None) -> Path | None:
+        """
+        Untrack the oldest capture (of function_name if given).
+
+        Returns:
+            Its path, to delete (see _delete_evicted). None if it is pending: it is deleted when written.
+        """
+        if function_name is None:
+            path, (function_name, size) = self._captures.popitem(last=False)
+            self._captures_by_function[function_name].popleft()
+        else:
+            path = self._captures_by_function[function_name].popleft()
+            _, size = self._captures.pop(path)
+        self.total_bytes -= size
+        if path in self._pending:
+            self._pending.remove(path)
+            self._evicted_pending.add(path)
+            return None
+        return path
+
+    def _delete_evicted(self, paths: list[Path]):
+        """Delete the evicted captures, and the blobs only they referenced. Called without the lock."""
+        if not paths:
+            return
+        blobs = []
+        for path in paths:
+            linked = _delete(path, self.root_path)
+            blobs = None if blobs is None or linked is None else blobs + linked
+            logger.debug(f"Function saver retention: {path} evicted")
+        if blobs is None:
+            gc_blobs(self.root_path)
+        else:
+            collect_blobs(blobs)
+        remove_from_catalog([str(path) for path in paths])
+
+    def capture_count(self, function_name: str) -> int:
+        return len(self._captures_by_function.get(function_name, ()))
+
+    def begin_capture(self, function_name: str, path: Path) -> bool:
+        """
+        Register a new capture, before it is written: it is pending until end_capture or cancel_capture.
+
+        Returns:
+            False if the capture is refused (refuse policy, and budget exhausted), True otherwise.
+        """
+        # refuse without taking the lock
+        if self.refuse and self.max_bytes is not None and self.total_bytes >= self.max_bytes:
+            return False
+        evicted = []
+        try:
+            with self._lock:
+                if not self._scanned:
+                    self._scan()
+                if self.max_captures is not None:
+                    if self.refuse and self.capture_count(function_name) >= self.max_captures:
+                        return False
+                    while self.capture_count(function_name) >= max(self.max_captures, 1):
+                        evicted.append(self._evict_oldest(function_name))
+                if self.refuse and self.max_bytes is not None and self.total_bytes >= self.max_bytes:
+                    return False
+                self._register(function_name, path, 0)
+                self._pending.add(path)
+                return True
+        finally:
+            self._delete_evicted([path for path in evicted if path is not None])
+
+    def _add_bytes(self, path: Path, size: int) -> list[Path]:
+        """add_bytes, with the lock. Returns the evicted captures to delete."""
+        capture = self._captures.get(path)
+        if capture is None:  # already evicted
+            return []
+        capture[1] += size
+        self.total_bytes += size
+        evicted = []
+        if not self.refuse and self.max_bytes is not None:
+            while self.total_bytes > self.max_bytes and len(self._captures) > 1:
+                if (evicted_path := self._evict_oldest()) is not None:
+                    evicted.append(evicted_path)
+        return evicted
+
+    def add_bytes(self, path: Path, size: int):
+        """Account size bytes written for the capture path, evicting the oldest captures if over budget."""
+        with self._lock:
+            evicted = self._add_bytes(path, size)
+        self._delete_evicted(evicted)
+
+    def end_capture(self, path: Path, size: int):
+        """The capture is written: add_bytes, or delete it if it was evicted while pending."""
+        with self._lock:
+            self._pending.discard(path)
+            if path in self._evicted_pending:
+                self._evicted_pending.remove(path)
+                evicted = [path]
+            else:
+                evicted = self._add_bytes(path, size)
+        self._delete_evicted(evicted)
+
+    def cancel_capture(self, path: Path):
+        """Untrack a pending capture which will not be written (i.e. dropped by the writer pool, see writer_pool.py)."""
+        with self._lock:
+            self._pending.discard(path)
+            self._evicted_pending.discard(path)
+            capture = self._captures.pop(path, None)
+            if capture is not None:
+                self._captures_by_function[capture[0]].remove(path)
+                self.total_bytes -= capture[1]
+
+
+_retention: RetentionManager | None = None
+_retention_key: tuple | None = None
+_retention_lock = threading.Lock()
+
+
+def get_retention() -> RetentionManager | None:
+    """Get the retention manager matching the configuration, None if there is no limit."""
+    global _retention, _retention_key
+    if config.max_bytes is None and config.max_captures is None:
+        return None
+    key = (config.root_path, config.max_bytes, config.max_captures, config.retention_refuse)
+    if key != _retention_key:
+        with _retention_lock:
+            if key != _retention_key:
+                _retention = RetentionManager(
+                    config.root_path,
+                    max_bytes=config.max_bytes,
+                    max_captures=config.max_captures,
+                    refuse=config.retention_refuse,
+                )
+                _retention_key = key
+    return _retention
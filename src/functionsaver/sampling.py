@@ -0,0 +1,103 @@
+"""
+Sampling policies: which calls of a decorated function are saved, when its saving is enabled.
+
+They are configured like the enable flags, with a policy spec:
+    - FUNCTION_SAVER_SAMPLING_ONE_FUNCTION=<spec> for def one_function(...)
+    - FUNCTION_SAVER_SAMPLING_ALL=<spec> for all the decorated functions (the per function variable wins)
+
+The specs are:
+    - every:N         save one call every N calls (the 1st, the N+1th, ...)
+    - probability:P   save each call with the probability P (0 <= P <= 1)
+    - rate:R[:B]      save at most R calls per second (token bucket, with bursts of B calls, default max(1, R))
+    - first:N         save the N first calls, then stop
+"""
+
+import abc
+import itertools
+import random
+import threading
+import time
+
+
+class SamplingPolicy(abc.ABC):
+    """A sampling policy decides, for each call, if it must be saved."""
+
+    @abc.abstractmethod
+    def should_capture(self) -> bool:
+        pass
+
+
+class EveryNth(SamplingPolicy):
+    def __init__(self, n: int):
+        if n < 1:
+            raise ValueError(f"every:N needs N >= 1, it is {n}")
+        self.n = n
+        self._counter = itertools.count()  # next() on it is atomic: thread safe without lock
+
+    def should_capture(self) -> bool:
+        return next(self._counter) % self.n == 0
+
+
+class Probability(SamplingPolicy):
+    def __init__(self, probability: float):
+        if not 0 <= probability <= 1:
+            raise ValueError(f"probability:P needs 0 <= P <= 1, it is {probability}")
+        self.probability = probability
+
+    def should_capture(self) -> bool:
+        return random.random() < self.probability
+
+
+class TokenBucket(SamplingPolicy):
+    def __init__(self, rate: float, burst: float | None = None):
+        if rate <= 0:
+            raise ValueError(f"rate:R needs R > 0, it is {rate}")
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def should_capture(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class FirstN(SamplingPolicy):
+    def __init__(self, n: int):
+        if n < 0:
+            raise ValueError(f"first:N needs N >= 0, it is {n}")
+        self.n = n
+        self._counter = itertools.count()
+
+    def should_capture(self) -> bool:
+        return next(self._counter) < self.n
+
+
+def parse_sampling_policy(spec: str) -> SamplingPolicy:
+    """
+    Build a sampling policy from its spec, i.e. "every:10" (see the module documentation).
+
+    Raises:
+        ValueError: if the spec is invalid
+    """
+    kind, _, parameters = spec.strip().partition(":")
+    values = parameters.split(":") if parameters else []
+    try:
+        if kind == "every" and len(values) == 1:
+            return EveryNth(int(values[0]))
+        if kind == "probability" and len(values) == 1:
+            return Probability(float(values[0]))
+        if kind == "rate" and len(values) in (1, 2):
+            return TokenBucket(*(float(value) for value in values))
+        if kind == "first" and len(values) == 1:
+            return FirstN(int(values[0]))
+    except ValueError as e:
+        raise ValueError(f"Invalid sampling policy '{spec}'. {e}") from e
+    raise ValueError(f"Invalid sampling policy '{spec}'. Expected every:N, probability:P, rate:R[:B] or first:N")
@@ -0,0 +1,230 @@
+"""
+Append-only segment logs, for the functions called too often for one file per capture (FUNCTION_SAVER_STORAGE=segment).
+
+The captures of a function are appended as framed records to rolling segment files, in <root>/<function>.segments/:
+    - <date>.seg: the records, back to back. A record is a fixed size frame (magic, header size, data size),
+      the data of the entries, then a json header describing the entries of the capture (their offset and size).
+      The data is streamed to the segment as it is serialized, the frame is completed once the header is written.
+      The records written before the streaming have their header before the data (magic FSR1).
+    - <date>.idx: the offset of each record of the segment, as 8 bytes integers: record n is at n * 8 (O(1) lookup).
+      A record is indexed once complete.
+A segment is rotated when it exceeds max_bytes, or when it is older than max_age seconds.
+A segment is written by one writer at a time: the concurrent writers of a function write to their own segments.
+
+A capture is identified by its capture id "<segment path>#<record number>", or by (segment path, offset).
+"""
+
+import datetime
+import itertools
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+_MAGIC = b"FSR1"  # the header, then the data
+_MAGIC_STREAMED = b"FSR2"  # the data, then the header
+_FRAME = struct.Struct("<4sIQ")  # magic, header size, data size
+_INDEX = struct.Struct("<Q")  # record offset
+
+
+class _Segment:
+    """An open segment and its index."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, "xb")
+        self.index_file = open(path.with_suffix(".idx"), "xb")
+        self.size = 0
+        self.count = 0
+        self.opened_at = time.monotonic()
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+
+class SegmentRecord:
+    """A record being written to a segment: the data of its entries (write), then its header (finish)."""
+
+    def __init__(self, segment_log: "SegmentLog", segment: _Segment):
+        self._segment_log = segment_log
+        self._segment = segment
+        self._offset = segment.size
+        #: the size of the data written, the offset of the next entry in the data
+        self.data_size = 0
+        try:
+            # completed by finish
+            segment.file.write(_FRAME.pack(_MAGIC_STREAMED, 0, 0))
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, chunk: bytes | memoryview):
+        self._segment.file.write(chunk)
+        self.data_size += memoryview(chunk).nbytes
+
+    def finish(self, header: bytes) -> str:
+        """
+        Write the header of the record and index it. If it fails, the record is aborted.
+
+        Returns:
+            The capture id of the record
+        """
+        segment = self._segment
+        try:
+            segment.file.write(header)
+            segment.file.seek(self._offset)
+            segment.file.write(_FRAME.pack(_MAGIC_STREAMED, len(header), self.data_size))
+            segment.file.seek(0, os.SEEK_END)
+            segment.file.flush()
+            # the index is written after the record: an indexed record is always complete
+            segment.index_file.write(_INDEX.pack(self._offset))
+            segment.index_file.flush()
+        except BaseException:
+            self.abort()
+            raise
+        segment.size += _FRAME.size + self.data_size + len(header)
+        record_number = segment.count
+        segment.count += 1
+        self._segment_log._release(segment)
+        return f"{segment.path}#{record_number}"
+
+    def abort(self):
+        """Forget the record: the next record of the segment is written in its place."""
+        try:
+            self._segment.file.seek(self._offset)
+            self._segment.file.truncate()
+        finally:
+            self._segment_log._release(self._segment)
+
+
+class SegmentLog:
+    """
+    The segments of one folder. A segment is written by one record at a time: a record takes a free segment,
+    or opens a new one if the others are being written. Each record is flushed when finished.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int, max_age: float | None = None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._free: list[_Segment] = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _open_segment(self) -> _Segment:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        name = datetime.datetime.now().strftime("%Y_%m_%d__%Hh%Mm%S.%f")
+        # a new segment at each rotation: a segment is never appended by two processes
+        for suffix in itertools.count():
+            try:
+                return _Segment(self.folder / (f"{name}_{suffix}.seg" if suffix else f"{name}.seg"))
+            except FileExistsError:  # opened at the same time by another writer
+                continue
+
+    def _must_rotate(self, segment: _Segment) -> bool:
+        if segment.size >= self.max_bytes:
+            return True
+        return self.max_age is not None and time.monotonic() - segment.opened_at >= self.max_age
+
+    def begin(self) -> SegmentRecord:
+        """Start a record. It must be finished or aborted: the segment is not written by others meanwhile."""
+        with self._lock:
+            # the last released first: a single writer appends to a single segment
+            segment = self._free.pop() if self._free else None
+        if segment is not None and self._must_rotate(segment):
+            segment.close()
+            segment = None
+        return SegmentRecord(self, segment or self._open_segment())
+
+    def _release(self, segment: _Segment):
+        with self._lock:
+            if not self._closed:
+                self._free.append(segment)
+                return
+        segment.close()
+
+    def close(self):
+        """Close the segments. The ones being written are closed when their record is finished."""
+        with self._lock:
+            self._closed = True
+            free, self._free = self._free, []
+        for segment in free:
+            segment.close()
+
+
+_segment_logs: dict[tuple, SegmentLog] = {}
+_segment_logs_lock = threading.Lock()
+
+
+def get_segment_log(folder: Path, max_bytes: int, max_age: float | None = None) -> SegmentLog:
+    """Get the segment log of a folder, shared by all the threads of the process."""
+    key = (folder, max_bytes, max_age)
+    segment_log = _segment_logs.get(key)
+    if segment_log is None:
+        with _segment_logs_lock:
+            segment_log = _segment_logs.get(key)
+            if segment_log is None:
+                # the settings changed: the previous log of the folder is closed, the new one starts a segment
+                for previous_key in [previous_key for previous_key in _segment_logs if previous_key[0] == folder]:
+                    _segment_logs.pop(previous_key).close()
+                segment_log = _segment_logs[key] = SegmentLog(folder, max_bytes, max_age)
+    return segment_log
+
+
+def parse_capture_id(capture_id: str) -> tuple[Path, int] | None:
+    """Parse "<segment path>#<record number>", None if capture_id is not the id of an existing segment."""
+    segment, separator, record_number = capture_id.rpartition("#")
+    if not separator or not record_number.isdigit() or not Path(segment).is_file():
+        return None
+    return Path(segment), int(record_number)
+
+
+def record_offset(segment: Path, record_number: int) -> int:
+    """
+    The offset of a record in a segment, read from the index.
+
+    Raises:
+        IndexError: if there is no such record
+    """
+    with open(segment.with_suffix(".idx"), "rb") as f:
+        f.seek(record_number * _INDEX.size)
+        data = f.read(_INDEX.size)
+    if len(data) < _INDEX.size:
+        raise IndexError(f"No record {record_number} in {segment}")
+    return _INDEX.unpack(data)[0]
+
+
+def read_record_header(segment: Path, offset: int) -> tuple[bytes, int]:
+    """
+    Read the header of the record at offset.
+
+    Returns:
+        The header, and the offset of the data of the record
+
+    Raises:
+        ValueError: if there is no record at offset
+    """
+    with open(segment, "rb") as f:
+        f.seek(offset)
+        frame = f.read(_FRAME.size)
+        if len(frame) < _FRAME.size:
+            raise ValueError(f"No record at offset {offset} of {segment}")
+        magic, header_size, data_size = _FRAME.unpack(frame)
+        if magic == _MAGIC:
+            return f.read(header_size), offset + _FRAME.size + header_size
+        if magic != _MAGIC_STREAMED:
+            raise ValueError(f"No record at offset {offset} of {segment}")
+        f.seek(offset + _FRAME.size + data_size)
+        return f.read(header_size), offset + _FRAME.size
+
+
+def list_captures(folder: str | Path) -> list[str]:
+    """The capture ids of the records of a segments folder, oldest first."""
+    capture_ids = []
+    for segment in sorted(Path(folder).glob("*.seg")):
+        index = segment.with_suffix(".idx")
+        count = index.stat().st_size // _INDEX.size if index.exists() else 0
+        capture_ids.extend(f"{segment}#{record_number}" for record_number in range(count))
+    return capture_ids
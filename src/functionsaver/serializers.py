@@ -1,15 +1,26 @@
 import inspect
 import io
-from functools import partial
+import itertools
+import json
+from functools import partial, lru_cache
 from types import UnionType
-from typing import Tuple, get_args, Callable, get_origin, Union
+from pathlib import Path
+from typing import Tuple, get_args, Callable, get_origin, Union, NamedTuple, Iterable, Iterator
 
 import jsons
 import numpy as np
+from jsons import Verbosity
 from PIL import Image
 
 from mycronic.functionsaver.numpy_types import NumpyTypes
 
+from .compression import CODECS, Compression
+from .exception import SerializationSkipped
+from .logger import get_logger
+from .shuffle import np_array_shuffle_delta_dump, np_array_shuffle_dump, np_array_shuffle_load
+
+logger = get_logger()
+
 
 def np_array_png_serializer(array) -> bytes:
     """
@@ -45,18 +56,61 @@ class SerializeAsArrayPng:
     pass
 
 
-def np_array_binary_dump(array: np.ndarray) -> bytes:
+class SerializeAsArrayShuffle:
+    """Numeric array, byte-shuffled then compressed with the compression of the variable (see shuffle.py)"""
+
+
+class SerializeAsArrayShuffleDelta:
+    """Numeric array, delta filtered, byte-shuffled then compressed: for smooth data (see shuffle.py)"""
+
+
+# size of the blocks copied to write a non-contiguous array
+_NPY_BLOCK_BYTES = 16 * 1024**2
+
+
+def _np_array_buffer_chunks(array: np.ndarray) -> Iterator[memoryview]:
+    """The data of an array in C order: a view of its buffer if it is contiguous, else copies of blocks of rows."""
+    if array.flags.c_contiguous:
+        yield memoryview(array.reshape(-1).view(np.uint8))
+        return
+    rows = max(1, _NPY_BLOCK_BYTES // max(1, array[0].nbytes))
+    for start in range(0, len(array), rows):
+        yield memoryview(np.ascontiguousarray(array[start:start + rows]).reshape(-1).view(np.uint8))
+
+
+def np_array_binary_chunks(array: np.ndarray) -> Iterable[bytes | memoryview]:
     """
-    Dump a numpy array to bytes
+    Dump a numpy array to .npy chunks, to be written one after the other:
+    the header, then views of the array buffer (no copy of the array, except by blocks if it is not contiguous).
 
     Raises:
         AssertionError: if the input is not a numpy array
     """
     if not isinstance(array, np.ndarray):
         raise AssertionError("Input must be a numpy array")
-    mem_io = io.BytesIO()
-    np.save(mem_io, array)  # noqa
-    return mem_io.getvalue()
+    if array.dtype.hasobject:  # pickled by np.save
+        mem_io = io.BytesIO()
+        np.save(mem_io, array)  # noqa
+        return [mem_io.getvalue()]
+    header = io.BytesIO()
+    header_data = np.lib.format.header_data_from_array_1_0(array)
+    try:
+        np.lib.format.write_array_header_1_0(header, header_data)
+    except ValueError:  # header too long for the version 1.0
+        np.lib.format.write_array_header_2_0(header, header_data)
+    if header_data["fortran_order"]:
+        array = array.T
+    return itertools.chain([header.getvalue()], _np_array_buffer_chunks(array))
+
+
+def np_array_binary_dump(array: np.ndarray) -> bytes:
+    """
+    Dump a numpy array to bytes
+
+    Raises:
+        AssertionError: if the input is not a numpy array
+    """
+    return b"".join(np_array_binary_chunks(array))
 
 
 def np_array_binary_load(data: bytes) -> np.ndarray:
@@ -72,6 +126,33 @@ def np_array_binary_load(data: bytes) -> np.ndarray:
     return np.load(mem_io)
 
 
+def np_array_binary_map(path: Path, offset: int, mmap_mode: str) -> np.ndarray:
+    """
+    Memory map a .npy entry stored at offset in a file (a .npy file, or an uncompressed entry of a capture file):
+    the array is read from the disk on demand, and its pages are shared by the processes mapping the same file.
+    The arrays of objects and the empty arrays can't be mapped: they are read.
+
+    Args:
+        path: the file
+        offset: the offset of the .npy entry in the file
+        mmap_mode: "c" copy on write, or "r" read only (see numpy.memmap)
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if dtype.hasobject or 0 in shape:
+            f.seek(offset)
+            return np.load(f, allow_pickle=True)
+        data_offset = f.tell()
+    return np.memmap(
+        path, dtype=dtype, mode=mmap_mode, offset=data_offset, shape=shape, order="F" if fortran_order else "C"
+    )
+
+
 def np_deserializer(cls: type) -> Callable[[str], type]:
     """This function is for factorizing the creation of numpy deserializers."""
 
@@ -83,14 +164,27 @@ def np_deserializer(cls: type) -> Callable[[str], type]:
 
 _function_saver_serializers: dict[type, (Callable, str)] = {
     np.ndarray: (np_array_binary_dump, "npy"),
+    SerializeAsArrayShuffle: (np_array_shuffle_dump, "shuffle"),
+    SerializeAsArrayShuffleDelta: (np_array_shuffle_delta_dump, "shuffle"),
     **{
         np_type: (jsons.dumps, ext)
         for np_type, ext in NumpyTypes.types_and_extensions()
     },
 }
 
+# The serializers which can also produce their data as chunks, written one after the other to the destination:
+# the data is not copied in memory before being written.
+_function_saver_chunk_serializers: dict[Callable, Callable] = {
+    np_array_binary_dump: np_array_binary_chunks,
+}
+
+# The serializers which compress their data themselves, with the compression of the variable as second argument:
+# their data is not compressed again (i.e. the shuffled arrays are compressed by block, see shuffle.py).
+_function_saver_compressing_serializers: set[Callable] = {np_array_shuffle_dump, np_array_shuffle_delta_dump}
+
 _function_saver_deserializers: dict[str, Callable] = {
     "npy": np_array_binary_load,
+    "shuffle": np_array_shuffle_load,
     **{
         ext: np_deserializer(np_type)
         for np_type, ext in NumpyTypes.types_and_extensions()
@@ -98,6 +192,56 @@ _function_saver_deserializers: dict[str, Callable] = {
 }
 
 
+# The deserializers which can map the file in memory instead of reading it: extension -> function(path, offset, mode)
+_function_saver_map_deserializers: dict[str, Callable] = {
+    "npy": np_array_binary_map,
+}
+
+
+_COMPACT_SEPARATORS = (",", ":")
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def _is_json_native(object_) -> bool:
+    """
+    True if object_ is only made of dicts with str keys, lists, tuples, str, int, float, bool and None
+    (exact types, not subclasses): the json module dumps it as jsons would.
+    """
+    type_ = type(object_)
+    if type_ in _JSON_SCALARS:
+        return True
+    if type_ is list or type_ is tuple:
+        return all(_is_json_native(item) for item in object_)
+    if type_ is dict:
+        return all(type(key) is str and _is_json_native(value) for key, value in object_.items())
+    return False
+
+
+def _default_serializer(object_) -> str:
+    """
+    The fallback serializer, when no serializer is registered for the type.
+    Compact json: no indentation, and only the class information the replay needs (prettify_json indents the files).
+    The json native structures are dumped by the json module directly, without the reflection of jsons.
+    """
+    if _is_json_native(object_):
+        return json.dumps(object_, separators=_COMPACT_SEPARATORS)
+    return jsons.dumps(object_, jdkwargs={"separators": _COMPACT_SEPARATORS}, verbose=Verbosity.WITH_CLASS_INFO)
+
+
+class SerializerEntry(NamedTuple):
+    """
+    A resolved serializer: the function, the file extension, the mode to open the file ("w" or "wb"),
+    the function producing the data as chunks, if any (see _function_saver_chunk_serializers),
+    and whether the serializer compresses its data itself (see _function_saver_compressing_serializers).
+    """
+
+    serializer: Callable
+    extension: str
+    mode: str
+    chunk_serializer: Callable | None = None
+    compressing: bool = False
+
+
 def _get_serializer(type_arg: type, dynamic_type: type) -> Tuple[callable, str]:
     if type_arg is None or type_arg == inspect.Signature.empty:
         type_arg = dynamic_type
@@ -115,20 +259,129 @@ def _get_serializer(type_arg: type, dynamic_type: type) -> Tuple[callable, str]:
             serializer, extension = _function_saver_serializers[type_]  # noqa
             break
     else:
-        serializer, extension = (
-            lambda x: jsons.dumps(x, jdkwargs={"indent": 2}, verbose=True),
-            "json",
-        )
+        serializer, extension = _default_serializer, "json"
     return serializer, extension
 
 
+# The resolved serializers, by (annotation, dynamic type). Cleared when a serializer is registered.
+_serializer_entries_cache: dict[tuple, SerializerEntry] = {}
+# The (registered serializer, value signature) that failed to serialize: they are skipped instead of failing again.
+# Not the fallback serializer: jsons fails on some values of a type (i.e. a dict with a generator), not on the type.
+# Cleared when a serializer is registered.
+_unserializable: set[tuple] = set()
+# Incremented when the caches are cleared: the serializers resolved before are outdated (see capture_plan.py)
+_serializer_generation = 0
+
+
+def _get_serializer_entry(type_arg: type, dynamic_type: type) -> SerializerEntry:
+    """
+    Same as _get_serializer, with the mode to open the file: "wb" if the serializer returns bytes, else "w".
+    The result is cached.
+    """
+    if type_arg is None or type_arg == inspect.Signature.empty:
+        key = (None, dynamic_type)
+    else:
+        key = (type_arg, None)  # the dynamic type is not used when there is an annotation
+    try:
+        return _serializer_entries_cache[key]
+    except KeyError:
+        pass
+    except TypeError:  # unhashable annotation: no cache
+        key = None
+    serializer, extension = _get_serializer(type_arg, dynamic_type)
+    mode = "w"
+    if inspect.signature(serializer).return_annotation == bytes:
+        mode = "wb"
+    entry = SerializerEntry(
+        serializer,
+        extension,
+        mode,
+        _function_saver_chunk_serializers.get(serializer),
+        serializer in _function_saver_compressing_serializers,
+    )
+    if key is not None:
+        _serializer_entries_cache[key] = entry
+    return entry
+
+
+def _value_signature(object_) -> tuple:
+    """
+    What the failure of a registered serializer is remembered for: the type of the value, and for the numpy arrays
+    their dtype and number of dimensions (i.e. the png serializer takes some arrays, not all), not their size.
+    """
+    if isinstance(object_, np.ndarray):
+        return type(object_), object_.dtype.str, object_.ndim
+    return (type(object_),)
+
+
+def _serialize(
+    serializer_entry: SerializerEntry, object_, compression: Compression | None = None
+) -> str | bytes | Iterable[bytes | memoryview] | None:
+    """
+    Serialize object_ with the serializer of serializer_entry.
+    compression is given to the serializers compressing their data themselves, the others ignore it.
+
+    Returns:
+        The serialized data (chunks if the serializer has a chunk serializer)
+
+    Raises:
+        SerializationSkipped: if this registered serializer already failed with the signature of object_
+            (see _value_signature)
+        Any exception raised by the serializer. For a registered serializer, the signature of object_ is then
+        remembered to be skipped next time.
+    """
+    key = (serializer_entry.serializer, *_value_signature(object_))
+    if key in _unserializable:
+        raise SerializationSkipped(
+            f"{serializer_entry.serializer.__name__} already failed to serialize {type(object_).__name__}: skipped"
+        )
+    try:
+        if serializer_entry.compressing:
+            return serializer_entry.serializer(object_, compression)
+        if serializer_entry.chunk_serializer is not None:
+            return serializer_entry.chunk_serializer(object_)
+        return serializer_entry.serializer(object_)
+    except Exception:
+        if serializer_entry.serializer is not _default_serializer:
+            _unserializable.add(key)
+            logger.debug(f"Function saver: {serializer_entry.serializer.__name__} skips {key[1:]} from now on")
+        raise
+
+
+def clear_serializer_cache():
+    """Forget the resolved serializers, and the value signatures which failed to serialize."""
+    global _serializer_generation
+    _serializer_generation += 1
+    _serializer_entries_cache.clear()
+    _unserializable.clear()
+    _get_deserializer.cache_clear()
+
+
+def serializer_generation() -> int:
+    """Changes when a serializer is registered: the serializers resolved before must be resolved again."""
+    return _serializer_generation
+
+
+def _compressed_deserializer(decompress: Callable, deserializer: Callable, mode: str) -> Callable[[bytes], object]:
+    def deserialize(data: bytes):
+        data = decompress(data)
+        return deserializer(data.decode() if mode == "r" else data)
+
+    return deserialize
+
+
+@lru_cache
 def _get_deserializer(extension: str) -> Tuple[callable, str]:
     """
-    Get the deserializer function and the mode to open the file
+    Get the deserializer function and the mode to open the file (cached, by extension)
+    A last suffix naming a codec (i.e. npy.zlib) is decompressed before deserializing (see compression.py)
 
     Raises:
         AssertionError: if the deserializer function does not take a string or bytes
     """
+    base_extension, _, codec_name = extension.rpartition(".")
+    if extension not in _function_saver_deserializers and base_extension and codec_name in CODECS:
+        return _compressed_deserializer(CODECS[codec_name].decompress, *_get_deserializer(base_extension)), "rb"
     deserializer = partial(jsons.loads, strict=True)
     if extension in _function_saver_deserializers:
         deserializer = _function_saver_deserializers[extension]
@@ -143,6 +396,11 @@ def _get_deserializer(extension: str) -> Tuple[callable, str]:
     return deserializer, "rb"
 
 
+def _get_map_deserializer(extension: str) -> Callable | None:
+    """The function mapping the entries with this extension in memory, None if they can't be mapped."""
+    return _function_saver_map_deserializers.get(extension)
+
+
 def register_serializer(
     type_arg: type, serializer: callable, deserializer: callable, file_extension: str
 ):
@@ -187,6 +445,7 @@ def register_serializer(
             f"Deserializer for extension {file_extension} already registered"
         )
     _function_saver_deserializers[file_extension] = deserializer
+    clear_serializer_cache()
 
 
 register_serializer(
@@ -0,0 +1,151 @@
+"""
+Lossless compression of numeric numpy arrays (extension .shuffle), for the SerializeAsArrayShuffle and SerializeAsArrayShuffleDelta types.
+
+Generic compressors do poorly on numeric arrays: the bytes of a value are interleaved with the bytes of the others.
+The byte-shuffle filter groups the first bytes of all the values, then their second bytes, and so on:
+the sign / exponent bytes of similar floats become long runs of similar bytes, which compress well.
+The optional delta filter stores the difference between consecutive values (on their bit patterns, so it is
+lossless for floats too): it helps with smooth data (ramps, counters, images).
+
+The shuffled blocks are compressed with the compression of the variable (see compression.py), the fast preset if
+it has none: the compression is done here, by block, not again on the whole file.
+The array is processed in fixed-size blocks, compressed and decompressed in parallel threads (the codecs release
+the GIL).
+File format: magic, json header size, json header (dtype, shape, filters, codec, blocks sizes), then the compressed
+blocks. The files without codec in their header are zlib.
+"""
+
+import json
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .compression import CODECS, Compression, fast_compression
+
+_MAGIC = b"FSSH"
+_HEADER = struct.Struct("<4sI")  # magic, json header size
+_BLOCK_BYTES = 1024**2
+# the codec of the files written before the codec was in the header
+_DEFAULT_CODEC = "zlib"
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _map(function, items: list) -> list:
+    """Map function on the blocks, in parallel threads if there are several blocks."""
+    global _executor
+    if len(items) < 2:
+        return [function(item) for item in items]
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="function_saver_shuffle"
+                )
+    return list(_executor.map(function, items))
+
+
+def _uint_dtype(dtype: np.dtype) -> np.dtype | None:
+    """The unsigned integer dtype with the size and the byte order of dtype, for the delta filter."""
+    if dtype.itemsize not in (1, 2, 4, 8) or dtype.fields is not None:
+        return None
+    uint_dtype = np.dtype(f"u{dtype.itemsize}")
+    if dtype.byteorder in "<>":
+        uint_dtype = uint_dtype.newbyteorder(dtype.byteorder)
+    return uint_dtype
+
+
+def _encode_block(block: np.ndarray, uint_dtype: np.dtype | None, compression: Compression) -> bytes:
+    if uint_dtype is not None:  # delta filter, the first value of each block is kept: the blocks are independent
+        block = np.diff(block.view(uint_dtype), prepend=uint_dtype.type(0)).astype(uint_dtype, copy=False)
+    shuffled = np.ascontiguousarray(block.view(np.uint8).reshape(-1, block.itemsize).T)
+    return b"".join(compression.compress([shuffled]))
+
+
+def _dump(array: np.ndarray, delta: bool, compression: Compression | None) -> bytes:
+    if not isinstance(array, np.ndarray):
+        raise AssertionError("Input must be a numpy array")
+    if array.dtype.hasobject:
+        raise AssertionError("Arrays of objects can't be shuffled")
+    if compression is None or compression.codec is None:
+        compression = fast_compression()
+    flat = np.ascontiguousarray(array).reshape(-1)
+    uint_dtype = _uint_dtype(array.dtype) if delta else None
+    block_items = max(1, _BLOCK_BYTES // max(1, array.itemsize))
+    blocks = [flat[start:start + block_items] for start in range(0, len(flat), block_items)]
+    compressed_blocks = _map(lambda block: _encode_block(block, uint_dtype, compression), blocks)
+    header = json.dumps(
+        {
+            "dtype": np.lib.format.dtype_to_descr(array.dtype),
+            "shape": array.shape,
+            "delta": uint_dtype is not None,
+            "codec": compression.codec.name,
+            "block_items": block_items,
+            "blocks": [len(compressed_block) for compressed_block in compressed_blocks],
+        }
+    ).encode()
+    return b"".join([_HEADER.pack(_MAGIC, len(header)), header, *compressed_blocks])
+
+
+def np_array_shuffle_dump(array: np.ndarray, compression: Compression | None = None) -> bytes:
+    """
+    Dump a numpy array to bytes, byte-shuffled and compressed (fast preset if compression is None)
+
+    Raises:
+        AssertionError: if the input is not a numpy array, or is an array of objects
+    """
+    return _dump(array, False, compression)
+
+
+def np_array_shuffle_delta_dump(array: np.ndarray, compression: Compression | None = None) -> bytes:
+    """
+    Dump a numpy array to bytes, delta filtered, byte-shuffled and compressed (fast preset if compression is None)
+
+    Raises:
+        AssertionError: if the input is not a numpy array, or is an array of objects
+    """
+    return _dump(array, True, compression)
+
+
+def np_array_shuffle_load(data: bytes) -> np.ndarray:
+    """
+    Load a numpy array dumped by np_array_shuffle_dump or np_array_shuffle_delta_dump
+
+    Raises:
+        AssertionError: if the input is not bytes, or not a shuffled array
+        ValueError: if the codec of the array is not installed
+    """
+    if not isinstance(data, bytes):
+        raise AssertionError("Input must be bytes")
+    magic, header_size = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise AssertionError("Input is not a shuffled array")
+    header = json.loads(data[_HEADER.size:_HEADER.size + header_size])
+    dtype = np.lib.format.descr_to_dtype(header["dtype"])
+    uint_dtype = _uint_dtype(dtype) if header["delta"] else None
+    codec_name = header.get("codec", _DEFAULT_CODEC)
+    if codec_name not in CODECS:
+        raise ValueError(f"The shuffled array is compressed with {codec_name}, which is not installed")
+    decompress = CODECS[codec_name].decompress
+    flat = np.empty(int(np.prod(header["shape"])), dtype=dtype)
+    blocks = []
+    offset = _HEADER.size + header_size
+    for index, size in enumerate(header["blocks"]):
+        start = index * header["block_items"]
+        blocks.append((flat[start:start + header["block_items"]], data[offset:offset + size]))
+        offset += size
+
+    def decode_block(block: tuple[np.ndarray, bytes]):
+        destination, compressed_block = block
+        shuffled = np.frombuffer(decompress(compressed_block), dtype=np.uint8)
+        destination.view(np.uint8).reshape(-1, dtype.itemsize)[:] = shuffled.reshape(dtype.itemsize, -1).T
+        if uint_dtype is not None:
+            values = destination.view(uint_dtype)
+            values[:] = np.cumsum(values, dtype=uint_dtype)
+
+    _map(decode_block, blocks)
+    return flat.reshape(header["shape"])
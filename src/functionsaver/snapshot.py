@@ -0,0 +1,148 @@
+"""
+Snapshot of the inputs, taken before the call: a function modifying its inputs in place
+(i.e. image[mask] = 0) must not have its inputs saved modified.
+It also lets the captures be serialized in background threads while the caller keeps using its objects.
+
+A deepcopy would be too slow, the snapshot is specialized by type:
+    - immutable values (numbers, str, bytes, None, numpy scalars, enums...): not copied
+    - numpy arrays: copied in one memcpy, or not copied at all if read only
+    - tuples, lists, dicts: copied, their items snapshot recursively (a tuple of immutables is not copied)
+    - sets: shallow copied, their items are hashable
+    - other objects (dataclasses...): deepcopy, sharing the memo (the arrays they hold are copied once)
+A value which can't be copied (locks, files, generators...) is captured as is, after the call, like before.
+
+It is enabled by default: FUNCTION_SAVER_SNAPSHOT_<FUNCTION NAME>=0, or FUNCTION_SAVER_SNAPSHOT_ALL=0, disables it.
+Its cost is measured: see the snapshot_stats attribute of the decorated functions.
+"""
+
+import copy
+import enum
+import threading
+import types
+from typing import Any, Callable
+
+import numpy as np
+
+from .logger import get_logger
+
+logger = get_logger()
+
+_IMMUTABLE_TYPES = {
+    int,
+    float,
+    complex,
+    bool,
+    str,
+    bytes,
+    type(None),
+    range,
+    frozenset,
+    type,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+}
+
+
+def _snapshot_array(array: np.ndarray, memo: dict) -> np.ndarray:
+    if array.dtype.hasobject:
+        return copy.deepcopy(array, memo)
+    if not array.flags.writeable:
+        return array  # read only: can't be modified by the call
+    return array.copy(order="K")
+
+
+def _snapshot_tuple(value: tuple, memo: dict) -> tuple:
+    items = [snapshot(item, memo) for item in value]
+    if all(item is original for item, original in zip(items, value)):
+        return value
+    return tuple(items)
+
+
+def _snapshot_list(value: list, memo: dict) -> list:
+    copied = memo[id(value)] = []  # before the items: a list containing itself
+    copied.extend(snapshot(item, memo) for item in value)
+    return copied
+
+
+def _snapshot_dict(value: dict, memo: dict) -> dict:
+    copied = memo[id(value)] = {}
+    for key, item in value.items():
+        copied[key] = snapshot(item, memo)
+    return copied
+
+
+def _snapshot_set(value: set, memo: dict) -> set:
+    return set(value)  # the items of a set are hashable: immutable in practice, like the frozensets
+
+
+# The snapshot functions by exact type: function(value, memo) -> copy
+_snapshot_functions: dict[type, Callable[[Any, dict], Any]] = {
+    np.ndarray: _snapshot_array,
+    tuple: _snapshot_tuple,
+    list: _snapshot_list,
+    dict: _snapshot_dict,
+    set: _snapshot_set,
+    bytearray: lambda value, memo: bytearray(value),
+}
+
+# The types which failed to be copied: captured as is, without trying again
+_not_copyable: set[type] = set()
+
+
+def snapshot(value, memo: dict | None = None):
+    """
+    Copy value, so that it can't be modified by the call (see the module documentation).
+
+    Args:
+        value: the value to copy
+        memo: the values already copied, by id: the values referenced twice are copied once
+    """
+    type_ = type(value)
+    if type_ in _IMMUTABLE_TYPES or type_ in _not_copyable:
+        return value
+    if memo is None:
+        memo = {}
+    key = id(value)
+    if key in memo:
+        return memo[key]
+    snapshot_function = _snapshot_functions.get(type_)
+    try:
+        if snapshot_function is not None:
+            copied = snapshot_function(value, memo)
+        elif isinstance(value, (np.generic, enum.Enum)):
+            return value
+        else:
+            copied = copy.deepcopy(value, memo)
+    except Exception as e:
+        logger.debug(f"Function saver: {type_} can't be copied, its values are saved after the call. {e}")
+        _not_copyable.add(type_)
+        return value
+    memo[key] = copied
+    return copied
+
+
+class SnapshotStats:
+    """The cost of the snapshots of a decorated function: number of snapshots, total and max duration in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration: float):
+        with self._lock:
+            self.count += 1
+            self.total += duration
+            self.max = max(self.max, duration)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return (
+            f"SnapshotStats(count={self.count}, mean={self.mean * 1000:.3f} ms, "
+            f"max={self.max * 1000:.3f} ms, total={self.total:.3f} s)"
+        )
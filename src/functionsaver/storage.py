@@ -0,0 +1,531 @@
+"""
+How a capture is stored. FUNCTION_SAVER_STORAGE selects the format of the new captures:
+    - directory (default): one folder per capture, with inputs/, output/ and internal/ subfolders, one file per entry.
+    - zip: one zip file per capture (<capture name>.zip), with the same tree inside.
+      It is a single file to create, and entries can be read individually (random access) at replay.
+    - segment: the captures of a function are appended to rolling segment files (see segment_log.py), for the
+      functions called thousands of times per second. Rotation settings:
+        - FUNCTION_SAVER_SEGMENT_MAX_BYTES (default 64M, K, M, G, T suffixes)
+        - FUNCTION_SAVER_SEGMENT_MAX_AGE in seconds (default: no time rotation)
+      The retention (FUNCTION_SAVER_MAX_BYTES, FUNCTION_SAVER_MAX_CAPTURES, see retention.py) doesn't apply to the
+      segments: with a quota, the captures are saved in folders.
+
+The root of a capture (section "") holds its metadata: metadata.json (see timing.py).
+
+The replay reads any format: open_capture detects it from the path, or from the capture id of a segment record.
+The data written at replay (output_replay/, internal_replay/) are always written in a folder:
+the capture folder itself, or a <...>_replay/ folder next to a zip capture or a segment.
+"""
+
+import abc
+import asyncio
+import functools
+import hashlib
+import json
+import shutil
+import struct
+import zipfile
+from enum import Enum
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import aiofiles
+
+from .blob_store import BlobStore, get_blob_store
+from .config import config, parse_size
+from .logger import get_logger
+from .segment_log import (
+    SegmentRecord,
+    get_segment_log,
+    list_captures,
+    parse_capture_id,
+    read_record_header,
+    record_offset,
+)
+
+logger = get_logger()
+
+METADATA_FILE = "metadata.json"
+MANIFEST_FILE = "manifest.json"
+
+
+class CaptureStorage(str, Enum):
+    DIRECTORY = "directory"
+    ZIP = "zip"
+    SEGMENT = "segment"
+
+
+_storage_setting: tuple[tuple | None, CaptureStorage] = (None, CaptureStorage.DIRECTORY)
+
+
+def get_capture_storage() -> CaptureStorage:
+    """The storage format of the new captures (FUNCTION_SAVER_STORAGE), parsed again only when the settings change."""
+    global _storage_setting
+    setting = config.get("FUNCTION_SAVER_STORAGE", CaptureStorage.DIRECTORY.value)
+    quotas = config.max_bytes, config.max_captures
+    if (setting, quotas) != _storage_setting[0]:
+        try:
+            storage = CaptureStorage(setting.lower())
+        except ValueError:
+            logger.error(f"Invalid FUNCTION_SAVER_STORAGE {setting}: captures are saved in folders.")
+            storage = CaptureStorage.DIRECTORY
+        if storage == CaptureStorage.SEGMENT and quotas != (None, None):
+            # the records of a segment can't be evicted one by one
+            logger.error(
+                "FUNCTION_SAVER_MAX_BYTES and FUNCTION_SAVER_MAX_CAPTURES are not supported by the segment storage: "
+                "captures are saved in folders. Rotate the segments with FUNCTION_SAVER_SEGMENT_MAX_BYTES instead."
+            )
+            storage = CaptureStorage.DIRECTORY
+        _storage_setting = ((setting, quotas), storage)
+    return _storage_setting[1]
+
+
+def capture_path(root_path: Path, function_name: str, capture_name: str, storage: CaptureStorage) -> Path:
+    """
+    The path of a new capture, in the given storage format.
+    For a segment log, the capture is not a file: the path is <root>/<function>.segments/<capture name>.
+    """
+    if storage == CaptureStorage.ZIP:
+        return root_path / f"{capture_name}.zip"
+    if storage == CaptureStorage.SEGMENT:
+        return root_path / f"{function_name}.segments" / capture_name
+    return root_path / capture_name
+
+
+def entry_hasher():
+    """The hash of the data of an entry, in the manifests, the catalog and the blob store: blake2b, 128 bits."""
+    return hashlib.blake2b(digest_size=16)
+
+
+class CaptureWriter(abc.ABC):
+    """
+    Writes the entries of one capture. Entries are files named file_name in a section (inputs, output, internal).
+    The writer of a storage format hashes the entries as it writes them, once: the wrappers (manifest, catalog)
+    read their hash in digests.
+    """
+
+    #: the size in bytes and the hash (see entry_hasher) of the entries written, by (section, file name)
+    digests: dict[tuple[str, str], tuple[int, str]]
+
+    def _hash(self, section: str, file_name: str, data: bytes):
+        hasher = entry_hasher()
+        hasher.update(data)
+        self.digests[(section, file_name)] = len(data), hasher.hexdigest()
+
+    def _hashed(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> Iterator:
+        """Yield the chunks, hashing them: the entry is in digests once they are all consumed."""
+        hasher = entry_hasher()
+        size = 0
+        for chunk in chunks:
+            size += memoryview(chunk).nbytes
+            hasher.update(chunk)
+            yield chunk
+        self.digests[(section, file_name)] = size, hasher.hexdigest()
+
+    @abc.abstractmethod
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        """
+        Write an entry.
+
+        Returns:
+            The size written (in characters for text), 0 if the data was already in the blob store
+        """
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        """
+        Write an entry given as chunks of bytes, one after the other: the data is not copied in memory.
+
+        Returns:
+            The size written
+        """
+        return self.write(section, file_name, b"".join(chunks))
+
+    def close(self):
+        pass
+
+
+class BufferedEntry(CaptureWriter):
+    """
+    An entry serialized in memory, with its sidecar entries (see jsons_numpy.py), to be written later with the rest
+    of its capture (write_to): the internals saved during the call of a capture written at the end of the call or in
+    background. The saved value can then be modified by the caller, the data is already copied.
+    """
+
+    def __init__(self, value: Any):
+        self.digests = {}  # hashed when written to the capture
+        self.value_type = type(value)
+        # the immutable scalars are kept, for the catalog (see catalog.py)
+        self.value = value if isinstance(value, (bool, int, float, str)) else None
+        self.files: list[tuple[str, str, str | bytes]] = []
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        self.files.append((section, file_name, data))
+        return len(data)
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        # copied: the chunks may be views of the value
+        return self.write(section, file_name, b"".join(chunks))
+
+    def write_to(self, writer: CaptureWriter) -> int:
+        """Write the buffered files to the writer of the capture. Returns the size written."""
+        return sum(writer.write(section, file_name, data) for section, file_name, data in self.files)
+
+
+def entry_type_and_value(value: Any) -> tuple[type, Any]:
+    """The type and the value of an entry to write: for a BufferedEntry, those of the value it was serialized from."""
+    if isinstance(value, BufferedEntry):
+        return value.value_type, value.value
+    return type(value), value
+
+
+class DirectoryCaptureWriter(CaptureWriter):
+    """
+    Writes a capture folder. With a blob store, the large entries are deduplicated (see blob_store.py).
+    hash_entries=False: the entries are not hashed (no manifest), except for the blob store.
+    """
+
+    def __init__(
+        self, path: Path, sections: list[str], blob_store: BlobStore | None = None, hash_entries: bool = True
+    ):
+        self.path = path
+        self.blob_store = blob_store
+        self.hash_entries = hash_entries
+        self.digests = {}
+        path.mkdir(parents=True, exist_ok=True)
+        for section in sections:
+            (path / section).mkdir(parents=True, exist_ok=True)
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        if self.hash_entries or self.blob_store is not None:
+            encoded = data.encode() if isinstance(data, str) else data
+            self._hash(section, file_name, encoded)
+            if self.blob_store is not None and len(encoded) >= self.blob_store.min_size:
+                return self.blob_store.store(
+                    self.path / section / file_name, [encoded], self.digests[(section, file_name)][1]
+                )
+        with open(self.path / section / file_name, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        return len(data)
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        path = self.path / section / file_name
+        if self.blob_store is not None:
+            # streamed to a temporary file of the blob store, hashed meanwhile: then a blob if large enough
+            temporary = self.blob_store.temporary_path()
+            try:
+                with open(temporary, "wb") as f:
+                    for chunk in self._hashed(section, file_name, chunks):
+                        f.write(chunk)
+                size, digest = self.digests[(section, file_name)]
+                if size >= self.blob_store.min_size:
+                    return self.blob_store.add(temporary, path, digest)
+                shutil.move(temporary, path)
+                return size
+            finally:
+                temporary.unlink(missing_ok=True)
+        if self.hash_entries:
+            chunks = self._hashed(section, file_name, chunks)
+        try:
+            with open(path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                return f.tell()
+        except BaseException:
+            # no partial entry
+            path.unlink(missing_ok=True)
+            raise
+
+
+def _zip_name(section: str, file_name: str) -> str:
+    return f"{section}/{file_name}" if section else file_name
+
+
+class ZipCaptureWriter(CaptureWriter):
+    def __init__(self, path: Path, sections: list[str]):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+        self.digests = {}
+        # the sections are recorded even if empty: the replay saves internals only if internals were saved
+        for section in sections:
+            self._zip.writestr(f"{section}/", b"")
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        encoded = data.encode() if isinstance(data, str) else data
+        self._hash(section, file_name, encoded)
+        self._zip.writestr(_zip_name(section, file_name), encoded)
+        return len(data)
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        name = _zip_name(section, file_name)
+        with self._zip.open(name, "w", force_zip64=True) as f:
+            for chunk in self._hashed(section, file_name, chunks):
+                f.write(chunk)
+        return self._zip.getinfo(name).file_size
+
+    def close(self):
+        self._zip.close()
+
+
+class SegmentCaptureWriter(CaptureWriter):
+    """Streams the entries of a capture to a record of the segment log of the function, finished by close."""
+
+    def __init__(self, path: Path, sections: list[str]):
+        self.path = path
+        self.sections = sections
+        self.capture_id: str | None = None
+        # [section, file name, is text, size, offset in the data of the record]
+        self._entries = []
+        self._record: SegmentRecord | None = None
+        self.digests = {}
+
+    def _begin(self) -> SegmentRecord:
+        if self._record is None:
+            max_age = config.get("FUNCTION_SAVER_SEGMENT_MAX_AGE")
+            segment_log = get_segment_log(
+                self.path.parent,
+                parse_size(config.get("FUNCTION_SAVER_SEGMENT_MAX_BYTES", "64M")),
+                float(max_age) if max_age is not None else None,
+            )
+            self._record = segment_log.begin()
+        return self._record
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        is_text = isinstance(data, str)
+        chunk = data.encode() if is_text else data
+        self._hash(section, file_name, chunk)
+        record = self._begin()
+        offset = record.data_size
+        record.write(chunk)
+        self._entries.append([section, file_name, is_text, len(chunk), offset])
+        return len(data)
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        record = self._begin()
+        offset = record.data_size
+        # if the chunks fail, the data written is in the record but not in its entries
+        for chunk in self._hashed(section, file_name, chunks):
+            record.write(chunk)
+        size = record.data_size - offset
+        self._entries.append([section, file_name, False, size, offset])
+        return size
+
+    def close(self):
+        header = json.dumps({"sections": self.sections, "entries": self._entries}).encode()
+        self.capture_id = self._begin().finish(header)
+
+
+def create_capture_writer(storage: CaptureStorage, path: Path, sections: list[str]) -> CaptureWriter:
+    if storage == CaptureStorage.ZIP:
+        return ZipCaptureWriter(path, sections)
+    if storage == CaptureStorage.SEGMENT:
+        return SegmentCaptureWriter(path, sections)
+    return DirectoryCaptureWriter(path, sections, get_blob_store())
+
+
+class CaptureReader(abc.ABC):
+    """Reads the entries of one capture, whatever its storage format."""
+
+    #: the folder where the replay writes output_replay/ and internal_replay/
+    replay_folder: Path
+    #: the capture, for the messages
+    location: str
+
+    @abc.abstractmethod
+    def has_section(self, section: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def find(self, section: str, name: str) -> list[str]:
+        """The file names of the entries named name.<extension> in section."""
+
+    @abc.abstractmethod
+    def read(self, section: str, file_name: str, mode: str) -> str | bytes:
+        """Read an entry, as str if mode is "r", as bytes if mode is "rb"."""
+
+    async def read_async(self, section: str, file_name: str, mode: str) -> str | bytes:
+        return await asyncio.to_thread(self.read, section, file_name, mode)
+
+    def entry_location(self, section: str, file_name: str) -> tuple[Path, int] | None:
+        """
+        Where the data of an entry is stored as is, to be memory mapped: the file and the offset of the data.
+        None if the entry is not stored as is (i.e. compressed).
+        """
+        return None
+
+    def metadata(self) -> dict:
+        """The metadata of the capture (see timing.py), empty for the captures saved without."""
+        try:
+            return json.loads(self.read("", METADATA_FILE, "r"))
+        except (FileNotFoundError, KeyError):
+            return {}
+
+    @functools.cached_property
+    def manifest(self) -> dict[tuple[str, str], dict] | None:
+        """The manifest entries (see manifest.py) by (section, file name), None for the captures saved without."""
+        try:
+            entries = json.loads(self.read("", MANIFEST_FILE, "r"))["entries"]
+        except (FileNotFoundError, KeyError):
+            return None
+        return {(entry["section"], entry["file"]): entry for entry in entries}
+
+    def entry_files(self, section: str, name: str) -> list[str]:
+        """Same as find, from the manifest of the capture if any: the section is not listed."""
+        if self.manifest is None:
+            return self.find(section, name)
+        return [
+            file_name
+            for (entry_section, file_name), entry in self.manifest.items()
+            if entry_section == section and entry["name"] == name
+        ]
+
+
+class DirectoryCaptureReader(CaptureReader):
+    def __init__(self, path: Path):
+        self.path = path
+        self.replay_folder = path
+        self.location = str(path)
+
+    def has_section(self, section: str) -> bool:
+        return (self.path / section).exists()
+
+    def find(self, section: str, name: str) -> list[str]:
+        return [file.name for file in (self.path / section).glob(f"{name}.*")]
+
+    def read(self, section: str, file_name: str, mode: str) -> str | bytes:
+        with open(self.path / section / file_name, mode) as f:
+            return f.read()
+
+    async def read_async(self, section: str, file_name: str, mode: str) -> str | bytes:
+        async with aiofiles.open(self.path / section / file_name, mode) as f:
+            return await f.read()
+
+    def entry_location(self, section: str, file_name: str) -> tuple[Path, int] | None:
+        return self.path / section / file_name, 0
+
+
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+class ZipCaptureReader(CaptureReader):
+    def __init__(self, path: Path):
+        self.path = path
+        self.replay_folder = path.with_name(path.stem + "_replay")
+        self.location = str(path)
+        with zipfile.ZipFile(path) as zip_file:
+            names = zip_file.namelist()
+        self._sections: dict[str, list[str]] = {}
+        for name in names:
+            # the entries at the root of the capture (its metadata) are in the section ""
+            section, _, file_name = name.partition("/") if "/" in name else ("", "", name)
+            files = self._sections.setdefault(section, [])
+            if file_name:
+                files.append(file_name)
+
+    def has_section(self, section: str) -> bool:
+        return section in self._sections
+
+    def find(self, section: str, name: str) -> list[str]:
+        prefix = f"{name}."
+        return [file_name for file_name in self._sections.get(section, []) if file_name.startswith(prefix)]
+
+    def read(self, section: str, file_name: str, mode: str) -> str | bytes:
+        with zipfile.ZipFile(self.path) as zip_file:
+            data = zip_file.read(_zip_name(section, file_name))
+        return data.decode() if mode == "r" else data
+
+    def entry_location(self, section: str, file_name: str) -> tuple[Path, int] | None:
+        with zipfile.ZipFile(self.path) as zip_file:
+            info = zip_file.getinfo(_zip_name(section, file_name))
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:  # compressed or encrypted
+            return None
+        # the data follows the local file header: 30 bytes, then the file name and the extra field
+        with open(self.path, "rb") as f:
+            f.seek(info.header_offset)
+            local_header = f.read(_ZIP_LOCAL_HEADER.size)
+        name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(local_header)[-2:]
+        return self.path, info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length
+
+
+class SegmentCaptureReader(CaptureReader):
+    """Reads the record at offset in a segment. Only the header is read when opening."""
+
+    def __init__(self, segment: Path, offset: int):
+        self.segment = segment
+        self.replay_folder = segment.with_name(f"{segment.stem}_{offset}_replay")
+        self.location = f"{segment}@{offset}"
+        header, data_offset = read_record_header(segment, offset)
+        header = json.loads(header)
+        self._sections: dict[str, dict[str, tuple[int, int, bool]]] = {
+            section: {} for section in header["sections"]
+        }
+        position = data_offset
+        for section, file_name, is_text, size, *offset in header["entries"]:
+            # the records written before the streaming have no offsets: the entries are back to back
+            entry_offset = data_offset + offset[0] if offset else position
+            self._sections.setdefault(section, {})[file_name] = (entry_offset, size, is_text)
+            position += size
+
+    def has_section(self, section: str) -> bool:
+        return section in self._sections
+
+    def find(self, section: str, name: str) -> list[str]:
+        prefix = f"{name}."
+        return [file_name for file_name in self._sections.get(section, {}) if file_name.startswith(prefix)]
+
+    def read(self, section: str, file_name: str, mode: str) -> str | bytes:
+        offset, size, _ = self._sections[section][file_name]
+        with open(self.segment, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        return data.decode() if mode == "r" else data
+
+    def entry_location(self, section: str, file_name: str) -> tuple[Path, int] | None:
+        return self.segment, self._sections[section][file_name][0]
+
+
+def open_capture(location: str | Path | tuple[str | Path, int]) -> CaptureReader:
+    """
+    Open a capture for reading: a capture folder, a zip capture,
+    or a segment record, given by its capture id or by (segment path, offset).
+
+    Raises:
+        FileNotFoundError: if there is no capture at location
+    """
+    if isinstance(location, tuple):
+        segment, offset = location
+        return SegmentCaptureReader(Path(segment), offset)
+    path = Path(location)
+    if path.is_dir():
+        return DirectoryCaptureReader(path)
+    if path.is_file() and zipfile.is_zipfile(path):
+        return ZipCaptureReader(path)
+    capture_id = parse_capture_id(str(location))
+    if capture_id is not None:
+        segment, record_number = capture_id
+        return SegmentCaptureReader(segment, record_offset(segment, record_number))
+    raise FileNotFoundError(f"No capture found at {location}")
+
+
+def read_capture_metadata(location: str | Path | tuple[str | Path, int]) -> dict:
+    """
+    The metadata of a capture (metadata.json: the timing of the call and of its saving, see timing.py).
+
+    Args:
+        location: the capture, as taken by open_capture
+
+    Raises:
+        FileNotFoundError: if there is no capture at location
+    """
+    return open_capture(location).metadata()
+
+
+def list_segment_captures(function_name: str, root_path: str | Path | None = None) -> list[str]:
+    """
+    The capture ids of the segment log of a function, oldest first.
+
+    Args:
+        function_name: the name of the decorated function
+        root_path: the root path of the captures, default is FUNCTION_SAVER_ROOT_PATH
+    """
+    return list_captures(Path(root_path or config.root_path) / f"{function_name}.segments")
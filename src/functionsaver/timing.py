@@ -0,0 +1,240 @@
+"""
+Timing of the decorated functions:
+    - each capture records the durations of its call and of its saving, in the metadata.json of the capture:
+        - wall: the wall time of the call
+        - cpu: the CPU time of the call, in the calling thread (None for async functions: the CPU time of a task
+          can't be told from the other tasks of the event loop)
+        - snapshot: the copy of the inputs before the call (see snapshot.py)
+        - serialization: the serialization of the values, and their compression
+        - io: the writing of the data
+    - each decorated function has a latency histogram of all its calls, captured or not: my_function.latency
+      (latency_histograms() gives them all). It is always on: recording a call is a few integer operations,
+      in a shard owned by the calling thread, without lock. The shard of a thread is folded into the histogram
+      when the thread ends (see ThreadShards).
+"""
+
+import json
+import threading
+import time
+import weakref
+from typing import Iterable
+
+from .storage import CaptureWriter
+
+# 4 buckets per power of two: the error on a percentile is less than 25%
+_SUB_BUCKETS_BITS = 2
+_SUB_BUCKETS = 1 << _SUB_BUCKETS_BITS
+_BUCKETS = 64 * _SUB_BUCKETS
+
+
+def _bucket(duration_ns: int) -> int:
+    """The bucket of a duration: the exact value below _SUB_BUCKETS ns, then log-linear"""
+    if duration_ns < _SUB_BUCKETS:
+        return max(duration_ns, 0)
+    shift = duration_ns.bit_length() - _SUB_BUCKETS_BITS - 1
+    return (shift + 1) * _SUB_BUCKETS + ((duration_ns >> shift) & (_SUB_BUCKETS - 1))
+
+
+def _bucket_bounds(bucket: int) -> tuple[int, int]:
+    """The durations (ns) of a bucket: [lower, upper["""
+    if bucket < _SUB_BUCKETS:
+        return bucket, bucket + 1
+    shift = bucket // _SUB_BUCKETS - 1
+    lower = (_SUB_BUCKETS + bucket % _SUB_BUCKETS) << shift
+    return lower, lower + (1 << shift)
+
+
+class _ShardOwner:
+    """Referenced only by the thread-local of its thread: collected when the thread ends."""
+
+    __slots__ = ("__weakref__",)
+
+
+class ThreadShards:
+    """
+    Counts sharded by thread: each thread increments its own shard (local.shard), without lock, the reads sum the
+    shards. The shard of a thread is folded into the retired counts when the thread ends: the threads come and go
+    (writer pools, executors), their shards don't pile up.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        #: local.shard: the shard of the current thread, if it has one
+        self.local = threading.local()
+        self._shards: dict[int, list[int]] = {}  # by id
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def new_shard(self) -> list[int]:
+        """The shard of the current thread, created at its first update"""
+        shard = [0] * self.size
+        owner = _ShardOwner()
+        weakref.finalize(owner, self._fold, shard).atexit = False
+        with self._lock:
+            self._shards[id(shard)] = shard
+        self.local.owner = owner
+        self.local.shard = shard
+        return shard
+
+    def _fold(self, shard: list[int]):
+        with self._lock:
+            del self._shards[id(shard)]
+            self._retired = [retired + count for retired, count in zip(self._retired, shard)]
+
+    def totals(self) -> list[int]:
+        with self._lock:
+            shards = [self._retired, *self._shards.values()]
+        return [sum(counts) for counts in zip(*shards)]
+
+    def reset(self):
+        with self._lock:
+            self._retired = [0] * self.size
+            for shard in self._shards.values():
+                shard[:] = [0] * self.size
+
+
+class LatencyHistogram:
+    """
+    Histogram of the durations of the calls of a function, log-linear, sharded by thread:
+    each thread increments its own counts, the reads sum the shards.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # the buckets, then the total duration
+        self._shards = ThreadShards(_BUCKETS + 1)
+        self._local = self._shards.local
+
+    def record(self, duration_ns: int):
+        """Record the duration of a call, in nanoseconds"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shards.new_shard()
+        shard[_bucket(duration_ns)] += 1
+        shard[_BUCKETS] += duration_ns
+
+    def _counts(self) -> list[int]:
+        return self._shards.totals()
+
+    def reset(self):
+        self._shards.reset()
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts()[:_BUCKETS])
+
+    def buckets(self) -> list[tuple[float, int]]:
+        """The non empty buckets: (upper bound in seconds, count), by increasing duration"""
+        counts = self._counts()
+        return [(_bucket_bounds(bucket)[1] / 1e9, counts[bucket]) for bucket in range(_BUCKETS) if counts[bucket]]
+
+    def summary(self, percentiles: Iterable[float] = (0.5, 0.9, 0.99)) -> dict:
+        """
+        The count, the total and mean durations, and the percentiles (estimated, in seconds) of the calls.
+        i.e. {"count": 10, "total": 0.01, "mean": 0.001, "p50": 0.0009, "p90": 0.0012, "p99": 0.0015}
+        """
+        counts = self._counts()
+        count = sum(counts[:_BUCKETS])
+        total = counts[_BUCKETS] / 1e9
+        summary = {"count": count, "total": total, "mean": total / count if count else 0.0}
+        for percentile in percentiles:
+            summary[f"p{percentile * 100:g}"] = self._percentile(counts, count, percentile)
+        return summary
+
+    def percentile(self, percentile: float) -> float:
+        """The estimated duration (seconds) under which are this proportion of the calls, i.e. 0.99"""
+        counts = self._counts()
+        return self._percentile(counts, sum(counts[:_BUCKETS]), percentile)
+
+    @staticmethod
+    def _percentile(counts: list[int], count: int, percentile: float) -> float:
+        if count == 0:
+            return 0.0
+        rank = percentile * count
+        seen = 0
+        for bucket in range(_BUCKETS):
+            seen += counts[bucket]
+            if seen >= rank and counts[bucket]:
+                lower, upper = _bucket_bounds(bucket)
+                return (lower + upper) / 2e9
+        return 0.0
+
+    def __repr__(self):
+        return f"LatencyHistogram({self.name}, {self.summary()})"
+
+
+_histograms: dict[str, LatencyHistogram] = {}
+
+
+def new_latency_histogram(name: str) -> LatencyHistogram:
+    """The histogram of a decorated function (by qualified name), registered for latency_histograms"""
+    histogram = _histograms[name] = LatencyHistogram(name)
+    return histogram
+
+
+def latency_histograms() -> dict[str, LatencyHistogram]:
+    """The latency histograms of all the decorated functions, by qualified name (module.qualname)"""
+    return dict(_histograms)
+
+
+class CaptureTiming:
+    """The durations (seconds) of a captured call and of its saving, see the module documentation."""
+
+    __slots__ = ("wall", "cpu", "snapshot", "serialization", "io")
+
+    def __init__(self):
+        self.wall: float | None = None
+        self.cpu: float | None = None
+        self.snapshot = 0.0
+        self.serialization = 0.0
+        self.io = 0.0
+
+    def to_json(self) -> str:
+        return json.dumps({"timing": {name: getattr(self, name) for name in self.__slots__}})
+
+
+class TimingWriter(CaptureWriter):
+    """
+    Wraps the writer of a capture, to measure the time spent writing.
+    The time spent producing the chunks (numpy arrays streamed, compression) is serialization, not io.
+    """
+
+    def __init__(self, writer: CaptureWriter):
+        self.writer = writer
+        self.digests = writer.digests
+        self.io = 0.0
+
+    def write(self, section: str, file_name: str, data: str | bytes) -> int:
+        start = time.perf_counter()
+        try:
+            return self.writer.write(section, file_name, data)
+        finally:
+            self.io += time.perf_counter() - start
+
+    def write_chunks(self, section: str, file_name: str, chunks: Iterable[bytes | memoryview]) -> int:
+        producing = 0.0
+
+        def timed_chunks():
+            nonlocal producing
+            iterator = iter(chunks)
+            while True:
+                start_chunk = time.perf_counter()
+                chunk = next(iterator, None)
+                producing += time.perf_counter() - start_chunk
+                if chunk is None:
+                    return
+                yield chunk
+
+        start = time.perf_counter()
+        try:
+            return self.writer.write_chunks(section, file_name, timed_chunks())
+        finally:
+            self.io += time.perf_counter() - start - producing
+
+    def close(self):
+        start = time.perf_counter()
+        try:
+            self.writer.close()
+        finally:
+            self.io += time.perf_counter() - start
@@ -0,0 +1,169 @@
+"""
+Background writer pool: captures are handed to a bounded queue and written by a pool of threads,
+so the caller of a decorated function doesn't pay the serialization and disk cost.
+
+It is enabled with FUNCTION_SAVER_BACKGROUND=1, and configured with:
+    - FUNCTION_SAVER_BACKGROUND_THREADS: number of writer threads (default 2)
+    - FUNCTION_SAVER_BACKGROUND_QUEUE_SIZE: max number of captures waiting to be written (default 256)
+    - FUNCTION_SAVER_BACKGROUND_OVERFLOW: what to do when the queue is full (default block):
+        - block: the caller waits for a free slot
+        - drop_newest: the new capture is dropped
+        - drop_oldest: the oldest waiting capture is dropped to make room for the new one
+
+Pending captures are flushed at exit.
+"""
+
+import atexit
+import queue
+import threading
+from enum import Enum
+from typing import Callable
+
+from .config import config
+from .logger import get_logger
+
+logger = get_logger()
+
+
+class OverflowPolicy(str, Enum):
+    BLOCK = "block"
+    DROP_NEWEST = "drop_newest"
+    DROP_OLDEST = "drop_oldest"
+
+
+_STOP = object()
+
+
+def parse_overflow_policy(spec: str) -> OverflowPolicy:
+    """
+    The overflow policy of FUNCTION_SAVER_BACKGROUND_OVERFLOW
+
+    Raises:
+        ValueError: if the spec is invalid
+    """
+    try:
+        return OverflowPolicy(spec.strip().lower())
+    except ValueError:
+        expected = ", ".join(policy.value for policy in OverflowPolicy)
+        raise ValueError(f"Invalid overflow policy '{spec}'. Expected {expected}") from None
+
+
+class WriterPool:
+    """
+    A pool of threads consuming jobs (callables without arguments) from a bounded queue.
+    A job is expected to write one whole capture, so that dropping a job never leaves a partial capture.
+    """
+
+    def __init__(self, threads: int = 2, queue_size: int = 256, overflow: OverflowPolicy = OverflowPolicy.BLOCK):
+        if threads < 1:
+            raise ValueError(f"Writer pool needs at least one thread, it is {threads}")
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._overflow = parse_overflow_policy(overflow)
+        # the captures are dropped by the calling threads
+        self._dropped_lock = threading.Lock()
+        self._dropped = 0
+        self._threads = [
+            threading.Thread(target=self._work, name=f"function_saver_writer_{i}", daemon=True)
+            for i in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def dropped(self) -> int:
+        """Number of captures dropped because the queue was full."""
+        return self._dropped
+
+    def submit(self, job: Callable[[], None], on_drop: Callable[[], None] | None = None) -> bool:
+        """
+        Queue a job, applying the overflow policy if the queue is full.
+
+        Args:
+            job: the job writing a capture
+            on_drop: Optional. Called if the job is dropped (i.e. to count the dropped captures, see metrics.py)
+
+        Returns:
+            False if the job was dropped, True otherwise.
+        """
+        item = (job, on_drop)
+        if self._overflow == OverflowPolicy.BLOCK:
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        if self._overflow == OverflowPolicy.DROP_NEWEST:
+            self._on_drop(on_drop)
+            return False
+        # drop oldest: make room by discarding waiting jobs until ours fits
+        while True:
+            try:
+                _, dropped_on_drop = self._queue.get_nowait()
+                self._queue.task_done()
+                self._on_drop(dropped_on_drop)
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                continue
+
+    def flush(self):
+        """Block until all the queued jobs are written."""
+        self._queue.join()
+
+    def shutdown(self):
+        """Flush the queue and stop the threads."""
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _on_drop(self, on_drop: Callable[[], None] | None):
+        with self._dropped_lock:
+            self._dropped += 1
+            dropped = self._dropped
+        if on_drop is not None:
+            on_drop()
+        logger.debug(f"Function saver background queue is full: capture dropped ({dropped} so far)")
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                item[0]()
+            except Exception as e:
+                logger.error(f"Error while writing a capture in background. {e}")
+            finally:
+                self._queue.task_done()
+
+
+_writer_pool: WriterPool | None = None
+_writer_pool_lock = threading.Lock()
+
+
+def get_writer_pool() -> WriterPool:
+    """Get the process wide writer pool, creating it from the configuration on first use."""
+    global _writer_pool
+    if _writer_pool is None:
+        with _writer_pool_lock:
+            if _writer_pool is None:
+                _writer_pool = WriterPool(
+                    threads=int(config.get("FUNCTION_SAVER_BACKGROUND_THREADS", "2")),
+                    queue_size=int(config.get("FUNCTION_SAVER_BACKGROUND_QUEUE_SIZE", "256")),
+                    overflow=parse_overflow_policy(config.get("FUNCTION_SAVER_BACKGROUND_OVERFLOW", "block")),
+                )
+                atexit.register(flush_background_writes)
+    return _writer_pool
+
+
+def flush_background_writes():
+    """Block until all the captures handed to the background writer pool are written."""
+    if _writer_pool is not None:
+        _writer_pool.flush()
@@ -4,6 +4,8 @@ import tempfile
 
 import pytest
 
+from functionsaver import reload_config
+
 
 def pytest_configure(config):  # noqa: yes config is not used. But it's the pytest hook signature.
     logging.basicConfig(level=logging.DEBUG)
@@ -23,11 +25,13 @@ def reset_environment():
     yield
     os.environ.clear()
     os.environ.update(old_environ)
+    reload_config()
 
 
 def update_settings_with_env(env: dict[str, str]):
     for env_name, env_value in env.items():
         os.environ[env_name] = env_value
+    reload_config()  # the function saver configuration is a snapshot of the environment
 
 
 @pytest.fixture
@@ -0,0 +1,51 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+from functionsaver import function_saver, flush_async_captures, set_capture_executor
+from functionsaver.function_saver import replay_and_check_function_async
+from conftest import update_settings_with_env
+from utils_for_tests import check_function_saving_files, get_data_folders_from_function_saver_root
+
+
+@function_saver
+async def function_for_test(a: int, b: int) -> int:
+    assert function_for_test.is_save_internal_enabled() is True
+    await function_for_test.save_internal_async(a - b, "subtracted")
+    return a + b
+
+
+@function_saver
+async def function_with_array(image: np.ndarray) -> np.ndarray:
+    return 255 - image
+
+
+async def test_async_capture_not_awaited(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": "1"})
+    for i in range(5):
+        await function_for_test(i, 2 * i)
+    await flush_async_captures()
+    check_function_saving_files(temp_folder, expected_folders=5)
+
+
+@pytest.fixture
+def process_pool_executor():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        set_capture_executor(executor)
+        yield executor
+    set_capture_executor(None)
+
+
+async def test_async_capture_in_process_pool(reset_environment, fonctionsaver_in_tempfolder, process_pool_executor):
+    temp_folder = fonctionsaver_in_tempfolder
+    image = np.arange(100 * 100, dtype=np.uint8).reshape((100, 100))
+    await function_with_array(image)
+
+    for data_folders in get_data_folders_from_function_saver_root(temp_folder):
+        assert (data_folders.input_path / "image.npy").exists()
+        await replay_and_check_function_async(function_with_array, data_folders.function_saver_path, np.array_equal)
+        break
+    else:
+        assert False, "Cannot find a folder for replay"
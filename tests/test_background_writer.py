@@ -0,0 +1,118 @@
+import importlib
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from functionsaver import function_saver, flush_background_writes
+from functionsaver.writer_pool import WriterPool, OverflowPolicy
+from conftest import update_settings_with_env
+from utils_for_tests import check_function_saving_files
+
+
+@function_saver
+def function_for_test(a: int, b: int) -> int:
+    assert function_for_test.is_save_internal_enabled() is True
+    function_for_test.save_internal(a - b, "subtracted")
+    return a + b
+
+
+def test_background_writing(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": "1"})
+    threads = [threading.Thread(target=function_for_test, args=(1, i * 10)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    flush_background_writes()
+    check_function_saving_files(temp_folder, expected_folders=10)
+
+
+@function_saver
+def function_returning_list(a: int) -> list:
+    internal = [0, 0, 0]
+    function_returning_list.save_internal(internal, "internal")
+    internal[:] = [5, 5, 5]
+    return [a, a]
+
+
+def test_background_writes_a_snapshot(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": "1"})
+    jobs = []
+
+    class HeldPool:
+        def submit(self, job, on_drop=None):
+            jobs.append(job)
+
+    # the module, not the decorator of the same name
+    monkeypatch.setattr(importlib.import_module("functionsaver.function_saver"), "get_writer_pool", HeldPool)
+    output = function_returning_list(1)
+    # the caller modifies the output before the capture is written
+    output[1] = 99
+    for job in jobs:
+        job()
+
+    capture = next(Path(fonctionsaver_in_tempfolder).iterdir())
+    assert json.loads((capture / "output" / "output.json").read_text()) == [1, 1]
+    assert json.loads((capture / "internal" / "internal.json").read_text()) == [0, 0, 0]
+
+
+@pytest.mark.parametrize(
+    "overflow, expected_written",
+    [
+        (OverflowPolicy.DROP_NEWEST, ["first", "second"]),
+        (OverflowPolicy.DROP_OLDEST, ["first", "third"]),
+    ],
+)
+def test_writer_pool_overflow(overflow, expected_written):
+    pool = WriterPool(threads=1, queue_size=1, overflow=overflow)
+    written = []
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_job():
+        started.set()
+        release.wait()
+        written.append("first")
+
+    pool.submit(blocking_job)
+    started.wait()  # the thread is busy, the queue is empty
+    dropped = []
+    assert pool.submit(lambda: written.append("second"), on_drop=lambda: dropped.append("second")) is True
+    pool.submit(lambda: written.append("third"), on_drop=lambda: dropped.append("third"))
+    assert pool.dropped == 1
+    release.set()
+    pool.shutdown()
+    assert written == expected_written
+    assert dropped == [job for job in ["second", "third"] if job not in expected_written]
+
+
+def test_writer_pool_drops_counted_from_threads():
+    pool = WriterPool(threads=1, queue_size=1, overflow=OverflowPolicy.DROP_NEWEST)
+    release = threading.Event()
+    started = threading.Event()
+    pool.submit(lambda: (started.set(), release.wait()))
+    started.wait()
+    pool.submit(lambda: None)  # the queue is full
+
+    def submit_many():
+        for _ in range(1000):
+            pool.submit(lambda: None)
+
+    threads = [threading.Thread(target=submit_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.dropped == 8000
+    release.set()
+    pool.shutdown()
+
+
+def test_writer_pool_invalid_settings():
+    with pytest.raises(ValueError, match="Invalid overflow policy 'drop_all'"):
+        WriterPool(threads=1, overflow="drop_all")
+    with pytest.raises(ValueError, match="at least one thread"):
+        WriterPool(threads=0)
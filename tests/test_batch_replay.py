@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from functionsaver import batch_replay, flush_background_writes, function_saver
+from functionsaver.__main__ import main
+from functionsaver.batch_replay import ReplayStatus, diff_summary, discover_captures, outputs_equal
+from conftest import update_settings_with_env
+
+
+@function_saver
+def scale(values: np.ndarray, factor: float) -> np.ndarray:
+    if factor < 0:
+        raise ValueError("negative factor")
+    return values * factor
+
+
+@function_saver
+def sleep_or_exit(seconds: float, exit_code: int) -> float:
+    if exit_code:
+        os._exit(exit_code)
+    time.sleep(seconds)
+    return seconds
+
+
+@function_saver
+async def scale_async(values: list[int], factor: int) -> list[int]:
+    return [value * factor for value in values]
+
+
+def test_outputs_equal():
+    assert outputs_equal({"a": np.array([1.0, np.nan])}, {"a": np.array([1.0, np.nan])})
+    assert not outputs_equal([np.zeros(2)], [np.zeros(3)])
+    assert not outputs_equal(np.zeros(2), [0, 0])
+    assert outputs_equal((1, "a"), (1, "a"))
+
+
+def test_diff_summary():
+    expected = np.zeros((2, 3))
+    output = expected.copy()
+    output[1, 2] = 0.5
+    assert diff_summary(output, expected) == "output: 1/6 elements differ, first at (1, 2), max abs difference 0.5"
+    assert diff_summary(np.zeros(2), np.zeros(3)) == "output: shape (2,) float64 != (3,) float64"
+    assert diff_summary({"a": [1, 2]}, {"a": [1, 3]}) == "output['a'][1]: 2 != 3"
+    assert diff_summary({"a": 1}, {"b": 1}) == "output: keys missing ['b'], extra ['a']"
+    assert diff_summary([1], [1, 2]) == "output: length 1 != 2"
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_discover_captures(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    for factor in range(3):
+        scale(np.arange(3), factor)
+    sleep_or_exit(0, 0)
+    flush_background_writes()
+
+    captures = discover_captures("scale", fonctionsaver_in_tempfolder)
+    assert len(captures) == 3
+    assert len(discover_captures("sleep_or_exit", fonctionsaver_in_tempfolder)) == 1
+    assert discover_captures("scale_async", fonctionsaver_in_tempfolder) == []
+
+
+def test_batch_replay(reset_environment, fonctionsaver_in_tempfolder):
+    for factor in range(3):
+        scale(np.arange(4.0), factor)
+    _, capture, raising = discover_captures("scale", fonctionsaver_in_tempfolder)
+    # the saved output of the second capture is changed: a mismatch at replay, the input of the third: an error
+    np.save(Path(capture) / "output" / "output.npy", np.array([0.0, 1.0, 2.0, 4.0]))
+    (Path(raising) / "inputs" / "factor.json").write_text("-1")
+
+    report = batch_replay(scale, fonctionsaver_in_tempfolder, workers=2)
+    statuses = [result.status for result in report.results]
+    assert sorted(statuses) == sorted([ReplayStatus.PASSED, ReplayStatus.FAILED, ReplayStatus.ERROR])
+    assert not report.ok
+    assert report.counts() == {"passed": 1, "failed": 1, "error": 1, "timeout": 0, "crashed": 0}
+    failed = next(result for result in report.results if result.status == ReplayStatus.FAILED)
+    assert failed.capture_id == capture
+    assert failed.diff == "output: 1/4 elements differ, first at (3,), max abs difference 1"
+    assert failed.load_duration >= 0 and failed.run_duration >= 0
+    error = next(result for result in report.results if result.status == ReplayStatus.ERROR)
+    assert "ValueError: negative factor" in error.exception
+    assert "failed" in report.summary()
+
+    # without check, the mismatch passes
+    report = batch_replay("test_batch_replay:scale", fonctionsaver_in_tempfolder, workers=1, check=False)
+    assert report.counts()["passed"] == 2
+
+
+def test_batch_replay_async(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "zip"})
+    asyncio.run(scale_async([1, 2], 3))
+    report = batch_replay(scale_async, fonctionsaver_in_tempfolder, workers=1)
+    assert report.ok
+    assert len(report.results) == 1
+
+
+def test_batch_replay_timeout_and_crash(reset_environment, fonctionsaver_in_tempfolder):
+    for _ in range(3):
+        sleep_or_exit(0, 0)
+    # the inputs are changed: the second replay crashes its worker, the third one times out
+    passed, crashed, timed_out = map(Path, discover_captures("sleep_or_exit", fonctionsaver_in_tempfolder))
+    (crashed / "inputs" / "exit_code.json").write_text("3")
+    (timed_out / "inputs" / "seconds.json").write_text("30")
+
+    report = batch_replay(sleep_or_exit, fonctionsaver_in_tempfolder, workers=2, timeout=1, retries=1)
+    assert [result.status for result in report.results] == [
+        ReplayStatus.PASSED,
+        ReplayStatus.CRASHED,
+        ReplayStatus.TIMEOUT,
+    ]
+    assert [result.attempts for result in report.results] == [1, 2, 2]
+    assert "exit code 3" in report.results[1].exception
+    assert report.duration < 30
+
+
+def test_main(reset_environment, fonctionsaver_in_tempfolder, tmp_path):
+    scale(np.arange(4.0), 2.0)
+    report_path = tmp_path / "report.json"
+    arguments = ["replay", "test_batch_replay:scale", "--root", fonctionsaver_in_tempfolder, "--workers", "1"]
+    assert main(arguments + ["--report", str(report_path)]) == 0
+    report = json.loads(report_path.read_text())
+    assert report["counts"]["passed"] == 1
+    assert report["results"][0]["status"] == "passed"
+    with pytest.raises(ValueError, match="can't be imported"):
+        main(["replay", "test_batch_replay:unknown", "--root", fonctionsaver_in_tempfolder])
@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import numpy as np
+
+from functionsaver import function_saver, gc_blobs, replay_and_check_function
+from conftest import update_settings_with_env
+from utils_for_tests import get_data_folders_from_function_saver_root
+
+
+@function_saver
+def function_with_table(a: int, table: np.ndarray, config: list) -> int:
+    return a + int(table[0]) + len(config)
+
+
+def get_blobs(temp_folder) -> list[Path]:
+    return sorted(path for path in (Path(temp_folder) / ".blobs").glob("*/*"))
+
+
+def get_captures(temp_folder):
+    return [
+        data_folders
+        for data_folders in get_data_folders_from_function_saver_root(temp_folder)
+        if data_folders.function_saver_path.name != ".blobs"
+    ]
+
+
+def test_dedup(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_DEDUP": "1", "FUNCTION_SAVER_DEDUP_MIN_SIZE": "1K"})
+    table = np.arange(1000, dtype=np.int64)
+    config = list(range(500))
+    for i in range(5):
+        assert function_with_table(i, table, config) == i + 500
+
+    # the table and the config are stored once, a is too small to be deduplicated
+    blobs = get_blobs(temp_folder)
+    assert len(blobs) == 2
+    assert [blob.stat().st_nlink for blob in blobs] == [6, 6]
+    # the temporary files (the streamed entries) are moved or deleted
+    assert not list((Path(temp_folder) / ".blobs").glob("*.tmp"))
+    captures = get_captures(temp_folder)
+    assert len(captures) == 5
+    for data_folders in captures:
+        assert any((data_folders.input_path / "table.npy").samefile(blob) for blob in blobs)
+        assert (data_folders.input_path / "a.json").stat().st_nlink == 1
+        assert replay_and_check_function(function_with_table, data_folders.function_saver_path) == 500 + int(
+            (data_folders.input_path / "a.json").read_text()
+        )
+
+
+def test_dedup_with_retention(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    from functionsaver import retention
+
+    def deleting(path, root_path):
+        # the other captures don't wait for the disk
+        assert not retention.get_retention()._lock.locked()
+        return delete(path, root_path)
+
+    def scanning_all_blobs(_):
+        raise AssertionError("all the blobs are scanned")
+
+    delete = retention._delete
+    monkeypatch.setattr(retention, "_delete", deleting)
+    # the blobs of the evicted captures are found from their manifest
+    monkeypatch.setattr(retention, "gc_blobs", scanning_all_blobs)
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env(
+        {"FUNCTION_SAVER_DEDUP": "1", "FUNCTION_SAVER_DEDUP_MIN_SIZE": "1K", "FUNCTION_SAVER_MAX_CAPTURES": "2"}
+    )
+    config = []
+    first_table = np.zeros(1000)
+    for i in range(2):
+        function_with_table(i, first_table, config)
+    assert len(get_blobs(temp_folder)) == 1
+
+    # the captures of the first table are evicted: its blob is collected
+    for i in range(3):
+        function_with_table(i, np.ones(1000), config)
+    assert len(get_captures(temp_folder)) == 2
+    blobs = get_blobs(temp_folder)
+    assert len(blobs) == 1
+    assert np.load(blobs[0])[0] == 1
+
+
+def test_gc_blobs(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_DEDUP": "1", "FUNCTION_SAVER_DEDUP_MIN_SIZE": "1K"})
+    function_with_table(1, np.zeros(1000), [])
+    for data_folders in get_captures(temp_folder):
+        (data_folders.input_path / "table.npy").unlink()
+    assert gc_blobs() == 8000 + 128
+    assert get_blobs(temp_folder) == []
@@ -0,0 +1,59 @@
+import inspect
+
+import numpy as np
+import pytest
+
+from functionsaver import SerializeAsArrayPng
+from functionsaver.capture_plan import CapturePlan
+
+
+def function_simple(a: int, b, c=3, *, d: np.ndarray | SerializeAsArrayPng = None) -> np.ndarray:
+    pass
+
+
+def function_var_args(a, /, b, *args, c=1, **kwargs):
+    pass
+
+
+def bind_with_inspect(function, args, kwargs):
+    bound_args = inspect.signature(function).bind_partial(*args, **kwargs)
+    bound_args.apply_defaults()
+    return bound_args.arguments
+
+
+@pytest.mark.parametrize(
+    "function, args, kwargs",
+    [
+        (function_simple, (1, 2), {}),
+        (function_simple, (1,), {"b": 2, "d": 4}),
+        (function_simple, (), {"c": 1, "a": 2}),
+        (function_var_args, (1, 2, 3, 4), {"e": 5}),
+        (function_var_args, (1,), {}),
+    ],
+)
+def test_capture_plan_bind(function, args, kwargs):
+    assert CapturePlan(function).bind(args, kwargs) == bind_with_inspect(function, args, kwargs)
+
+
+def test_capture_plan_bind_errors():
+    plan = CapturePlan(function_simple)
+    with pytest.raises(TypeError):
+        plan.bind((1,), {"a": 1})
+    with pytest.raises(TypeError):
+        plan.bind((1,), {"unknown": 1})
+
+
+def test_capture_plan_serializers():
+    plan = CapturePlan(function_simple)
+    assert plan.input_serializers["a"].extension == "json"
+    assert plan.input_serializers["b"] is None  # resolved at each call, from the value type
+    assert plan.input_serializers["d"].extension == "png"
+    assert plan.output_serializer.extension == "npy"
+    assert plan.output_serializer.mode == "wb"
+    entries = plan.input_entries((1, np.zeros(3)), {}, "inputs", lambda name: None)
+    assert [(entry[0].extension, entry[3]) for entry in entries] == [
+        ("json", "a"),
+        ("npy", "b"),
+        ("json", "c"),
+        ("png", "d"),
+    ]
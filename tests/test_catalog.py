@@ -0,0 +1,82 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from functionsaver import find_captures, flush_background_writes, function_saver, replay_and_check_function
+from conftest import update_settings_with_env
+
+
+@function_saver
+def function_to_index(x: int, label: str, table: np.ndarray) -> float:
+    function_to_index.save_internal(x * 2, "doubled")
+    return x + float(table.sum())
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_catalog(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env(
+        {"FUNCTION_SAVER_CATALOG": "1", "FUNCTION_SAVER_STORAGE": storage, "FUNCTION_SAVER_INTERNALS_ALL": "1"}
+    )
+    table = np.ones(10)
+    for x in range(6):
+        function_to_index(x, f"label {x}", table)
+
+    captures = find_captures("function_to_index")
+    assert [capture.entry("x").value for capture in captures] == [5, 4, 3, 2, 1, 0]
+    capture = captures[0]
+    assert capture.function == "test_catalog.function_to_index"
+    assert capture.storage == storage
+    assert capture.call_duration >= 0 and capture.write_duration >= 0
+    assert capture.entry("label") == ("inputs", "label", "str", "label 5", len('"label 5"'), capture.entry("label").hash)
+    table_entry = capture.entry("table")
+    assert (table_entry.type, table_entry.value, table_entry.size) == ("numpy.ndarray", None, 128 + 80)
+    # the same table in all the captures: same hash
+    assert len({capture.entry("table").hash for capture in captures}) == 1
+    assert capture.entry("output", "output").value == 15.0
+    assert capture.size == sum(entry.size for entry in capture.entries)
+
+    # the capture id is what the replay takes
+    assert replay_and_check_function(function_to_index, capture.capture_id) == 15.0
+
+    # queries
+    assert [c.entry("x").value for c in find_captures("function_to_index", where={"x": (">", 3)})] == [5, 4]
+    assert [c.entry("x").value for c in find_captures(where={"label": "label 2"})] == [2]
+    assert len(find_captures("function_to_index", limit=2)) == 2
+    assert find_captures("test_catalog.function_to_index", since=datetime.datetime.now()) == []
+    assert find_captures("another_function") == []
+    with pytest.raises(ValueError, match="Invalid operator"):
+        find_captures(where={"x": ("like", 3)})
+
+
+def test_catalog_background_and_retention(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env(
+        {"FUNCTION_SAVER_CATALOG": "1", "FUNCTION_SAVER_BACKGROUND": "1", "FUNCTION_SAVER_MAX_CAPTURES": "3"}
+    )
+    for x in range(5):
+        function_to_index(x, "", np.zeros(2))
+        flush_background_writes()
+
+    # the evicted captures are removed from the catalog
+    assert [capture.entry("x").value for capture in find_captures(limit=None)] == [4, 3, 2]
+
+
+def test_no_catalog(reset_environment, fonctionsaver_in_tempfolder):
+    function_to_index(1, "", np.zeros(2))
+    with pytest.raises(FileNotFoundError, match="No catalog"):
+        find_captures()
+
+
+def test_find_captures_reuses_the_connection(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    import sqlite3
+
+    update_settings_with_env({"FUNCTION_SAVER_CATALOG": "1"})
+    function_to_index(1, "", np.zeros(2))
+    # the catalog is disabled, its captures are still found
+    update_settings_with_env({"FUNCTION_SAVER_CATALOG": "0"})
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connections.append(1) or connect(*args, **kwargs))
+    for _ in range(3):
+        assert len(find_captures(root_path=fonctionsaver_in_tempfolder)) == 1
+    assert len(connections) <= 1
@@ -0,0 +1,79 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from functionsaver import function_saver, replay_and_check_function
+from functionsaver.compression import CODECS, NO_COMPRESSION, parse_compression
+from conftest import update_settings_with_env
+from utils_for_tests import get_data_folders_from_function_saver_root
+
+
+@function_saver
+def function_to_compress(a: int, image: np.ndarray) -> np.ndarray:
+    function_to_compress.save_internal([a] * 10, "repeated")
+    return image * a
+
+
+@function_saver(compression={"image": "gzip:9", "output": "none"})
+def function_compressed_per_variable(a: int, image: np.ndarray) -> np.ndarray:
+    return image * a
+
+
+def compare_arrays(x, y) -> bool:
+    return np.array_equal(x, y)
+
+
+def get_file_names(temp_folder) -> list[str]:
+    data_folders = get_data_folders_from_function_saver_root(temp_folder)[0]
+    return sorted(path.name for path in data_folders.function_saver_path.glob("*/*"))
+
+
+def test_parse_compression():
+    assert parse_compression("none") is NO_COMPRESSION
+    assert parse_compression("zlib").level == 6
+    assert parse_compression("lzma:1") == (CODECS["lzma"], 1)
+    assert parse_compression("fast").codec is not None
+    for invalid_spec in ["unknown", "zlib:high"]:
+        with pytest.raises(ValueError, match="Invalid compression"):
+            parse_compression(invalid_spec)
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+def test_compression_all(reset_environment, fonctionsaver_in_tempfolder, codec):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_COMPRESSION_ALL": codec})
+    image = np.zeros((100, 100), dtype=np.float32)
+    function_to_compress(2, image)
+    assert get_file_names(temp_folder) == [
+        f"a.json.{codec}",
+        f"image.npy.{codec}",
+        f"output.npy.{codec}",
+        f"repeated.json.{codec}",
+    ]
+    data_folders = get_data_folders_from_function_saver_root(temp_folder)[0]
+    assert (data_folders.input_path / f"image.npy.{codec}").stat().st_size < image.nbytes / 10
+    replay_and_check_function(function_to_compress, data_folders.function_saver_path, compare_arrays)
+
+
+@pytest.mark.parametrize("storage", ["zip", "segment"])
+def test_compression_storages(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env({"FUNCTION_SAVER_COMPRESSION_ALL": "fast", "FUNCTION_SAVER_STORAGE": storage})
+    function_to_compress(3, np.ones(1000))
+    capture = next(Path(fonctionsaver_in_tempfolder).iterdir())
+    if storage == "segment":
+        capture = f"{next(capture.glob('*.seg'))}#0"
+    # compressed entries are read, not mapped
+    replay_and_check_function(function_to_compress, capture, compare_arrays)
+
+
+def test_compression_per_variable(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_COMPRESSION_FUNCTION_COMPRESSED_PER_VARIABLE": "bz2"})
+    function_compressed_per_variable(2, np.ones(10))
+    assert get_file_names(temp_folder) == ["a.json.bz2", "image.npy.gzip", "output.npy"]
+    data_folders = get_data_folders_from_function_saver_root(temp_folder)[0]
+    # gzip files can be read by any tool
+    assert gzip.decompress((data_folders.input_path / "image.npy.gzip").read_bytes()).startswith(b"\x93NUMPY")
+    replay_and_check_function(function_compressed_per_variable, data_folders.function_saver_path, compare_arrays)
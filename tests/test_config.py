@@ -0,0 +1,40 @@
+import os
+
+from functionsaver import function_saver, reload_config
+from conftest import update_settings_with_env
+from utils_for_tests import count_function_saver_folders
+
+
+def function_to_compile_out(a: int, b: int) -> int:
+    assert function_to_compile_out.is_save_internal_enabled() is False
+    function_to_compile_out.save_internal(a - b, "subtracted")
+    return a + b
+
+
+def test_config_is_a_snapshot(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+
+    @function_saver
+    def function_to_save(a: int, b: int) -> int:
+        return a + b
+
+    os.environ["FUNCTION_SAVER_ALL"] = "0"
+    function_to_save(1, 2)
+    assert count_function_saver_folders(temp_folder) == 1  # the environment change is not seen yet
+
+    reload_config()
+    function_to_save(1, 2)
+    assert count_function_saver_folders(temp_folder) == 1
+
+    update_settings_with_env({"FUNCTION_SAVER_FUNCTION_TO_SAVE": "1"})
+    function_to_save(1, 2)
+    assert count_function_saver_folders(temp_folder) == 2
+
+
+def test_compile_out(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_COMPILE_OUT": "1"})
+    decorated = function_saver(function_to_compile_out)
+    assert decorated is function_to_compile_out
+    assert decorated(1, 2) == 3
+    assert count_function_saver_folders(temp_folder) == 0
@@ -0,0 +1,111 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from functionsaver import function_saver, list_segment_captures, replay_and_check_function, replay_function
+from functionsaver.manifest import CaptureIntegrityError, type_name
+from functionsaver.storage import DirectoryCaptureReader, open_capture
+from conftest import update_settings_with_env
+
+
+@dataclass
+class Acquisition:
+    image: np.ndarray
+    exposure: float
+
+
+@function_saver(compression={"acquisition": "zlib"})
+def process(acquisition: Acquisition, gain, labels: list[str]) -> float:
+    return float(acquisition.image.sum()) * gain
+
+
+def _capture(temp_folder: str, storage: str):
+    if storage == "segment":
+        return list_segment_captures("process", temp_folder)[0]
+    return next(Path(temp_folder).iterdir())
+
+
+def test_type_name():
+    assert type_name(int) == "int"
+    assert type_name(np.ndarray) == "numpy.ndarray"
+    assert type_name(list[str]) == "list[str]"
+    assert type_name(None) is None
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_manifest(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    image = np.arange(10_000, dtype=np.uint16).reshape(100, 100)
+    process(Acquisition(image, 0.5), 2, ["a", "b"])
+
+    capture = open_capture(_capture(fonctionsaver_in_tempfolder, storage))
+    manifest = capture.manifest
+    assert sorted(manifest) == [
+        ("inputs", "acquisition#0.npy.zlib"),
+        ("inputs", "acquisition.json.zlib"),
+        ("inputs", "gain.json"),
+        ("inputs", "labels.json"),
+        ("output", "output.json"),
+    ]
+    acquisition = manifest[("inputs", "acquisition.json.zlib")]
+    assert acquisition["name"] == "acquisition"
+    assert (acquisition["extension"], acquisition["codec"]) == ("json", "zlib")
+    assert acquisition["type"] == acquisition["declared_type"] == f"{__name__}.Acquisition"
+    sidecar = manifest[("inputs", "acquisition#0.npy.zlib")]
+    assert (sidecar["name"], sidecar["extension"], sidecar["type"]) == ("acquisition#0", "npy", "numpy.ndarray")
+    gain = manifest[("inputs", "gain.json")]
+    assert (gain["type"], gain["declared_type"]) == ("int", None)
+    assert manifest[("inputs", "labels.json")]["declared_type"] == "list[str]"
+    assert manifest[("output", "output.json")]["declared_type"] == "float"
+    # the size and hash of the data stored
+    for (section, file_name), entry in manifest.items():
+        data = capture.read(section, file_name, "rb")
+        assert entry["size"] == len(data)
+        assert entry["hash"] == hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def test_replay_without_listing(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    process(Acquisition(np.ones((40, 40)), 0.5), 2, [])
+    capture = _capture(fonctionsaver_in_tempfolder, "directory")
+
+    def find(*_):
+        raise AssertionError("the sections are listed")
+
+    monkeypatch.setattr(DirectoryCaptureReader, "find", find)
+    assert replay_and_check_function(process, capture) == 3200.0
+
+
+def test_replay_without_manifest(reset_environment, fonctionsaver_in_tempfolder):
+    process(Acquisition(np.ones((40, 40)), 0.5), 2, [])
+    capture = _capture(fonctionsaver_in_tempfolder, "directory")
+    # a capture saved before the manifests
+    (capture / "manifest.json").unlink()
+    assert open_capture(capture).manifest is None
+    assert replay_and_check_function(process, capture) == 3200.0
+
+
+def test_verify(reset_environment, fonctionsaver_in_tempfolder):
+    process(Acquisition(np.ones((40, 40)), 0.5), 2, [])
+    capture = _capture(fonctionsaver_in_tempfolder, "directory")
+    (capture / "inputs" / "gain.json").write_text("3")
+
+    # not verified by default
+    assert replay_function(process, capture) == 4800.0
+    update_settings_with_env({"FUNCTION_SAVER_VERIFY_CAPTURES": "1"})
+    with pytest.raises(CaptureIntegrityError, match="gain.json"):
+        replay_function(process, capture)
+
+
+def test_verify_after_prettify(reset_environment, fonctionsaver_in_tempfolder):
+    from functionsaver import prettify_json
+
+    process(Acquisition(np.ones((40, 40)), 0.5), 2, ["a", "b"])
+    capture = _capture(fonctionsaver_in_tempfolder, "directory")
+    assert prettify_json(capture) > 0
+    assert "\n" in (capture / "inputs" / "labels.json").read_text()
+
+    update_settings_with_env({"FUNCTION_SAVER_VERIFY_CAPTURES": "1"})
+    assert replay_and_check_function(process, capture) == 3200.0
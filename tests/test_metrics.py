@@ -0,0 +1,92 @@
+import threading
+import urllib.request
+
+import numpy as np
+
+from functionsaver import (
+    SerializeAsArrayPng,
+    function_saver,
+    metrics,
+    start_metrics_server,
+    to_prometheus,
+    write_prometheus,
+)
+from conftest import update_settings_with_env
+
+
+@function_saver
+def function_to_measure(x: int, image: SerializeAsArrayPng) -> int:
+    return x + 1
+
+
+def test_metrics(reset_environment, fonctionsaver_in_tempfolder):
+    function_to_measure.metrics.reset()
+    update_settings_with_env({"FUNCTION_SAVER_SAMPLING_ALL": "every:2"})
+    for x in range(4):
+        function_to_measure(x, np.zeros((2, 2), dtype=np.uint8))
+    # not an image: the png serializer fails
+    function_to_measure(4, "not an image")
+
+    values = metrics()["test_metrics.function_to_measure"]
+    assert values["calls"] == 5
+    assert (values["captures"], values["skipped"], values["failed"]) == (3, 2, 1)
+    assert values["written_bytes"] > 0
+    assert values["latency"]["count"] == 5
+    assert values["overhead"]["count"] == 3
+
+
+def test_refused_by_the_retention(reset_environment, fonctionsaver_in_tempfolder):
+    function_to_measure.metrics.reset()
+    update_settings_with_env({"FUNCTION_SAVER_MAX_CAPTURES": "1", "FUNCTION_SAVER_RETENTION": "refuse"})
+    for x in range(3):
+        function_to_measure(x, np.zeros((2, 2), dtype=np.uint8))
+    assert (function_to_measure.metrics.captures.value, function_to_measure.metrics.refused.value) == (1, 2)
+
+
+def test_prometheus_export(reset_environment, fonctionsaver_in_tempfolder, tmp_path):
+    function_to_measure.metrics.reset()
+    function_to_measure(1, np.zeros((2, 2), dtype=np.uint8))
+
+    text = to_prometheus()
+    label = '{function="test_metrics.function_to_measure"}'
+    assert f"function_saver_calls_total{label} 1\n" in text
+    assert f"function_saver_captures_total{label} 1\n" in text
+    assert "# TYPE function_saver_call_duration_seconds histogram" in text
+    assert 'function_saver_call_duration_seconds_bucket{function="test_metrics.function_to_measure",le="+Inf"} 1' in text
+    assert f"function_saver_capture_overhead_seconds_count{label} 1\n" in text
+
+    write_prometheus(tmp_path / "function_saver.prom")
+    assert (tmp_path / "function_saver.prom").read_text() == text
+
+    server = start_metrics_server()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert f"function_saver_calls_total{label} 1\n" in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_shards_folded_when_threads_end():
+    from functionsaver.metrics import Counter
+    from functionsaver.timing import LatencyHistogram
+
+    counter = Counter()
+    histogram = LatencyHistogram("test")
+
+    def update():
+        counter.inc(2)
+        histogram.record(1000)
+
+    for _ in range(20):
+        thread = threading.Thread(target=update)
+        thread.start()
+        thread.join()
+    counter.inc()
+    # the shards of the ended threads are folded, the counts are kept
+    assert len(counter._shards._shards) == 1
+    assert len(histogram._shards._shards) == 0
+    assert counter.value == 41
+    assert histogram.count == 20
+    counter.reset()
+    assert counter.value == 0
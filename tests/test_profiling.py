@@ -0,0 +1,103 @@
+import asyncio
+import pstats
+
+import numpy as np
+import pytest
+
+from functionsaver import flush_background_writes, function_saver, replay_and_check_function
+from functionsaver.profiling import ProfileMode, parse_profile_mode
+from conftest import update_settings_with_env
+from utils_for_tests import get_data_folders_from_function_saver_root
+
+
+def slow_part(size: int) -> np.ndarray:
+    return np.ones(size).cumsum()
+
+
+@function_saver
+def function_to_profile(size: int) -> float:
+    return float(slow_part(size)[-1])
+
+
+async def slow_async_part(size: int) -> float:
+    await asyncio.sleep(0)
+    return float(slow_part(size)[-1])
+
+
+@function_saver
+async def async_function_to_profile(size: int) -> float:
+    return await slow_async_part(size)
+
+
+def test_parse_profile_mode():
+    assert parse_profile_mode("0") is None
+    assert parse_profile_mode("1") == ProfileMode.CPU
+    assert parse_profile_mode("memory") == ProfileMode.MEMORY
+    with pytest.raises(ValueError, match="Invalid profile mode"):
+        parse_profile_mode("gpu")
+
+
+@pytest.mark.parametrize("background", ["0", "1"])
+def test_profile(reset_environment, fonctionsaver_in_tempfolder, background):
+    update_settings_with_env(
+        {"FUNCTION_SAVER_PROFILE_FUNCTION_TO_PROFILE": "1", "FUNCTION_SAVER_BACKGROUND": background}
+    )
+    assert function_to_profile(1000) == 1000.0
+    flush_background_writes()
+
+    capture = get_data_folders_from_function_saver_root(fonctionsaver_in_tempfolder)[0].function_saver_path
+    stats = pstats.Stats(str(capture / "profile" / "profile.pstats"))
+    assert any(function == "slow_part" for _, _, function in stats.stats)
+    assert "slow_part" in (capture / "profile" / "profile.txt").read_text()
+    assert not (capture / "profile" / "memory.txt").exists()
+    # the profile doesn't prevent the replay
+    assert replay_and_check_function(function_to_profile, capture) == 1000.0
+
+
+def test_profile_memory(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_PROFILE_ALL": "memory", "FUNCTION_SAVER_PROFILE_TOP": "5"})
+    function_to_profile(100_000)
+
+    capture = get_data_folders_from_function_saver_root(fonctionsaver_in_tempfolder)[0].function_saver_path
+    memory = (capture / "profile" / "memory.txt").read_text()
+    peak = int(memory.splitlines()[0].split(": ")[1].split()[0])
+    # 2 arrays of 100 000 float64
+    assert peak >= 1_600_000
+    assert "Top 5 allocation sites" in memory
+    assert (capture / "profile" / "profile.pstats").exists()
+
+
+def test_profile_async(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_PROFILE_ALL": "1"})
+    assert asyncio.run(async_function_to_profile(1000)) == 1000.0
+
+    capture = get_data_folders_from_function_saver_root(fonctionsaver_in_tempfolder)[0].function_saver_path
+    stats = pstats.Stats(str(capture / "profile" / "profile.pstats"))
+    assert any(function == "slow_part" for _, _, function in stats.stats)
+
+
+def test_profile_sampling(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_PROFILE_ALL": "1", "FUNCTION_SAVER_PROFILE_SAMPLING_ALL": "every:2"})
+    for _ in range(4):
+        function_to_profile(10)
+
+    data_folders = get_data_folders_from_function_saver_root(fonctionsaver_in_tempfolder)
+    assert len(data_folders) == 4
+    assert sum((data_folder.function_saver_path / "profile").is_dir() for data_folder in data_folders) == 2
+
+
+def test_not_profiled_by_default(reset_environment, fonctionsaver_in_tempfolder):
+    function_to_profile(10)
+    capture = get_data_folders_from_function_saver_root(fonctionsaver_in_tempfolder)[0].function_saver_path
+    assert not (capture / "profile").exists()
+
+
+def test_profile_top_setting(reset_environment):
+    from functionsaver.config import FunctionSettings
+
+    update_settings_with_env({"FUNCTION_SAVER_PROFILE_ALL": "1", "FUNCTION_SAVER_PROFILE_TOP": "5"})
+    settings = FunctionSettings("function_to_profile")
+    assert settings.profile_top == 5
+    # parsed when the settings are reloaded, not at each call
+    update_settings_with_env({"FUNCTION_SAVER_PROFILE_ALL": "1", "FUNCTION_SAVER_PROFILE_TOP": "many"})
+    assert settings.profile_top == 30
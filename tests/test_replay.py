@@ -2,7 +2,7 @@ from pathlib import Path
 
 import numpy as np
 
-from functionsaver import function_saver, SerializeAsArrayPng
+from functionsaver import function_saver, SerializeAsArrayPng, SerializeAsArrayShuffleDelta
 from functionsaver.function_saver import (
     replay_function,
     replay_and_check_function,
@@ -156,6 +156,37 @@ def test_replay_and_check_np_array_as_png(
     assert count_function_saver_folders(temp_folder) == 1
 
 
+def test_replay_and_check_np_array_shuffled(reset_environment, fonctionsaver_in_tempfolder):
+    @function_saver
+    def function_to_replay_shuffled(
+        signal: np.ndarray | SerializeAsArrayShuffleDelta,
+    ) -> np.ndarray | SerializeAsArrayShuffleDelta:
+        return np.cumsum(signal)
+
+    temp_folder = fonctionsaver_in_tempfolder
+    res = function_to_replay_shuffled(np.sin(np.linspace(0, 10, 10_000)))
+
+    assert count_function_saver_folders(temp_folder) == 1
+    dir_path = next(path for path in Path(temp_folder).iterdir() if path.is_dir())
+    assert (dir_path / "inputs" / "signal.shuffle").is_file()
+    output = replay_and_check_function(function_to_replay_shuffled, dir_path, np.array_equal)
+    assert np.array_equal(output, res)
+    assert count_function_saver_folders(temp_folder) == 1
+
+
+def test_np_array_shuffled_with_compression(reset_environment, fonctionsaver_in_tempfolder):
+    @function_saver(compression={"signal": "lzma"})
+    def function_to_replay_shuffled_lzma(signal: np.ndarray | SerializeAsArrayShuffleDelta) -> float:
+        return float(signal.sum())
+
+    res = function_to_replay_shuffled_lzma(np.sin(np.linspace(0, 10, 10_000)))
+    dir_path = next(path for path in Path(fonctionsaver_in_tempfolder).iterdir() if path.is_dir())
+    # compressed by the shuffle, by block: not compressed again
+    assert [path.name for path in (dir_path / "inputs").iterdir()] == ["signal.shuffle"]
+    assert b'"codec": "lzma"' in (dir_path / "inputs" / "signal.shuffle").read_bytes()[:1000]
+    assert replay_and_check_function(function_to_replay_shuffled_lzma, dir_path) == res
+
+
 def test_replay_check_double(reset_environment, fonctionsaver_in_tempfolder):
     """
     This test tests the save of in out of a function with doubles, and replay and check the replay.
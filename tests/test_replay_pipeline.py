@@ -0,0 +1,96 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from functionsaver import function_saver, replay_captures
+from functionsaver.batch_replay import discover_captures
+from functionsaver import replay_pipeline
+from conftest import update_settings_with_env
+
+
+@function_saver
+def normalize(image: np.ndarray, labels: list[str]) -> np.ndarray:
+    return image / image.max()
+
+
+@function_saver
+async def normalize_async(image: np.ndarray) -> np.ndarray:
+    return image / image.max()
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_replay_captures(reset_environment, fonctionsaver_in_tempfolder, storage, prefetch):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    images = [np.arange(1.0, 101.0).reshape(10, 10) * (i + 1) for i in range(5)]
+    for i, image in enumerate(images):
+        normalize(image, [f"image {i}"])
+    update_settings_with_env({"FUNCTION_SAVER_ALL": "0"})
+    captures = discover_captures("normalize", fonctionsaver_in_tempfolder)
+
+    replayed = list(replay_captures(normalize, captures, prefetch=prefetch, expected_output=True))
+    assert [replay.capture_id for replay in replayed] == captures
+    for replay in replayed:
+        np.testing.assert_array_equal(replay.output, images[0] / 100)
+        np.testing.assert_array_equal(replay.output, replay.expected_output)
+        assert replay.load_duration >= 0 and replay.wait_duration >= 0 and replay.run_duration >= 0
+
+
+def test_replay_captures_default_root(reset_environment, fonctionsaver_in_tempfolder):
+    normalize(np.ones(3), ["a"])
+    replayed = list(replay_captures(normalize))
+    assert len(replayed) == 1
+    assert replayed[0].expected_output is None
+
+
+def test_prefetch_is_bounded(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    for i in range(6):
+        normalize(np.ones(3) * (i + 1), [])
+    update_settings_with_env({"FUNCTION_SAVER_ALL": "0"})
+    loading = []
+    lock = threading.Lock()
+    load = replay_pipeline._load
+
+    def counting_load(*args):
+        with lock:
+            loading.append(args[1])
+        return load(*args)
+
+    monkeypatch.setattr(replay_pipeline, "_load", counting_load)
+    replays = replay_captures(normalize, prefetch=2)
+    next(replays)
+    time.sleep(0.1)
+    # the current capture and 2 prefetched ones
+    assert len(loading) == 3
+    next(replays)
+    time.sleep(0.1)
+    # the replay being consumed, the current capture and 2 prefetched ones
+    assert len(loading) == 4
+    replays.close()
+    assert len(loading) == 4
+
+
+@pytest.mark.skipif(not hasattr(replay_pipeline.os, "posix_fadvise"), reason="no posix_fadvise")
+def test_read_ahead(reset_environment, fonctionsaver_in_tempfolder, monkeypatch):
+    image = np.arange(1.0, 101.0)
+    normalize(image, [])
+    update_settings_with_env({"FUNCTION_SAVER_ALL": "0"})
+    advised = []
+    monkeypatch.setattr(replay_pipeline.os, "posix_fadvise", lambda fd, offset, length, _: advised.append(length))
+    list(replay_captures(normalize, expected_output=True))
+    # the input and the expected output
+    assert advised == [image.nbytes, image.nbytes]
+
+def test_load_error(reset_environment, fonctionsaver_in_tempfolder):
+    normalize(np.ones(3), [])
+    with pytest.raises(FileNotFoundError):
+        list(replay_captures(normalize, [fonctionsaver_in_tempfolder + "/missing"]))
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError, match="Invalid prefetch"):
+        replay_captures(normalize, [], prefetch=-1)
+    with pytest.raises(TypeError, match="coroutine function"):
+        replay_captures(normalize_async, [])
@@ -0,0 +1,122 @@
+import importlib
+import json
+import time
+
+import numpy as np
+import pytest
+
+from functionsaver import flush_async_captures, flush_background_writes, function_saver
+from functionsaver.retention import RetentionManager
+from functionsaver.config import parse_size
+from conftest import update_settings_with_env
+from utils_for_tests import count_function_saver_folders, get_data_folders_from_function_saver_root
+
+
+@function_saver
+def function_to_retain(a: int, b: int) -> int:
+    return a + b
+
+
+@function_saver
+def function_with_array(image: np.ndarray) -> np.ndarray:
+    return image
+
+
+@function_saver
+async def function_to_retain_async(a: int) -> int:
+    return a
+
+
+def test_parse_size():
+    assert parse_size("123") == 123
+    assert parse_size("2K") == 2048
+    assert parse_size("1.5MB") == 1536 * 1024
+    assert parse_size("10g") == 10 * 1024**3
+
+
+def test_max_captures_evicts_oldest(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_MAX_CAPTURES": "3"})
+    for i in range(6):
+        function_to_retain(i, 0)
+    assert count_function_saver_folders(temp_folder) == 3
+    saved_a = sorted(
+        json.loads((data_folders.input_path / "a.json").read_text())
+        for data_folders in get_data_folders_from_function_saver_root(temp_folder)
+    )
+    assert saved_a == [3, 4, 5]
+
+
+@pytest.mark.parametrize("variable", ["FUNCTION_SAVER_MAX_BYTES", "FUNCTION_SAVER_MAX_CAPTURES"])
+def test_invalid_retention_is_unbounded(reset_environment, fonctionsaver_in_tempfolder, variable):
+    update_settings_with_env({variable: "a lot"})
+    for i in range(3):
+        assert function_to_retain(i, 0) == i
+    assert count_function_saver_folders(fonctionsaver_in_tempfolder) == 3
+
+
+def test_max_captures_refuse(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_MAX_CAPTURES": "2", "FUNCTION_SAVER_RETENTION": "refuse"})
+    for i in range(4):
+        assert function_to_retain(i, 0) == i
+    assert count_function_saver_folders(temp_folder) == 2
+
+
+def test_max_bytes(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    image = np.zeros((100, 100), dtype=np.uint8)  # 2 files of 10 KB per capture
+    update_settings_with_env({"FUNCTION_SAVER_MAX_BYTES": "50K"})
+    for _ in range(5):
+        function_with_array(image)
+    assert count_function_saver_folders(temp_folder) == 2
+
+    # the existing captures are found at startup, and the budget is exhausted: new captures are refused
+    update_settings_with_env({"FUNCTION_SAVER_MAX_BYTES": "30K", "FUNCTION_SAVER_RETENTION": "refuse"})
+    function_with_array(image)
+    assert count_function_saver_folders(temp_folder) == 2
+
+
+def test_pending_capture_deleted_when_written(tmp_path):
+    retention = RetentionManager(tmp_path, max_captures=1)
+    first, second = tmp_path / "first", tmp_path / "second"
+    assert retention.begin_capture("function", first)
+    assert retention.begin_capture("function", second)
+    # evicted before being written: deleted once written
+    first.mkdir()
+    retention.end_capture(first, 10)
+    assert not first.exists()
+    assert retention.capture_count("function") == 1
+    assert retention.total_bytes == 0
+    # a capture dropped by the writer pool is no longer tracked
+    retention.cancel_capture(second)
+    assert retention.capture_count("function") == 0
+
+
+@pytest.fixture
+def slow_writes(monkeypatch):
+    """The captures are written after the next calls: they are evicted while pending"""
+    function_saver_module = importlib.import_module("functionsaver.function_saver")
+    write_capture = function_saver_module._write_capture
+
+    def slow_write_capture(*args, **kwargs):
+        time.sleep(0.01)
+        return write_capture(*args, **kwargs)
+
+    monkeypatch.setattr(function_saver_module, "_write_capture", slow_write_capture)
+
+
+def test_max_captures_background(reset_environment, fonctionsaver_in_tempfolder, slow_writes):
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": "1", "FUNCTION_SAVER_MAX_CAPTURES": "2"})
+    for i in range(20):
+        function_to_retain(i, 0)
+    flush_background_writes()
+    assert count_function_saver_folders(fonctionsaver_in_tempfolder) == 2
+
+
+async def test_max_captures_async_not_awaited(reset_environment, fonctionsaver_in_tempfolder, slow_writes):
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": "1", "FUNCTION_SAVER_MAX_CAPTURES": "2"})
+    for i in range(20):
+        await function_to_retain_async(i)
+    await flush_async_captures()
+    assert count_function_saver_folders(fonctionsaver_in_tempfolder) == 2
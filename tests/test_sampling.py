@@ -0,0 +1,51 @@
+import pytest
+
+from functionsaver import function_saver
+from functionsaver.sampling import parse_sampling_policy, EveryNth, FirstN, SamplingPolicy, TokenBucket, Probability
+from conftest import update_settings_with_env
+from utils_for_tests import count_function_saver_folders
+
+
+@function_saver
+def function_to_sample(a: int, b: int) -> int:
+    return a + b
+
+
+def test_parse_sampling_policy():
+    assert isinstance(parse_sampling_policy("every:10"), EveryNth)
+    assert isinstance(parse_sampling_policy("probability:0.5"), Probability)
+    assert isinstance(parse_sampling_policy("rate:5"), TokenBucket)
+    assert parse_sampling_policy("rate:5:20").capacity == 20
+    assert isinstance(parse_sampling_policy("first:3"), FirstN)
+    for invalid_spec in ["every:0", "probability:2", "rate:-1", "unknown:1", "every", "every:a"]:
+        with pytest.raises(ValueError, match="Invalid sampling policy"):
+            parse_sampling_policy(invalid_spec)
+
+
+def test_sampling_policies():
+    every_3 = EveryNth(3)
+    assert [every_3.should_capture() for _ in range(7)] == [True, False, False, True, False, False, True]
+    first_2 = FirstN(2)
+    assert [first_2.should_capture() for _ in range(4)] == [True, True, False, False]
+    bucket = TokenBucket(rate=0.001, burst=2)
+    assert [bucket.should_capture() for _ in range(4)] == [True, True, False, False]
+    assert Probability(0).should_capture() is False
+    assert Probability(1).should_capture() is True
+    with pytest.raises(TypeError):
+        SamplingPolicy()
+
+
+def test_sampling_every_nth_call(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_SAMPLING_FUNCTION_TO_SAMPLE": "every:4"})
+    for i in range(10):
+        assert function_to_sample(i, 1) == i + 1
+    assert count_function_saver_folders(temp_folder) == 3
+
+
+def test_sampling_all(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_SAMPLING_ALL": "first:2"})
+    for i in range(5):
+        function_to_sample(i, 1)
+    assert count_function_saver_folders(temp_folder) == 2
@@ -1,6 +1,15 @@
+import io
+import json
+import os
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import jsons
+import numpy as np
 import pytest
 
-from functionsaver import register_serializer
+from functionsaver import SerializeAsArrayPng, function_saver, register_serializer, replay_function
 
 
 def test_register_serializer_type():
@@ -57,3 +66,248 @@ def test_register_serializer_type():
     register_serializer(SerializeAsTest, good_serializer, good_deserializer, "txt")
     with pytest.raises(ValueError, match="Serializer for type .*SerializeAsTest.* already registered"):
         register_serializer(SerializeAsTest, good_serializer, good_deserializer, "txt")
+
+
+def test_serializer_cache_and_skip_failing_types():
+    from functionsaver.exception import SerializationSkipped
+    from functionsaver.serializers import (
+        _get_serializer_entry,
+        _serialize,
+        _function_saver_serializers,
+        _function_saver_deserializers,
+        clear_serializer_cache,
+    )
+
+    class SerializeAsCached:
+        pass
+
+    class ObjectFailingToSerialize:
+        pass
+
+    calls = []
+
+    def failing_serializer(x) -> str:
+        calls.append(x)
+        raise ValueError("cannot serialize")
+
+    def cached_deserializer(x: str):
+        pass
+
+    entry = _get_serializer_entry(ObjectFailingToSerialize | SerializeAsCached, ObjectFailingToSerialize)
+    assert entry.extension == "json"
+    assert _get_serializer_entry(ObjectFailingToSerialize | SerializeAsCached, ObjectFailingToSerialize) is entry
+
+    # registering invalidates the cache
+    register_serializer(SerializeAsCached, failing_serializer, cached_deserializer, "cached")
+    try:
+        entry = _get_serializer_entry(ObjectFailingToSerialize | SerializeAsCached, ObjectFailingToSerialize)
+        assert entry.extension == "cached"
+        with pytest.raises(ValueError, match="cannot serialize"):
+            _serialize(entry, ObjectFailingToSerialize())
+        # then, the type is skipped without calling the serializer again
+        with pytest.raises(SerializationSkipped, match="skipped"):
+            _serialize(entry, ObjectFailingToSerialize())
+        assert len(calls) == 1
+    finally:
+        del _function_saver_serializers[SerializeAsCached]
+        del _function_saver_deserializers["cached"]
+        clear_serializer_cache()
+
+
+@function_saver
+def function_with_config(cfg: dict) -> int:
+    return len(cfg)
+
+
+@function_saver
+def other_function_with_config(cfg: dict) -> int:
+    return len(cfg)
+
+
+def test_fallback_failure_is_not_cached(reset_environment, fonctionsaver_in_tempfolder):
+    # jsons fails on this value, not on every dict
+    function_with_config({"gen": (i for i in range(3))})
+    assert function_with_config.metrics.failed.value >= 1
+    other_function_with_config({"a": 1})
+    capture = next(Path(fonctionsaver_in_tempfolder).glob("other_function_with_config_*"))
+    assert replay_function(other_function_with_config, capture) == 1
+
+
+@function_saver
+def function_with_image(image: np.ndarray | SerializeAsArrayPng) -> int:
+    return image.ndim
+
+
+def test_failure_is_cached_by_array_signature(reset_environment, fonctionsaver_in_tempfolder):
+    from functionsaver.serializers import clear_serializer_cache
+
+    clear_serializer_cache()
+    try:
+        # not an image: the png serializer fails, then skips the float64 arrays with 3 dimensions
+        function_with_image(np.zeros((4, 4, 2)))
+        function_with_image(np.zeros((8, 8, 2)))
+        assert function_with_image.metrics.failed.value == 2
+        # the images are still saved
+        function_with_image(np.zeros((4, 4, 3), dtype=np.uint8))
+        assert function_with_image.metrics.failed.value == 2
+        assert len(list(Path(fonctionsaver_in_tempfolder).glob("*/inputs/image.png"))) == 1
+    finally:
+        clear_serializer_cache()
+
+class SerializeAsUpper:
+    pass
+
+
+@function_saver
+def function_with_label(label: str | SerializeAsUpper) -> int:
+    return len(label)
+
+
+def test_register_serializer_after_capture(reset_environment, fonctionsaver_in_tempfolder):
+    from functionsaver.serializers import (
+        _function_saver_serializers,
+        _function_saver_deserializers,
+        clear_serializer_cache,
+    )
+
+    def upper_serializer(x) -> str:
+        return x.upper()
+
+    def upper_deserializer(x: str):
+        return x.lower()
+
+    function_with_label("a")
+    # the serializers resolved by the capture plan of the function are outdated
+    register_serializer(SerializeAsUpper, upper_serializer, upper_deserializer, "upper")
+    try:
+        function_with_label("b")
+        files = sorted(file.name for file in Path(fonctionsaver_in_tempfolder).glob("*/inputs/label.*"))
+        assert files == ["label.json", "label.upper"]
+    finally:
+        del _function_saver_serializers[SerializeAsUpper]
+        del _function_saver_deserializers["upper"]
+        clear_serializer_cache()
+
+
+def test_np_array_binary_chunks(monkeypatch):
+    from functionsaver import serializers
+
+    array = np.arange(1000, dtype=np.float64).reshape(100, 10)
+    # contiguous: the data chunk is a view of the array, not a copy
+    chunks = list(serializers.np_array_binary_chunks(array))
+    assert len(chunks) == 2
+    assert np.shares_memory(np.frombuffer(chunks[1], dtype=np.uint8), array)
+
+    # non-contiguous: copied by blocks
+    monkeypatch.setattr(serializers, "_NPY_BLOCK_BYTES", 100)
+    for non_contiguous in [array[::2, ::3], np.asfortranarray(array)[::3]]:
+        chunks = list(serializers.np_array_binary_chunks(non_contiguous))
+        assert len(chunks) > 2
+        expected = io.BytesIO()
+        np.save(expected, non_contiguous)
+        assert b"".join(chunks) == expected.getvalue()
+
+
+@pytest.mark.parametrize(
+    "array",
+    [
+        np.sin(np.linspace(0, 20, 100_000)).reshape(1000, 100),
+        np.arange(100_000, dtype=">i4"),
+        np.asfortranarray(np.arange(60, dtype=np.uint16).reshape(6, 10)),
+        np.array([(1, 2.5), (3, 4.5)], dtype=[("a", "i4"), ("b", "f8")]),
+        np.arange(10, dtype=np.complex128),
+        np.zeros((0, 3)),
+        np.array(2.5),
+    ],
+)
+def test_np_array_shuffle(monkeypatch, array):
+    from functionsaver import shuffle
+
+    # several blocks, compressed in parallel
+    monkeypatch.setattr(shuffle, "_BLOCK_BYTES", 10_000)
+    for dump in (shuffle.np_array_shuffle_dump, shuffle.np_array_shuffle_delta_dump):
+        loaded = shuffle.np_array_shuffle_load(dump(array))
+        assert loaded.dtype == array.dtype
+        assert loaded.shape == array.shape
+        assert loaded.tobytes() == np.ascontiguousarray(array).tobytes()
+
+    with pytest.raises(AssertionError):
+        shuffle.np_array_shuffle_dump(np.array([{}, []], dtype=object))
+
+
+def test_np_array_shuffle_ratio():
+    from functionsaver.compression import parse_compression
+    from functionsaver.shuffle import np_array_shuffle_delta_dump, np_array_shuffle_dump
+
+    # the filters against the same codec
+    zlib_6 = parse_compression("zlib")
+    ramp = np.arange(1_000_000, dtype=np.int64)
+    smooth = np.sin(np.linspace(0, 20, 1_000_000)).astype(np.float32)
+    assert len(np_array_shuffle_dump(ramp, zlib_6)) < len(zlib.compress(ramp.tobytes())) / 5
+    assert len(np_array_shuffle_delta_dump(ramp, zlib_6)) < len(np_array_shuffle_dump(ramp, zlib_6)) / 2
+    assert len(np_array_shuffle_dump(smooth, zlib_6)) < len(zlib.compress(smooth.tobytes()))
+
+
+def test_np_array_shuffle_codec():
+    from functionsaver import shuffle
+    from functionsaver.compression import fast_compression, parse_compression
+
+    def split(dumped: bytes) -> tuple[dict, bytes]:
+        header_end = shuffle._HEADER.size + shuffle._HEADER.unpack_from(dumped)[1]
+        return json.loads(dumped[shuffle._HEADER.size:header_end]), dumped[header_end:]
+
+    array = np.arange(10_000, dtype=np.float64)
+    for compression in [None, parse_compression("lzma"), parse_compression("zlib:9")]:
+        dumped = shuffle.np_array_shuffle_dump(array, compression)
+        assert split(dumped)[0]["codec"] == (compression or fast_compression()).codec.name
+        np.testing.assert_array_equal(shuffle.np_array_shuffle_load(dumped), array)
+
+    # written before the codec was in the header: zlib
+    header, blocks = split(shuffle.np_array_shuffle_dump(array, parse_compression("zlib")))
+    del header["codec"]
+    header = json.dumps(header).encode()
+    old = shuffle._HEADER.pack(shuffle._MAGIC, len(header)) + header + blocks
+    np.testing.assert_array_equal(shuffle.np_array_shuffle_load(old), array)
+
+
+@dataclass
+class Point:
+    x: float
+    tags: list
+
+
+def test_default_serializer_compact():
+    from functionsaver.serializers import _default_serializer, _get_deserializer
+
+    deserialize, _ = _get_deserializer("json")
+    # json native: dumped by the json module, as jsons would
+    for native in [{"a": [1, 2.5, None, True, "b"], "c": {}}, [(1, 2)], "text", 3]:
+        serialized = _default_serializer(native)
+        assert "\n" not in serialized and ", " not in serialized
+        assert json.loads(serialized) == json.loads(jsons.dumps(native))
+    # subclasses and non str keys go through jsons
+    assert _default_serializer({1: np.float64(2.5)}) == '{"1":"2.5"}'
+
+    # not native: only the class information is kept
+    serialized = _default_serializer(Point(1.5, [Point(2, [])]))
+    assert "\n" not in serialized
+    assert "dump_time" not in serialized
+    assert deserialize(serialized) == Point(1.5, [Point(2, [])])
+
+
+def test_prettify_json(tmp_path):
+    from functionsaver import prettify_json
+    from functionsaver.serializers import _default_serializer
+
+    capture = tmp_path / "function" / "capture" / "inputs"
+    capture.mkdir(parents=True)
+    (capture / "point.json").write_text(_default_serializer(Point(1.5, [])))
+    (capture / "a.json").write_text("1")
+    linked = tmp_path / "blob.json"
+    os.link(capture / "point.json", linked)
+
+    assert prettify_json(tmp_path / "function") == 1
+    assert prettify_json(tmp_path / "function") == 0
+    assert '\n  "x": 1.5,\n' in (capture / "point.json").read_text()
+    # a hard linked file (deduplicated) is not modified through the capture
+    assert "\n" not in linked.read_text()
@@ -0,0 +1,75 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+from functionsaver import function_saver, replay_and_check_function, flush_background_writes
+from functionsaver.snapshot import snapshot
+from conftest import update_settings_with_env
+from utils_for_tests import get_data_folders_from_function_saver_root
+
+
+@dataclass
+class Frame:
+    image: np.ndarray
+    labels: list
+
+
+def test_snapshot_by_type():
+    array = np.arange(10)
+    read_only = np.arange(10)
+    read_only.flags.writeable = False
+    frame = Frame(array, ["a"])
+    value = {"array": array, "read_only": read_only, "frame": frame, "constants": (1, "b", None), "items": [array]}
+    copied = snapshot(value)
+
+    assert copied["array"] is not array and np.array_equal(copied["array"], array)
+    assert copied["read_only"] is read_only
+    assert copied["constants"] is value["constants"]
+    assert copied["frame"] is not frame and copied["frame"].labels == ["a"]
+    # referenced several times: copied once
+    assert copied["items"][0] is copied["array"]
+    assert copied["frame"].image is copied["array"]
+
+    # a list containing itself
+    recursive = [1]
+    recursive.append(recursive)
+    copied_recursive = snapshot(recursive)
+    assert copied_recursive[1] is copied_recursive
+
+    # not copyable: kept as is
+    lock = threading.Lock()
+    assert snapshot(lock) is lock
+
+
+@function_saver
+def function_modifying_inputs(image: np.ndarray, frame: Frame) -> int:
+    image[:] = 0
+    frame.labels.append("modified")
+    return len(frame.labels)
+
+
+@pytest.mark.parametrize("background", ["0", "1"])
+def test_inputs_saved_before_the_call(reset_environment, fonctionsaver_in_tempfolder, background):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_BACKGROUND": background})
+    image = np.ones(100)
+    assert function_modifying_inputs(image, Frame(np.arange(3), ["a"])) == 2
+    flush_background_writes()
+
+    data_folders = get_data_folders_from_function_saver_root(temp_folder)[0]
+    assert np.array_equal(np.load(data_folders.input_path / "image.npy"), np.ones(100))
+    assert replay_and_check_function(function_modifying_inputs, data_folders.function_saver_path) == 2
+    assert function_modifying_inputs.snapshot_stats.count >= 1
+
+
+def test_snapshot_disabled(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_SNAPSHOT_FUNCTION_MODIFYING_INPUTS": "0"})
+    count = function_modifying_inputs.snapshot_stats.count
+    function_modifying_inputs(np.ones(100), Frame(np.arange(3), ["a"]))
+
+    data_folders = get_data_folders_from_function_saver_root(temp_folder)[0]
+    assert np.array_equal(np.load(data_folders.input_path / "image.npy"), np.zeros(100))
+    assert function_modifying_inputs.snapshot_stats.count == count
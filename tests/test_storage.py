@@ -0,0 +1,288 @@
+import io
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from functionsaver import (
+    function_saver,
+    flush_background_writes,
+    list_segment_captures,
+    replay_and_check_function,
+    replay_function,
+)
+from functionsaver.function_saver import replay_and_check_function_async
+from functionsaver.jsons_numpy import collecting_sidecar_arrays
+from functionsaver.segment_log import SegmentLog, read_record_header, record_offset
+from functionsaver.serializers import _default_serializer
+from functionsaver.storage import open_capture, SegmentCaptureWriter, ZipCaptureReader
+from conftest import update_settings_with_env
+
+replayed_internals = []
+
+
+@function_saver
+def function_to_zip(a: int, image: np.ndarray) -> int:
+    if function_to_zip.is_save_internal_enabled():
+        replayed_internals.append(a)
+    function_to_zip.save_internal(a * 2, "doubled")
+    return a + int(image.sum())
+
+
+@function_saver
+async def async_function_to_zip(a: int, b: int) -> int:
+    await async_function_to_zip.save_internal_async(a - b, "subtracted")
+    return a + b
+
+
+def get_zip_captures(temp_folder) -> list[Path]:
+    return sorted(Path(temp_folder).glob("*.zip"))
+
+
+def test_zip_capture(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "zip"})
+    assert function_to_zip(3, np.ones((4, 4), dtype=np.uint8)) == 19
+
+    captures = get_zip_captures(temp_folder)
+    assert len(captures) == 1
+    assert not [path for path in Path(temp_folder).iterdir() if path.is_dir()]
+    with zipfile.ZipFile(captures[0]) as zip_file:
+        names = set(zip_file.namelist())
+    assert {"inputs/a.json", "inputs/image.npy", "output/output.json", "internal/doubled.json"} <= names
+
+    # random access to one argument
+    capture = open_capture(captures[0])
+    assert isinstance(capture, ZipCaptureReader)
+    assert capture.find("inputs", "image") == ["image.npy"]
+    assert capture.read("inputs", "a.json", "r") == "3"
+
+    replayed_internals.clear()
+    assert replay_and_check_function(function_to_zip, captures[0]) == 19
+    assert replayed_internals == [3]
+    # the replay writes next to the zip
+    replay_folder = captures[0].with_name(captures[0].stem + "_replay")
+    assert (replay_folder / "output_replay" / "output.json").read_text() == "19"
+    assert (replay_folder / "internal_replay" / "doubled.json").read_text() == "6"
+
+
+@function_saver
+def function_modifying_internal(a: int) -> int:
+    internal = np.full(3, a)
+    function_modifying_internal.save_internal(internal, "internal")
+    internal[:] = 0
+    return a
+
+
+@pytest.mark.parametrize("storage", ["zip", "segment"])
+def test_internal_serialized_when_saved(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    function_modifying_internal(7)
+    if storage == "zip":
+        capture = open_capture(get_zip_captures(fonctionsaver_in_tempfolder)[0])
+    else:
+        capture = open_capture(list_segment_captures("function_modifying_internal", fonctionsaver_in_tempfolder)[0])
+    # the value when save_internal was called, not after the call
+    assert np.load(io.BytesIO(capture.read("internal", "internal.npy", "rb"))).tolist() == [7, 7, 7]
+    assert capture.manifest[("internal", "internal.npy")]["type"] == "numpy.ndarray"
+
+
+def test_zip_capture_background(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "zip", "FUNCTION_SAVER_BACKGROUND": "1"})
+    for i in range(3):
+        function_to_zip(i, np.zeros(2))
+    flush_background_writes()
+    captures = get_zip_captures(temp_folder)
+    assert len(captures) == 3
+    assert sorted(replay_function(function_to_zip, capture) for capture in captures) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_zip_capture_async(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "zip"})
+    assert await async_function_to_zip(5, 2) == 7
+    captures = get_zip_captures(temp_folder)
+    assert len(captures) == 1
+    assert open_capture(captures[0]).read("internal", "subtracted.json", "r") == "3"
+    assert await replay_and_check_function_async(async_function_to_zip, captures[0]) == 7
+
+
+def test_zip_capture_retention(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "zip", "FUNCTION_SAVER_MAX_CAPTURES": "2"})
+    for i in range(4):
+        function_to_zip(i, np.zeros(2))
+    assert len(get_zip_captures(temp_folder)) == 2
+
+
+def test_open_capture_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError, match="No capture found"):
+        open_capture(tmp_path / "missing")
+
+
+def test_segment_log(reset_environment, fonctionsaver_in_tempfolder):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "segment", "FUNCTION_SAVER_SEGMENT_MAX_BYTES": "1K"})
+    for i in range(20):
+        function_to_zip(i, np.zeros(10, dtype=np.uint8))
+
+    segments_folder = Path(temp_folder) / "function_to_zip.segments"
+    assert [path for path in Path(temp_folder).iterdir()] == [segments_folder]
+    assert len(list(segments_folder.glob("*.seg"))) > 1  # rotated by size
+    capture_ids = list_segment_captures("function_to_zip")
+    assert len(capture_ids) == 20
+
+    replayed_internals.clear()
+    assert replay_and_check_function(function_to_zip, capture_ids[7]) == 7
+    assert replayed_internals == [7]
+
+    # the same capture, by (segment, offset)
+    segment, record_number = capture_ids[7].rsplit("#", 1)
+    offset = record_offset(Path(segment), int(record_number))
+    capture = open_capture((segment, offset))
+    assert capture.read("internal", "doubled.json", "r") == "14"
+    assert replay_function(function_to_zip, (segment, offset)) == 7
+
+
+def test_segment_log_concurrent_records(tmp_path):
+    segment_log = SegmentLog(tmp_path, max_bytes=1 << 20)
+    first, second = segment_log.begin(), segment_log.begin()
+    first.write(b"first")
+    second.write(memoryview(np.arange(4, dtype=np.int64)))
+    assert second.data_size == 32
+    first.write(b" record")
+    capture_ids = [record.finish(b"{}") for record in (second, first)]
+    segment_log.close()
+
+    # written at the same time: in two segments
+    assert len({capture_id.rpartition("#")[0] for capture_id in capture_ids}) == 2
+    for capture_id, expected_data in zip(capture_ids, [np.arange(4, dtype=np.int64).tobytes(), b"first record"]):
+        segment, record_number = capture_id.rsplit("#", 1)
+        header, data_offset = read_record_header(Path(segment), record_offset(Path(segment), int(record_number)))
+        assert header == b"{}"
+        with open(segment, "rb") as f:
+            f.seek(data_offset)
+            assert f.read(len(expected_data)) == expected_data
+
+
+def test_segment_failed_entry(reset_environment, fonctionsaver_in_tempfolder):
+    writer = SegmentCaptureWriter(Path(fonctionsaver_in_tempfolder) / "function.segments" / "capture", ["inputs"])
+    writer.write("inputs", "a.json", "1")
+
+    def failing_chunks():
+        yield b"partial"
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        writer.write_chunks("inputs", "b.npy", failing_chunks())
+    writer.write_chunks("inputs", "c.npy", [b"c", b" data"])
+    writer.close()
+
+    # the data of the failed entry is in the record, not the entry
+    capture = open_capture(writer.capture_id)
+    assert capture.find("inputs", "b") == []
+    assert capture.read("inputs", "a.json", "r") == "1"
+    assert capture.read("inputs", "c.npy", "rb") == b"c data"
+
+
+def test_segment_with_quota(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": "segment", "FUNCTION_SAVER_MAX_CAPTURES": "2"})
+    for i in range(3):
+        function_to_zip(i, np.zeros(2))
+    # the quota is not supported by the segments: the captures are saved in folders, within the quota
+    assert not list_segment_captures("function_to_zip")
+    assert len([path for path in Path(fonctionsaver_in_tempfolder).iterdir() if path.is_dir()]) == 2
+
+
+replayed_images = []
+
+
+@function_saver
+def function_modifying_image(image: np.ndarray) -> int:
+    replayed_images.append(image)
+    image[0, 0] = 255
+    return int(image.sum())
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_replay_maps_arrays(reset_environment, fonctionsaver_in_tempfolder, storage):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    assert function_modifying_image(image.copy()) == 255 + 66
+    if storage == "segment":
+        capture = list_segment_captures("function_modifying_image")[0]
+    else:
+        capture = next(Path(temp_folder).iterdir())
+
+    # copy on write (default): the function can modify the input, the capture is not modified
+    replayed_images.clear()
+    assert replay_and_check_function(function_modifying_image, capture) == 255 + 66
+    assert isinstance(replayed_images[0], np.memmap)
+    assert replay_function(function_modifying_image, capture) == 255 + 66
+
+    # read only
+    with pytest.raises(ValueError, match="read-only"):
+        replay_function(function_modifying_image, capture, mmap_mode="r")
+
+    # read in memory
+    replayed_images.clear()
+    replay_function(function_modifying_image, capture, mmap_mode=None)
+    assert not isinstance(replayed_images[0], np.memmap)
+
+    with pytest.raises(ValueError, match="Invalid mmap_mode"):
+        replay_function(function_modifying_image, capture, mmap_mode="w+")
+
+
+@dataclass
+class Acquisition:
+    image: np.ndarray
+    settings: dict
+
+
+replayed_acquisitions = []
+
+
+@function_saver
+def function_with_acquisition(acquisition: Acquisition) -> Acquisition:
+    replayed_acquisitions.append(acquisition)
+    return Acquisition(acquisition.image > 2, {"sum": int(acquisition.image.sum())})
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_nested_arrays_sidecars(reset_environment, fonctionsaver_in_tempfolder, storage):
+    temp_folder = fonctionsaver_in_tempfolder
+    update_settings_with_env({"FUNCTION_SAVER_STORAGE": storage})
+    image = np.arange(40_000, dtype=np.uint16).reshape(200, 200)
+    expected = function_with_acquisition(Acquisition(image, {"exposure": 1.5}))
+    if storage == "segment":
+        capture = list_segment_captures("function_with_acquisition")[0]
+    else:
+        capture = next(Path(temp_folder).iterdir())
+
+    # the large arrays are written to their own .npy entries
+    reader = open_capture(capture)
+    assert reader.find("inputs", "acquisition") == ["acquisition.json"]
+    assert reader.find("inputs", "acquisition#0") == ["acquisition#0.npy"]
+    assert reader.find("output", "output#0") == ["output#0.npy"]
+    assert reader.find("output", "output#1") == []
+    assert len(reader.read("inputs", "acquisition.json", "r")) < 1000
+
+    replayed_acquisitions.clear()
+    output = replay_and_check_function(
+        function_with_acquisition, capture, lambda x, y: np.array_equal(x.image, y.image) and x.settings == y.settings
+    )
+    assert np.array_equal(output.image, expected.image)
+    assert isinstance(replayed_acquisitions[0].image, np.memmap)
+    assert np.array_equal(replayed_acquisitions[0].image, image)
+    assert replayed_acquisitions[0].settings == {"exposure": 1.5}
+
+    # the small arrays, and the arrays serialized out of a capture, are embedded in the json
+    with collecting_sidecar_arrays() as arrays:
+        assert "__numpy__" in _default_serializer(Acquisition(np.arange(3), {}))
+    assert arrays == []
+    assert "__numpy__" in _default_serializer(Acquisition(image, {}))
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from functionsaver import find_captures, function_saver, latency_histograms, read_capture_metadata
+from functionsaver.timing import LatencyHistogram, _bucket, _bucket_bounds
+from conftest import update_settings_with_env
+
+
+@function_saver
+def function_to_time(x: int, table: np.ndarray) -> float:
+    return x + float(table.sum())
+
+
+@function_saver
+async def async_function_to_time(x: int) -> int:
+    await asyncio.sleep(0)
+    return x + 1
+
+
+def test_latency_histogram():
+    for duration in [0, 1, 3, 4, 5, 7, 8, 1000, 123456789, 2**40 + 12345]:
+        lower, upper = _bucket_bounds(_bucket(duration))
+        assert lower <= duration < upper
+
+    histogram = LatencyHistogram("histogram")
+    threads = [
+        threading.Thread(target=lambda: [histogram.record(1_000_000) for _ in range(90)]),
+        threading.Thread(target=lambda: [histogram.record(100_000_000) for _ in range(10)]),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = histogram.summary()
+    assert summary["count"] == histogram.count == 100
+    assert summary["total"] == pytest.approx(90 * 0.001 + 10 * 0.1)
+    # log-linear buckets: less than 25% of error
+    assert summary["p50"] == pytest.approx(0.001, rel=0.25)
+    assert summary["p99"] == pytest.approx(0.1, rel=0.25)
+    assert sum(count for _, count in histogram.buckets()) == 100
+    histogram.reset()
+    assert histogram.count == 0 and histogram.percentile(0.5) == 0.0
+
+
+@pytest.mark.parametrize("storage", ["directory", "zip", "segment"])
+def test_timing_in_metadata(reset_environment, fonctionsaver_in_tempfolder, storage):
+    update_settings_with_env({"FUNCTION_SAVER_CATALOG": "1", "FUNCTION_SAVER_STORAGE": storage})
+    function_to_time(1, np.ones(10))
+
+    capture = find_captures("function_to_time")[0]
+    timing = read_capture_metadata(capture.capture_id)["timing"]
+    assert set(timing) == {"wall", "cpu", "snapshot", "serialization", "io"}
+    assert all(duration >= 0 for duration in timing.values())
+    assert timing["wall"] == capture.call_duration
+
+
+def test_async_timing_in_metadata(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_CATALOG": "1"})
+    assert asyncio.run(async_function_to_time(1)) == 2
+
+    capture = find_captures("async_function_to_time")[0]
+    timing = read_capture_metadata(capture.capture_id)["timing"]
+    assert timing["wall"] >= 0 and timing["cpu"] is None
+
+
+def test_latency_of_calls_not_captured(reset_environment, fonctionsaver_in_tempfolder):
+    update_settings_with_env({"FUNCTION_SAVER_ALL": "0"})
+    assert latency_histograms()["test_timing.function_to_time"] is function_to_time.latency
+    count = function_to_time.latency.count
+    for x in range(5):
+        function_to_time(x, np.ones(2))
+    assert function_to_time.latency.count == count + 5
+    assert os.listdir(fonctionsaver_in_tempfolder) == []